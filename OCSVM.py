@@ -2,42 +2,114 @@ import numpy as np
 #OCSVM.py
 
 from sklearn.svm import OneClassSVM
-from pymongo import MongoClient
+from sklearn.linear_model import SGDOneClassSVM
+from sklearn.kernel_approximation import Nystroem, RBFSampler
 from bson.objectid import ObjectId
+import repository
 
-# Connect to the MongoDB server
-client = MongoClient("mongodb://localhost:27017/")
+NU = 0.05  # Upper bound on the fraction of points treated as outliers
+BACKENDS = ('exact', 'nystroem', 'rff')
 
-# Select the database and collection
-db = client['HRMonitoring']
-users_collection = db['Users']
 
-def detect_anomalies_ocsvm(user_id):
+class ApproximateOneClassSVM:
+    """OC-SVM with an approximated RBF kernel: Nystroem or random Fourier features feeding a linear SGD one-class SVM.
+
+    Fitting is linear in the number of points and partial_fit takes mini-batches,
+    so months of history or the whole population can be streamed through it.
+    gamma='scale' picks the same kernel width OneClassSVM would, from the first batch.
+    """
+
+    def __init__(self, nu=NU, method='nystroem', n_components=300, gamma='scale', batch_size=4096, n_epochs=5,
+                 random_state=42):
+        if method not in ('nystroem', 'rff'):
+            raise ValueError(f"Unknown kernel approximation: {method}")
+        self.nu = nu
+        self.method = method
+        self.n_components = n_components
+        self.gamma = gamma
+        self.batch_size = batch_size
+        self.n_epochs = n_epochs
+        self.random_state = random_state
+        self.feature_map = None
+        self.sgd = SGDOneClassSVM(nu=nu, random_state=random_state)
+
+    def _init_feature_map(self, X):
+        gamma = self.gamma
+        if gamma == 'scale':
+            variance = X.var()
+            gamma = 1.0 / (X.shape[1] * variance) if variance > 0 else 1.0
+        if self.method == 'nystroem':
+            n_components = min(self.n_components, len(X))
+            self.feature_map = Nystroem(gamma=gamma, n_components=n_components, random_state=self.random_state)
+        else:
+            self.feature_map = RBFSampler(gamma=gamma, n_components=self.n_components, random_state=self.random_state)
+        self.feature_map.fit(X)
+
+    def partial_fit(self, X):
+        """Update the model with one mini-batch; the first batch also fixes the kernel approximation."""
+        X = np.asarray(X, dtype=np.float64)
+        if self.feature_map is None:
+            self._init_feature_map(X)
+        self.sgd.partial_fit(self.feature_map.transform(X))
+        return self
+
+    def fit(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        rng = np.random.default_rng(self.random_state)
+        # Landmarks and kernel width come from a sample, not the whole data set
+        sample = X[rng.choice(len(X), min(len(X), max(self.n_components * 10, self.batch_size)), replace=False)]
+        self._init_feature_map(sample)
+        self.sgd = SGDOneClassSVM(nu=self.nu, random_state=self.random_state)
+        for _ in range(self.n_epochs):
+            order = rng.permutation(len(X))
+            for start in range(0, len(X), self.batch_size):
+                self.sgd.partial_fit(self.feature_map.transform(X[order[start:start + self.batch_size]]))
+        return self
+
+    def decision_function(self, X):
+        return self.sgd.decision_function(self.feature_map.transform(np.asarray(X, dtype=np.float64)))
+
+    def score_samples(self, X):
+        return self.sgd.score_samples(self.feature_map.transform(np.asarray(X, dtype=np.float64)))
+
+    def predict(self, X):
+        return self.sgd.predict(self.feature_map.transform(np.asarray(X, dtype=np.float64)))
+
+
+def make_ocsvm(backend='exact', nu=NU, **kwargs):
+    """An unfitted OC-SVM: 'exact' (libsvm, O(n^2) or worse to fit) or the 'nystroem' / 'rff' approximations."""
+    if backend == 'exact':
+        return OneClassSVM(nu=nu, **kwargs)
+    if backend in ('nystroem', 'rff'):
+        return ApproximateOneClassSVM(nu=nu, method=backend, **kwargs)
+    raise ValueError(f"Unknown OC-SVM backend: {backend}")
+
+
+def ocsvm_scores(X, nu=NU, backend='exact'):
+    """Fit an OC-SVM on the rows of X; returns (is_anomaly, score), higher score = more anomalous."""
+    ocsvm = make_ocsvm(backend, nu)
+    ocsvm.fit(X)
+    return ocsvm.predict(X) == -1, -ocsvm.decision_function(X)
+
+
+def detect_anomalies_ocsvm(user_id, backend='exact'):
     # Fetch heart rate data
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
-    if not user:
+    series = repository.find_hr_series(ObjectId(user_id))
+    if series is None:
         print("User not found.")
         return
 
-    hr_times = []
-    hr_values = []
-    for key in user:
-        if key.startswith("HR at"):
-            hr_times.append(key)
-            hr_values.append(user[key])
+    hr_times = series.keys()
+    hr_values = series.present_values()
 
     # Prepare data for OC-SVM (using only heart rate values)
     X = np.array(hr_values).reshape(-1, 1)
 
-    # Train OC-SVM model
-    ocsvm = OneClassSVM(nu=0.05)  # Adjust nu parameter as needed
-    ocsvm.fit(X)
-
-    # Predict outliers (anomalies)
-    outliers = ocsvm.predict(X)
-    anomaly_indices = np.where(outliers == -1)[0]
+    # Train OC-SVM model and predict outliers (anomalies)
+    is_anomaly, _ = ocsvm_scores(X, backend=backend)
+    anomaly_indices = np.where(is_anomaly)[0]
 
     # Print anomalies
     print("OCSVM:\nAnomalies detected:")
     for idx in anomaly_indices:
-        print(f"At time {hr_times[idx]}: Heart rate {hr_values[idx]}")
+        print(f"At time {hr_times[idx]}: Heart rate {hr_values[idx]:g}")
@@ -0,0 +1,87 @@
+import asyncio
+import functools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# analysis_service.py
+# Runs CPU-bound model fitting (ARIMA, Isolation Forest, OC-SVM) in a worker
+# pool so the toga event loop only awaits results. Jobs are grouped by owner
+# (the user they were started for) so switching users cancels stale work.
+
+
+class AnalysisService:
+    """Executor-backed job runner that the app submits analysis work to and awaits."""
+
+    def __init__(self, max_workers=2, executor=None):
+        # Threads by default: jobs share the pooled Mongo client and in-memory
+        # model caches, and numpy/sklearn/statsmodels release the GIL in their
+        # heavy loops. Pass a ProcessPoolExecutor for fully isolated jobs.
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis')
+        self._jobs = defaultdict(set)
+
+    def submit(self, owner, fn, *args, **kwargs):
+        """Start fn(*args, **kwargs) in the pool and return an awaitable asyncio future."""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        self._jobs[owner].add(future)
+        future.add_done_callback(lambda f: self._forget(owner, f))
+        return future
+
+    def _forget(self, owner, future):
+        jobs = self._jobs.get(owner)
+        if jobs is not None:
+            jobs.discard(future)
+            if not jobs:
+                del self._jobs[owner]
+        if future.cancelled():
+            print(f"Analysis job for {owner} was cancelled.")
+        elif future.exception() is not None:
+            print(f"Analysis job for {owner} failed: {future.exception()}")
+
+    async def run_all(self, owner, jobs, progress=None):
+        """Run (name, fn, *args) jobs concurrently and return {name: result}.
+
+        `progress(done, total, name)` is called on the event loop as each job
+        finishes. A job that raised maps to its exception instead of a result.
+        """
+        futures = {self.submit(owner, fn, *args): name for name, fn, *args in jobs}
+        results = {}
+        if progress is not None:
+            progress(0, len(futures), None)
+        done_count = 0
+        pending = set(futures)
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                done_count += 1
+                name = futures[future]
+                results[name] = future.exception() or future.result()
+                if progress is not None:
+                    progress(done_count, len(futures), name)
+        return results
+
+    def pending(self, owner=None):
+        """Number of queued or running jobs, for one owner or overall."""
+        if owner is not None:
+            return len(self._jobs.get(owner, ()))
+        return sum(len(jobs) for jobs in self._jobs.values())
+
+    def cancel(self, owner):
+        """Cancel an owner's jobs. Queued jobs never start; running ones finish but are discarded."""
+        for future in list(self._jobs.get(owner, ())):
+            future.cancel()
+
+    def cancel_others(self, owner, keep=()):
+        """Cancel every job not started for `owner` (e.g. after the user name changed).
+
+        Owners in `keep` are not tied to a user (such as the population
+        dashboard) and are left running.
+        """
+        for other in list(self._jobs):
+            if other != owner and other not in keep:
+                self.cancel(other)
+
+    def shutdown(self):
+        for owner in list(self._jobs):
+            self.cancel(owner)
+        self._executor.shutdown(wait=False, cancel_futures=True)
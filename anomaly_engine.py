@@ -0,0 +1,151 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from bson.objectid import ObjectId
+from sklearn.preprocessing import StandardScaler
+from hr_series import HrSeries, SLOT_KEYS, SLOTS_PER_DAY
+from IsolationForests import isolation_forest_scores
+from OCSVM import ocsvm_scores
+import repository
+
+# anomaly_engine.py
+# Per-user anomaly detection. The user's week of heart rates is loaded once
+# and turned into one feature matrix (value, time of day, day of week and the
+# change from the neighbouring measurements) that every detector shares. The
+# detectors run concurrently and return structured results instead of printing.
+
+FEATURE_NAMES = ('value', 'tod_sin', 'tod_cos', 'day_of_week', 'delta_prev', 'delta_next')
+
+# name -> fn(X) returning (is_anomaly, score) with higher scores more anomalous
+DETECTORS = {
+    'Isolation Forest': isolation_forest_scores,
+    'OC-SVM': ocsvm_scores,
+}
+
+
+def build_features(series):
+    """Feature matrix with one row per measured slot of an HrSeries, in week order."""
+    slots = series.present_indices()
+    values = series.present_values().astype(np.float64)
+    minutes = (slots % SLOTS_PER_DAY) * 30.0
+    angle = 2 * np.pi * minutes / (24 * 60)  # Time of day on a circle, so 23:30 is next to 00:00
+    delta_prev = np.diff(values, prepend=values[:1])
+    delta_next = -np.diff(values[::-1], prepend=values[-1:])[::-1]
+    return np.column_stack([values, np.sin(angle), np.cos(angle), slots // SLOTS_PER_DAY, delta_prev, delta_next])
+
+
+def user_features(user):
+    """Load a user's series once and featurise it.
+
+    `user` is a user document with its HR fields, or an id to fetch one with.
+    Returns a dict with the slots, legacy keys, values, labels (when stored),
+    raw and standardized feature matrices, or None if the user is unknown.
+    """
+    if not isinstance(user, dict):
+        user = repository.find_user_with_series(ObjectId(user), include_labels=True)
+        if not user:
+            return None
+    series = HrSeries.from_document(user)
+    slots = series.present_indices()
+    keys = [SLOT_KEYS[i] for i in slots]
+    features = build_features(series)
+    labels = None
+    if any(f"{key}_label" in user for key in keys):
+        labels = np.array([user.get(f"{key}_label", 1) for key in keys])
+    return {
+        'user_id': user.get('_id'),
+        'slots': slots,
+        'keys': keys,
+        'values': series.present_values(),
+        'labels': labels,
+        'features': features,
+        # Both detectors are distance/split based, so every feature gets the same scale
+        'X': StandardScaler().fit_transform(features) if len(features) else features,
+    }
+
+
+def anomaly_result(features, is_anomaly, scores):
+    """Structured result of one detector for the UI and batch jobs."""
+    indices = np.flatnonzero(is_anomaly)
+    result = {
+        'indices': indices,
+        'slots': features['slots'][indices],
+        'timestamps': [features['keys'][i] for i in indices],
+        'values': features['values'][indices],
+        'scores': np.asarray(scores, dtype=np.float64),
+        'accuracy': None,
+    }
+    if features['labels'] is not None:
+        result['accuracy'] = float(np.mean(features['labels'] == is_anomaly.astype(int)))
+    return result
+
+
+def run_detectors(features, detectors=None, executor=None):
+    """Run detectors concurrently on the shared features; returns {name: result or exception}."""
+    detectors = detectors or DETECTORS
+    if not len(features['X']):
+        return {name: anomaly_result(features, np.zeros(0, dtype=bool), np.zeros(0)) for name in detectors}
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=len(detectors), thread_name_prefix='anomaly')
+    try:
+        futures = {name: executor.submit(fn, features['X']) for name, fn in detectors.items()}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = anomaly_result(features, *future.result())
+            except Exception as e:
+                results[name] = e
+        return results
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+
+def score_with_models(features, models):
+    """Score a user with pre-trained models ({name: {'scaler', 'model'}}) from the model registry.
+
+    Only predicts, so it is cheap enough to run inline; scores are positive
+    beyond each model's decision threshold.
+    """
+    results = {}
+    for name, entry in models.items():
+        if not len(features['features']):
+            results[name] = anomaly_result(features, np.zeros(0, dtype=bool), np.zeros(0))
+            continue
+        X = entry['scaler'].transform(features['features'])
+        scores = -entry['model'].decision_function(X)
+        results[name] = anomaly_result(features, entry['model'].predict(X) == -1, scores)
+    return results
+
+
+def detect_user_anomalies(user, detectors=None, executor=None, registry=None):
+    """Load, featurise and score one user; None if the user is unknown.
+
+    With a ModelRegistry the user's cohort models are used when they exist;
+    otherwise every detector is fitted on the user's own series.
+    """
+    features = user_features(user)
+    if features is None:
+        return None
+    if registry is not None:
+        user_doc = user if isinstance(user, dict) else repository.find_profile(ObjectId(user))
+        _, models = registry.models_for(user_doc or {})
+        if models is not None:
+            return score_with_models(features, models)
+    return run_detectors(features, detectors, executor)
+
+
+def print_anomalies(results):
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            print(f"{name}: failed ({result})")
+            continue
+        if result['accuracy'] is not None:
+            print(f"{name} accuracy: {result['accuracy']:.2f}")
+        if len(result['indices']):
+            print(f"{name}:\nAnomalies detected at the following times:")
+            for timestamp, value in zip(result['timestamps'], result['values']):
+                print(f"{timestamp}: {value:g}")
+        else:
+            print(f"{name}: No anomalies detected.")
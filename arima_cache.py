@@ -0,0 +1,133 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from arima_model2 import fit_arima_model
+
+# arima_cache.py
+# Per-user cache of fitted ARIMA models. A new observation extends the cached
+# model's state (results.append with refit=False) instead of refitting from
+# scratch. A full refit only happens every `refit_every` observations or when
+# the one-step-ahead error shows the fit has drifted.
+
+
+class ArimaModelCache:
+    """LRU cache of fitted ARIMA results per user, persisted to disk."""
+
+    def __init__(self, capacity=128, cache_dir='arima_models', refit_every=48, drift_threshold=4.0,
+                 max_history=336 * 4):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.refit_every = refit_every  # observations appended before a scheduled refit (48 = one day)
+        self.drift_threshold = drift_threshold  # one-step error, in residual standard deviations
+        self.max_history = max_history  # observations kept when refitting
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()  # Guards the LRU only; used from the event loop and analysis workers
+        # Per-user locks (striped, so their number stays fixed) serialize fits and updates of one user
+        # while other users' lookups and fits go ahead
+        self._key_locks = [threading.RLock() for _ in range(64)]
+
+    def _key_lock(self, user_key):
+        return self._key_locks[hash(user_key) % len(self._key_locks)]
+
+    def _path(self, user_key):
+        digest = hashlib.sha1(str(user_key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.pkl")
+
+    def _load(self, user_key):
+        try:
+            with open(self._path(user_key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _save(self, user_key, entry):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(user_key)
+        # Write then rename so a crash never leaves a half-written model behind
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def _remember(self, user_key, entry):
+        self._entries[user_key] = entry
+        self._entries.move_to_end(user_key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)  # Still on disk, reloaded on next use
+
+    def get(self, user_key):
+        """Cached entry from memory or disk, or None."""
+        with self._lock:
+            entry = self._entries.get(user_key)
+            if entry is not None:
+                self._entries.move_to_end(user_key)
+                return entry
+            entry = self._load(user_key)
+            if entry is not None:
+                self._remember(user_key, entry)
+            return entry
+
+    def fit(self, user_key, values):
+        """Fully fit a model on `values` and cache it."""
+        with self._key_lock(user_key):
+            values = np.asarray(values, dtype=float)[-self.max_history:]
+            # The slow MLE fit runs without the LRU lock, so lookups for other users are not blocked
+            entry = {'fit': fit_arima_model(values), 'appended': 0, 'fitted_at': time.time()}
+            with self._lock:
+                self._remember(user_key, entry)
+            self._save(user_key, entry)
+            return entry['fit']
+
+    def get_or_fit(self, user_key, values):
+        """The cached model for a user, fitting one on `values` if there is none."""
+        entry = self.get(user_key)
+        if entry is not None:
+            return entry['fit']
+        with self._key_lock(user_key):
+            # A concurrent caller may have fitted the model while this one waited
+            entry = self.get(user_key)
+            if entry is not None:
+                return entry['fit']
+            return self.fit(user_key, values)
+
+    def _drifted(self, model_fit, observation):
+        predicted = float(np.asarray(model_fit.forecast(steps=1))[0])
+        sigma2 = float(np.asarray(model_fit.params)[model_fit.model.param_names.index('sigma2')])
+        return abs(observation - predicted) > self.drift_threshold * np.sqrt(max(sigma2, 1e-9))
+
+    def update(self, user_key, new_values):
+        """Extend a user's cached model with newly measured values.
+
+        Returns the updated results, or None when the user has no cached model
+        (the next get_or_fit fits one from the stored history).
+        """
+        with self._key_lock(user_key):
+            entry = self.get(user_key)
+            if entry is None:
+                return None
+            new_values = np.atleast_1d(np.asarray(new_values, dtype=float))
+            model_fit = entry['fit']
+            appended = entry['appended'] + len(new_values)
+
+            if appended >= self.refit_every or self._drifted(model_fit, new_values[0]):
+                history = np.concatenate([np.asarray(model_fit.model.endog, dtype=float).ravel(), new_values])
+                return self.fit(user_key, history)
+
+            # Kalman filter state update with the already estimated parameters; no MLE
+            entry = {'fit': model_fit.append(new_values, refit=False), 'appended': appended,
+                     'fitted_at': entry['fitted_at']}
+            with self._lock:
+                self._remember(user_key, entry)
+            self._save(user_key, entry)
+            return entry['fit']
+
+    def invalidate(self, user_key):
+        with self._key_lock(user_key), self._lock:
+            self._entries.pop(user_key, None)
+            try:
+                os.remove(self._path(user_key))
+            except OSError:
+                pass
@@ -1,25 +1,21 @@
 import pandas as pd
 from statsmodels.tsa.arima.model import ARIMA
-import matplotlib.pyplot as plt
-from pymongo import MongoClient
 import numpy as np
 import random
 from datetime import datetime
-
-# Connect to MongoDB
-client = MongoClient("mongodb://localhost:27017/")
-db = client['HRMonitoring']
-users_collection = db['Users']
+from pymongo import UpdateOne
+from hr_series import HrSeries, KEY_TO_INDEX, slot_index, slot_key
+import repository
+import population_stats
+from render_service import render_png
 
 def get_user_data(user_name):
     """Retrieve HR data for the specified user."""
-    return users_collection.find_one({"Name": user_name})
+    return repository.find_user_with_series(user_name)
 
 def process_hr_data(hr_data):
-    """Process raw HR data into a time series starting from the current time rounded up to the nearest half-hour in 24-hour format."""
-    hr_series = pd.Series(list(hr_data.values()))
-    hr_series = pd.to_numeric(hr_series, errors='coerce')
-    hr_series.dropna(inplace=True)
+    """Process raw HR data (an HrSeries or a dict of "HR at" keys) into a time series starting from the current time rounded up to the nearest half-hour in 24-hour format."""
+    hr_series = pd.Series(HrSeries.coerce(hr_data).present_values().astype(float))
     
     # Get the current time
     now = pd.Timestamp.now()
@@ -40,7 +36,7 @@ def process_hr_data(hr_data):
     start_time = rounded_time
     
     # Generate a date range with a frequency of 30 minutes
-    hr_series.index = pd.date_range(start=start_time, periods=len(hr_series), freq='30T')
+    hr_series.index = pd.date_range(start=start_time, periods=len(hr_series), freq='30min')
     
     return hr_series
 
@@ -58,14 +54,11 @@ def generate_forecast(model_fit, steps):
 
 def create_forecast_series(forecast, hr_series, forecast_steps):
     """Create a pandas Series with forecasted HR values."""
-    forecast_index = pd.date_range(hr_series.index[-1] + pd.Timedelta(minutes=30), periods=forecast_steps, freq='30T')
+    forecast_index = pd.date_range(hr_series.index[-1] + pd.Timedelta(minutes=30), periods=forecast_steps, freq='30min')
     return pd.Series(forecast, index=forecast_index)
 
 
 
-import matplotlib.pyplot as plt
-import pandas as pd
-
 def plot_hr_and_forecast(hr_series, forecast_series, save_path="ARIMA_Background.png"):
     """Plot the original and forecasted HR data and save the plot as an image file."""
     
@@ -81,11 +74,11 @@ def plot_hr_and_forecast(hr_series, forecast_series, save_path="ARIMA_Background
     if isinstance(hr_series.index, pd.DatetimeIndex):
         time_labels_hr = hr_series.index.strftime('%H:%M')  # Format to hour and minute
     else:
-        time_labels_hr = pd.date_range(start='00:00', periods=len(hr_series), freq='30T').strftime('%H:%M')
+        time_labels_hr = pd.date_range(start='00:00', periods=len(hr_series), freq='30min').strftime('%H:%M')
     
     # Time labels for the forecast data, assuming it matches the length of the forecast_series
     forecast_start_time = hr_series.index[-1] + pd.DateOffset(minutes=30)
-    forecast_time_range = pd.date_range(start=forecast_start_time, periods=len(forecast_series), freq='30T')
+    forecast_time_range = pd.date_range(start=forecast_start_time, periods=len(forecast_series), freq='30min')
     time_labels_forecast = forecast_time_range.strftime('%H:%M')
     
     # Ensure forecast_series is trimmed to match the number of intervals
@@ -96,57 +89,110 @@ def plot_hr_and_forecast(hr_series, forecast_series, save_path="ARIMA_Background
     # Ensure both time labels lists are the same length
     common_time_labels = time_labels_hr  # Using hr_series time labels for consistency
     if len(common_time_labels) < len(forecast_time_range):
-        forecast_time_range = pd.date_range(start=forecast_start_time, periods=len(common_time_labels), freq='30T')
+        forecast_time_range = pd.date_range(start=forecast_start_time, periods=len(common_time_labels), freq='30min')
         time_labels_forecast = forecast_time_range.strftime('%H:%M')
     
-    plt.figure(figsize=(14, 6))
-    
-    plt.subplot(1, 2, 1)  # Original data plot
-    plt.plot(time_labels_hr, hr_series, label='Original HR Data', color='blue')
-    plt.title("Original Heart Rate Data")
-    plt.xlabel('Time')
-    plt.ylabel('Heart Rate (BPM)')
-    plt.xticks(rotation=45)  # Rotate x labels for better readability
-    plt.legend()
-    
-    plt.subplot(1, 2, 2)  # Forecasted data plot
-    plt.plot(time_labels_forecast, forecast_series, label='Forecasted HR', color='red')
-    plt.title("Forecasted Heart Rate Data")
-    plt.xlabel('Time')
-    plt.ylabel('Heart Rate (BPM)')
-    plt.xticks(rotation=45)  # Rotate x labels for better readability
-    plt.legend()
-    
-    plt.tight_layout()
+    # Drawn on a private Figure rather than through pyplot's global state, so it is safe in a worker thread
+    png = render_png(_draw_hr_and_forecast, (time_labels_hr, hr_series, time_labels_forecast, forecast_series),
+                     figsize=(14, 6))
     
     # Save the plot as a PNG file
-    plt.savefig(save_path)
-    plt.close()
-
-
-def update_user_with_forecast(user_name, forecast_series):
-    """Update the MongoDB database with forecasted HR values."""
-    for time, forecast_value in forecast_series.items():
-        hr_key = f"HR at {time.strftime('%H:%M (%A)')}"
-        print(f"Updating database: {hr_key} = {forecast_value:.2f}")
-        users_collection.update_one(
-            {"Name": user_name},
-            {"$set": {hr_key: int(forecast_value)}}
+    with open(save_path, 'wb') as f:
+        f.write(png)
+
+
+def _draw_hr_and_forecast(fig, data):
+    time_labels_hr, hr_series, time_labels_forecast, forecast_series = data
+    
+    ax = fig.add_subplot(1, 2, 1)  # Original data plot
+    ax.plot(time_labels_hr, hr_series, label='Original HR Data', color='blue')
+    ax.set_title("Original Heart Rate Data")
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Heart Rate (BPM)')
+    ax.tick_params(axis='x', labelrotation=45)  # Rotate x labels for better readability
+    ax.legend()
+    
+    ax = fig.add_subplot(1, 2, 2)  # Forecasted data plot
+    ax.plot(time_labels_forecast, forecast_series, label='Forecasted HR', color='red')
+    ax.set_title("Forecasted Heart Rate Data")
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Heart Rate (BPM)')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend()
+    
+    fig.tight_layout()
+
+
+def forecast_update(forecast_series):
+    """Build the $set document that writes a whole forecast in one update."""
+    return {slot_key(slot_index(time)): int(forecast_value) for time, forecast_value in forecast_series.items()}
+
+def update_user_with_forecast(user_name, forecast_series, user_data=None):
+    """Update the MongoDB database with forecasted HR values in a single round trip.
+
+    When the user's current document is given, the population_stats cache is
+    updated incrementally with the same values.
+    """
+    update = forecast_update(forecast_series)
+    repository.users_collection().update_one(
+        {"Name": user_name},
+        {"$set": update}
+    )
+    print(f"Database updated with {len(update)} forecasted HR values.")
+    if user_data is not None:
+        population_stats.record_slot_updates(
+            user_data,
+            HrSeries.from_document(user_data),
+            {KEY_TO_INDEX[key]: value for key, value in update.items()},
         )
-    print("Database updated with forecasted HR values.")
 
-def arima_forecast_for_user(user_name, forecast_steps):
-    """Main function to forecast HR data and update the database."""
+def bulk_update_forecasts(forecasts, user_docs=None, batch_size=1000):
+    """Persist forecasts for many users with unordered bulk writes, one $set per user.
+
+    `forecasts` is an iterable of (user, forecast_series) pairs where `user` is a
+    name or an ObjectId. `user_docs` optionally maps the same keys to the users'
+    current documents so the population_stats cache can be kept in step.
+    Returns the number of modified users.
+    """
+    modified = 0
+    operations = []
+    stats_updates = []
+    for user, forecast_series in forecasts:
+        update = forecast_update(forecast_series)
+        operations.append(UpdateOne(repository.user_query(user), {"$set": update}))
+        if user_docs is not None and user in user_docs:
+            stats_updates.append((user_docs[user], update))
+        if len(operations) >= batch_size:
+            modified += repository.users_collection().bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        modified += repository.users_collection().bulk_write(operations, ordered=False).modified_count
+
+    population_stats.record_many_slot_updates(
+        (user_data, HrSeries.from_document(user_data), {KEY_TO_INDEX[key]: value for key, value in update.items()})
+        for user_data, update in stats_updates
+    )
+    return modified
+
+def arima_forecast_for_user(user_name, forecast_steps, model_cache=None):
+    """Main function to forecast HR data and update the database.
+
+    With an ArimaModelCache the user's cached (state-updated) model is reused
+    and only fitted from scratch when there is none.
+    """
     user_data = get_user_data(user_name)
     if user_data:
-        hr_data = {key: value for key, value in user_data.items() if 'HR at' in key}
-        if hr_data:
+        hr_data = HrSeries.from_document(user_data)
+        if len(hr_data):
             hr_series = process_hr_data(hr_data)
-            model_fit = fit_arima_model(hr_series)
+            if model_cache is not None:
+                model_fit = model_cache.get_or_fit(user_name, hr_series.to_numpy())
+            else:
+                model_fit = fit_arima_model(hr_series)
             forecast = generate_forecast(model_fit, steps=forecast_steps)
-            forecast_series = create_forecast_series(forecast, hr_series, forecast_steps)
-            plot_hr_and_forecast(hr_series, forecast_series)
-            update_user_with_forecast(user_name, forecast_series)
+            forecast_series = create_forecast_series(np.asarray(forecast), hr_series, forecast_steps)
+            # No plot here: this runs in the analysis pool, and nothing reads a PNG written from the background
+            update_user_with_forecast(user_name, forecast_series, user_data)
         else:
             print("No heart rate data found for user.")
     else:
@@ -0,0 +1,112 @@
+import argparse
+import json
+import time
+import numpy as np
+from capture import frame_sample
+from bpm_estimator import estimate_bpm
+from frame_sources import SyntheticPpgSource, VideoFileSource
+
+# bpm_benchmark.py
+# Runs the capture-to-BPM pipeline offline over a corpus of recorded videos
+# and synthetic signals, as fast as the frames can be processed, and reports
+# frames/sec and BPM error against the known ground truth.
+#
+#   python bpm_benchmark.py --synthetic 20
+#   python bpm_benchmark.py --corpus corpus.json
+#
+# A corpus file is a JSON list of {"video": path, "bpm": 72} and
+# {"synthetic": {...SyntheticPpgSource arguments...}} entries.
+
+
+def run_pipeline(source, roi_fraction=0.5, step=4):
+    """Feed every frame of a source through ROI sampling and the BPM estimator."""
+    rows = []
+    started = time.perf_counter()
+    while True:
+        ok, frame, timestamp = source.read()
+        if not ok:
+            break
+        rows.append((timestamp, *frame_sample(frame, roi_fraction, step)))
+    capture_seconds = time.perf_counter() - started
+    source.release()
+
+    samples = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    bpm, confidence = estimate_bpm(samples[:, 0], samples[:, 1]) if len(samples) > 1 else (None, 0.0)
+    total_seconds = time.perf_counter() - started
+    return {
+        'frames': len(samples),
+        'frames_per_second': len(samples) / total_seconds if total_seconds > 0 else 0.0,
+        'capture_seconds': capture_seconds,
+        'estimate_seconds': total_seconds - capture_seconds,
+        'bpm': bpm,
+        'confidence': confidence,
+        'ground_truth_bpm': source.ground_truth_bpm,
+    }
+
+
+def synthetic_corpus(count, seed=0):
+    """Random synthetic recordings spanning resting to exercise heart rates and noise levels."""
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        yield f"synthetic-{i}", SyntheticPpgSource(
+            bpm=float(rng.uniform(50, 150)),
+            fps=float(rng.choice([30.0, 60.0])),
+            duration=float(rng.uniform(8, 20)),
+            noise=float(rng.uniform(0.5, 6.0)),
+            pulse_amplitude=float(rng.uniform(1.0, 3.0)),
+            motion_rate=float(rng.choice([0.0, 0.0, 0.1, 0.3])),
+            seed=int(rng.integers(1 << 31)),
+        )
+
+
+def corpus_from_file(path):
+    with open(path) as f:
+        entries = json.load(f)
+    for i, entry in enumerate(entries):
+        if 'video' in entry:
+            yield entry['video'], VideoFileSource(entry['video'], entry.get('bpm'))
+        else:
+            yield f"synthetic-{i}", SyntheticPpgSource(**entry.get('synthetic', {}))
+
+
+def run_benchmark(corpus):
+    results = []
+    for name, source in corpus:
+        result = run_pipeline(source)
+        truth = result['ground_truth_bpm']
+        error = None if result['bpm'] is None or truth is None else result['bpm'] - truth
+        result['error'] = error
+        results.append(result)
+        bpm_text = 'n/a' if result['bpm'] is None else f"{result['bpm']:.1f}"
+        truth_text = 'n/a' if truth is None else f"{truth:.1f}"
+        error_text = 'n/a' if error is None else f"{error:+.1f}"
+        print(f"{name}: {result['frames']} frames, {result['frames_per_second']:.0f} frames/s, "
+              f"BPM {bpm_text} (truth {truth_text}, error {error_text}, confidence {result['confidence']:.2f})")
+
+    errors = np.array([r['error'] for r in results if r['error'] is not None])
+    frames = sum(r['frames'] for r in results)
+    seconds = sum(r['capture_seconds'] + r['estimate_seconds'] for r in results)
+    print(f"\n{len(results)} recordings, {frames} frames at {frames / seconds if seconds else 0:.0f} frames/s overall")
+    if len(errors):
+        print(f"BPM error: MAE {np.abs(errors).mean():.2f}, RMSE {np.sqrt((errors ** 2).mean()):.2f}, "
+              f"within 5 BPM {np.mean(np.abs(errors) <= 5) * 100:.0f}%")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the capture-to-BPM pipeline offline.')
+    parser.add_argument('--synthetic', type=int, default=0, help='Number of random synthetic recordings')
+    parser.add_argument('--corpus', help='JSON corpus of videos with known BPM and synthetic configs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = []
+    if args.corpus:
+        corpus.extend(corpus_from_file(args.corpus))
+    if args.synthetic or not args.corpus:
+        corpus.extend(synthetic_corpus(args.synthetic or 10, args.seed))
+    run_benchmark(corpus)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import numpy as np
+from scipy.signal import butter, sosfiltfilt
+
+# bpm_estimator.py
+# Spectral heart-rate estimation from the camera intensity signal: resample
+# onto uniform timestamps, detrend, bandpass to the heart-rate band and take
+# the peak of the power spectrum. All windows are processed as one 2-D array,
+# so a whole batch of sliding windows costs a handful of numpy calls.
+
+LOW_HZ = 0.7   # 42 BPM
+HIGH_HZ = 3.5  # 210 BPM
+FILTER_ORDER = 3
+MIN_CONFIDENCE = 0.6  # Below this share of band power in the peak a reading is not trusted
+
+
+def resample_uniform(times, values, fs):
+    """Linearly interpolate irregularly timed samples onto a uniform grid at `fs` Hz."""
+    times = np.asarray(times, dtype=np.float64)
+    grid = np.arange(times[0], times[-1], 1.0 / fs)
+    return grid, np.interp(grid, times, np.asarray(values, dtype=np.float64))
+
+
+def bandpass_sos(fs):
+    return butter(FILTER_ORDER, [LOW_HZ, HIGH_HZ], btype='band', fs=fs, output='sos')
+
+
+def band_spectrum(segments, fs, sos=None, nfft=None):
+    """(frequencies, in-band bin indices, in-band power per row) of detrended, bandpassed rows."""
+    n = segments.shape[1]
+    if sos is None:
+        sos = bandpass_sos(fs)
+    if nfft is None:
+        nfft = max(4096, 1 << int(np.ceil(np.log2(n))))  # Zero-padding for a fine frequency grid
+
+    # Vectorized least-squares detrend of every row
+    x = np.arange(n) - (n - 1) / 2.0
+    slopes = segments @ x / (x @ x)
+    detrended = segments - segments.mean(axis=1, keepdims=True) - slopes[:, None] * x
+
+    filtered = sosfiltfilt(sos, detrended, axis=1)
+    power = np.abs(np.fft.rfft(filtered * np.hanning(n), n=nfft, axis=1)) ** 2
+    freqs = np.fft.rfftfreq(nfft, 1.0 / fs)
+
+    band = np.flatnonzero((freqs >= LOW_HZ) & (freqs <= HIGH_HZ))
+    return freqs, band, power[:, band]
+
+
+def windows_bpm(segments, fs, sos=None, nfft=None):
+    """BPM and confidence for every row of `segments` (n_windows x n_samples) at once.
+
+    Each row is linearly detrended, bandpassed, Hann-windowed and transformed;
+    the BPM is the strongest frequency inside the band (refined by parabolic
+    interpolation) and the confidence is the share of in-band power inside the
+    peak's main lobe, between 0 and 1.
+    """
+    segments = np.atleast_2d(np.asarray(segments, dtype=np.float64))
+    n = segments.shape[1]
+    freqs, band, band_power = band_spectrum(segments, fs, sos, nfft)
+    peak = band_power.argmax(axis=1)
+    rows = np.arange(len(segments))
+
+    # Parabolic interpolation around the peak bin
+    left = band_power[rows, np.maximum(peak - 1, 0)]
+    centre = band_power[rows, peak]
+    right = band_power[rows, np.minimum(peak + 1, len(band) - 1)]
+    denominator = left - 2 * centre + right
+    offset = np.where(denominator != 0, 0.5 * (left - right) / np.where(denominator != 0, denominator, 1), 0.0)
+    peak_freq = freqs[band[peak]] + offset * (freqs[1] - freqs[0])
+
+    # Power within the Hann main lobe (+-2 / window length) of the peak, relative to the whole band
+    near = np.abs(freqs[band][None, :] - peak_freq[:, None]) <= 2.0 * fs / n
+    total = band_power.sum(axis=1)
+    confidence = np.where(total > 0, (band_power * near).sum(axis=1) / np.where(total > 0, total, 1), 0.0)
+    return peak_freq * 60.0, confidence
+
+
+def estimate_bpm(times, values, fs=30.0, min_seconds=3.0):
+    """(BPM, confidence) for a whole recording, or (None, 0.0) if it is too short."""
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) < 2 or times[-1] - times[0] < min_seconds:
+        return None, 0.0
+    _, uniform = resample_uniform(times, values, fs)
+    bpm, confidence = windows_bpm(uniform, fs)
+    return float(bpm[0]), float(confidence[0])
+
+
+def sliding_bpm(times, values, fs=30.0, window_seconds=8.0, hop_seconds=0.5):
+    """BPM and confidence for every sliding window of a recording, computed in one batch."""
+    _, uniform = resample_uniform(times, values, fs)
+    window = int(window_seconds * fs)
+    hop = max(int(hop_seconds * fs), 1)
+    if len(uniform) < window:
+        return np.empty(0), np.empty(0)
+    segments = np.lib.stride_tricks.sliding_window_view(uniform, window)[::hop]
+    return windows_bpm(segments, fs)
+
+
+class StreamingBpmEstimator:
+    """Live BPM estimate over the most recent `window_seconds` of a growing signal."""
+
+    def __init__(self, fs=30.0, window_seconds=8.0, min_seconds=4.0):
+        self.fs = fs
+        self.window_seconds = window_seconds
+        self.min_seconds = min_seconds
+        self.sos = bandpass_sos(fs)  # Designed once, reused for every update
+        self.bpm = None
+        self.confidence = 0.0
+
+    def update(self, times, values):
+        """Re-estimate from the latest samples; returns (bpm, confidence)."""
+        times = np.asarray(times, dtype=np.float64)
+        if len(times) < 2 or times[-1] - times[0] < self.min_seconds:
+            return self.bpm, self.confidence
+        recent = times >= times[-1] - self.window_seconds
+        _, uniform = resample_uniform(times[recent], np.asarray(values)[recent], self.fs)
+        bpm, confidence = windows_bpm(uniform, self.fs, self.sos)
+        self.bpm, self.confidence = float(bpm[0]), float(confidence[0])
+        return self.bpm, self.confidence
+
+
+def spectral_snr_db(times, values, fs=30.0):
+    """Signal-to-noise ratio of a recording in dB, or None if it is too short.
+
+    The power of the strongest in-band spectral peak against the noise floor,
+    the median power of the band's bins outside the peak's main lobe.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) < 2 or times[-1] - times[0] < 1.0:
+        return None
+    _, uniform = resample_uniform(times, values, fs)
+    freqs, band, band_power = band_spectrum(np.atleast_2d(uniform), fs)
+    power = band_power[0]
+    peak = power.argmax()
+    outside = np.abs(freqs[band] - freqs[band[peak]]) > 2.0 * fs / len(uniform)
+    floor = np.median(power[outside]) if outside.any() else 0.0
+    if floor <= 0:
+        return None
+    return float(10 * np.log10(power[peak] / floor))
+
+
+def finger_coverage(samples, recent_seconds=2.0, min_intensity=30.0, min_red_ratio=0.5, max_saturated=0.5):
+    """Whether a finger seems to cover the lens over the last `recent_seconds` of capture samples.
+
+    `samples` are rows of (time, intensity, red ratio, saturated fraction). A
+    covered lens is red-dominated, not dark and not mostly clipped.
+    """
+    if len(samples) == 0:
+        return False
+    recent = samples[samples[:, 0] >= samples[-1, 0] - recent_seconds]
+    intensity, red_ratio, saturated = recent[:, 1].mean(), recent[:, 2].mean(), recent[:, 3].mean()
+    return intensity >= min_intensity and red_ratio >= min_red_ratio and saturated <= max_saturated
+
+
+class AdaptiveStop:
+    """Decides when a measurement has converged and can stop early.
+
+    Stops after `min_seconds` once the confidence passes `confidence_threshold`,
+    the finger covers the lens and the last `stable_updates` estimates agree
+    within `tolerance_bpm`. While quality is poor it keeps measuring, up to
+    `max_seconds`.
+    """
+
+    def __init__(self, min_seconds=4.0, max_seconds=20.0, confidence_threshold=MIN_CONFIDENCE, stable_updates=3,
+                 tolerance_bpm=3.0):
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.confidence_threshold = confidence_threshold
+        self.stable_updates = stable_updates
+        self.tolerance_bpm = tolerance_bpm
+        self._recent = []
+
+    def should_stop(self, elapsed, bpm, confidence, covered):
+        if elapsed >= self.max_seconds:
+            return True
+        if bpm is None or not covered or confidence < self.confidence_threshold:
+            self._recent = []
+            return False
+        self._recent = (self._recent + [bpm])[-self.stable_updates:]
+        converged = (len(self._recent) == self.stable_updates
+                     and max(self._recent) - min(self._recent) <= self.tolerance_bpm)
+        return elapsed >= self.min_seconds and converged
@@ -0,0 +1,130 @@
+import threading
+import time
+import cv2
+import numpy as np
+from frame_sources import CameraSource
+
+# capture.py
+# Camera capture for the heart-rate measurement. A dedicated thread reads
+# frames, reduces each one to the mean intensity of a central region of
+# interest and writes (monotonic timestamp, intensity) into a preallocated
+# ring buffer, so the event loop never touches frames and no frame waits on it.
+# Two cheap quality measures ride along with every sample: how red the region
+# is (a fingertip over the lens glows red) and how much of it is saturated.
+
+# Weights cv2.COLOR_BGR2GRAY uses; the mean of a weighted sum is the weighted sum of the channel means
+GRAY_WEIGHTS = np.array([0.114, 0.587, 0.299])
+SATURATION_LEVEL = 250  # Red channel values at or above this count as clipped
+
+CAPTURE_COLUMNS = ('time', 'intensity', 'red_ratio', 'saturated')
+
+
+class RingBuffer:
+    """Fixed-size, thread-safe buffer of float rows; the oldest rows are overwritten when full."""
+
+    def __init__(self, capacity, columns):
+        self.columns = columns
+        self._data = np.zeros((capacity, len(columns)), dtype=np.float64)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def append(self, *row):
+        with self._lock:
+            self._data[self._next] = row
+            self._next = (self._next + 1) % len(self._data)
+            self._count = min(self._count + 1, len(self._data))
+
+    def __len__(self):
+        return self._count
+
+    def snapshot(self):
+        """Copy of the stored rows, oldest first, as an (n, columns) array."""
+        with self._lock:
+            if self._count < len(self._data):
+                return self._data[:self._count].copy()
+            return np.roll(self._data, -self._next, axis=0)
+
+    def column(self, name):
+        return self.snapshot()[:, self.columns.index(name)]
+
+
+def central_roi(frame, roi_fraction=0.5, step=4):
+    """View of the central `roi_fraction` of a frame, keeping every `step`-th pixel."""
+    height, width = frame.shape[:2]
+    y0 = int(height * (1 - roi_fraction) / 2)
+    x0 = int(width * (1 - roi_fraction) / 2)
+    return frame[y0:height - y0:step, x0:width - x0:step]
+
+
+def roi_channel_means(frame, roi_fraction=0.5, step=4):
+    """Per-channel mean of the central `roi_fraction` of a frame, sampling every `step`-th pixel."""
+    roi = central_roi(frame, roi_fraction, step)
+    return roi.reshape(-1, roi.shape[-1]).mean(axis=0)
+
+
+def frame_sample(frame, roi_fraction=0.5, step=4):
+    """(intensity, red ratio, saturated fraction) of a BGR frame's region of interest."""
+    roi = central_roi(frame, roi_fraction, step)
+    means = roi.reshape(-1, roi.shape[-1]).mean(axis=0)
+    total = means.sum()
+    red_ratio = means[2] / total if total > 0 else 0.0
+    saturated = np.count_nonzero(roi[..., 2] >= SATURATION_LEVEL) / (roi.shape[0] * roi.shape[1])
+    return float(means @ GRAY_WEIGHTS), float(red_ratio), float(saturated)
+
+
+class CaptureThread(threading.Thread):
+    """Reads camera frames on its own thread into a RingBuffer of CAPTURE_COLUMNS rows."""
+
+    def __init__(self, camera_index=0, capacity=4096, roi_fraction=0.5, step=4, preview=False, source=None):
+        super().__init__(name='capture', daemon=True)
+        # Any FrameSource works (video file, synthetic signal); the camera is the default
+        self.source = source if source is not None else CameraSource(camera_index)
+        self.buffer = RingBuffer(capacity, CAPTURE_COLUMNS)
+        self.roi_fraction = roi_fraction
+        self.step = step
+        self.preview = preview  # Showing frames costs time per frame, so it is off by default
+        self.error = None
+        self.started_at = None
+        self._stop_event = threading.Event()
+
+    def opened(self):
+        return self.source.opened()
+
+    def elapsed(self):
+        """Seconds since capture started."""
+        if self.started_at is None:
+            return 0.0
+        return time.monotonic() - self.started_at
+
+    def run(self):
+        self.started_at = time.monotonic()
+        while not self._stop_event.is_set():
+            ret, frame, timestamp = self.source.read()
+            if not ret:
+                if self.source.live:
+                    self.error = 'Failed to capture image.'
+                break
+
+            self.buffer.append(timestamp, *frame_sample(frame, self.roi_fraction, self.step))
+
+            if self.preview:
+                cv2.imshow('Frame', frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+
+    def stop(self):
+        """Stop capturing and release the camera; safe to call more than once."""
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.source.release()
+        if self.preview:
+            cv2.destroyAllWindows()
+
+    def fps(self):
+        """Frames per second actually achieved so far."""
+        times = self.buffer.column('time')
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
@@ -0,0 +1,132 @@
+import time
+import numpy as np
+from scipy.signal import lfilter
+from hr_series import HrSeries, NUM_SLOTS
+import repository
+
+# fleet_forecast.py
+# Baseline forecasts for many users at once. Every user is a row of a
+# users x slots array (NaN where nothing was measured), and the rolling simple
+# moving average, EWMA and seasonal-naive forecasts are computed for all rows
+# together with cumulative sums, a linear filter and shifted views, so there is
+# no Python loop over users or over time. Each method is also backtested on
+# the history to give a per-user error.
+
+METHODS = ('sma', 'ewma', 'seasonal_naive')
+
+
+def _filled(Y):
+    Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+    mask = ~np.isnan(Y)
+    return np.where(mask, Y, 0.0), mask.astype(np.float64)
+
+
+def rolling_sma(Y, window):
+    """Mean of the last `window` slots (ignoring missing ones) ending at every slot; NaN if all are missing."""
+    values, mask = _filled(Y)
+    sums = np.cumsum(values, axis=1)
+    counts = np.cumsum(mask, axis=1)
+    # Subtract the running totals from `window` slots earlier, in place on the cumulative arrays' copies
+    sums[:, window:] -= np.cumsum(values, axis=1)[:, :-window]
+    counts[:, window:] -= np.cumsum(mask, axis=1)[:, :-window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def rolling_ewma(Y, alpha):
+    """Exponentially weighted mean of every row up to every slot; missing slots carry the level forward."""
+    values, mask = _filled(Y)
+    # y[t] = alpha * x[t] + (1 - alpha) * y[t - 1], run over values and over the mask, then normalised
+    b, a = [alpha], [1.0, -(1.0 - alpha)]
+    weighted = lfilter(b, a, values, axis=1)
+    weights = lfilter(b, a, mask, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(weights > 0, weighted / weights, np.nan)
+
+
+def seasonal_naive(Y, horizon, season=NUM_SLOTS):
+    """Forecast step k as the value one season before it (same slot last week by default)."""
+    Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+    steps = Y.shape[1] - season + np.arange(horizon) % season
+    forecast = np.full((len(Y), horizon), np.nan)
+    valid = steps >= 0
+    forecast[:, valid] = Y[:, steps[valid]]
+    return forecast
+
+
+def _flat_backtest(Y, levels, horizon):
+    # Mean absolute error of predicting every one of the next `horizon` slots with the level at each origin
+    actual, actual_mask = _filled(Y)
+    predicted, predicted_mask = _filled(levels)
+    errors = np.zeros(len(Y))
+    counts = np.zeros(len(Y))
+    for step in range(1, horizon + 1):
+        both = actual_mask[:, step:] * predicted_mask[:, :-step]
+        errors += np.einsum('ij,ij->i', np.abs(actual[:, step:] - predicted[:, :-step]), both)
+        counts += both.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, errors / counts, np.nan)
+
+
+def _seasonal_backtest(Y, season):
+    if Y.shape[1] <= season:
+        return np.full(len(Y), np.nan)  # Needs more than one season of history
+    diff = np.abs(Y[:, season:] - Y[:, :-season])
+    counts = np.sum(~np.isnan(diff), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, np.nansum(diff, axis=1) / counts, np.nan)
+
+
+def fleet_forecast(Y, horizon=10, window=3, alpha=0.3, season=NUM_SLOTS):
+    """Forecast the next `horizon` slots for every row of a users x slots history (oldest slot first).
+
+    Returns {'forecasts': {method: (users, horizon) array}, 'mae': {method: (users,) backtest MAE},
+    'best': (users,) index into METHODS of the lowest backtest error}. SMA and EWMA
+    forecasts are flat at the latest level; seasonal naive repeats last season.
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+    sma = rolling_sma(Y, window)
+    ewma = rolling_ewma(Y, alpha)
+    forecasts = {
+        'sma': np.repeat(sma[:, -1:], horizon, axis=1),
+        'ewma': np.repeat(ewma[:, -1:], horizon, axis=1),
+        'seasonal_naive': seasonal_naive(Y, horizon, season),
+    }
+    mae = {
+        'sma': _flat_backtest(Y, sma, horizon),
+        'ewma': _flat_backtest(Y, ewma, horizon),
+        'seasonal_naive': _seasonal_backtest(Y, season),
+    }
+    errors = np.column_stack([mae[method] for method in METHODS])
+    # Missing errors rank last; a row with no usable backtest falls back to SMA
+    best = np.argmin(np.where(np.isnan(errors), np.inf, errors), axis=1)
+    return {'forecasts': forecasts, 'mae': mae, 'best': best}
+
+
+def week_history(series, origin):
+    """A stored week as a chronological history whose last slot is `origin`.
+
+    The week is circular (each slot holds its latest value), so the slot after
+    `origin` holds last week's value and comes first.
+    """
+    values = np.where(series.mask, series.values.astype(np.float64), np.nan)
+    return np.roll(values, -(origin + 1))
+
+
+def load_fleet(origin):
+    """(user ids, users x NUM_SLOTS history ending at slot `origin`) for every user."""
+    user_ids = []
+    rows = []
+    for user in repository.iter_users():
+        user_ids.append(user['_id'])
+        rows.append(week_history(HrSeries.from_document(user), origin))
+    return user_ids, np.array(rows).reshape(-1, NUM_SLOTS)
+
+
+def forecast_fleet(origin, horizon=10, **kwargs):
+    """Forecast every user from slot `origin` onwards and report the timing."""
+    user_ids, Y = load_fleet(origin)
+    started = time.perf_counter()
+    result = fleet_forecast(Y, horizon, **kwargs)
+    print(f"Forecast {len(user_ids)} users x {horizon} slots in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return user_ids, result
@@ -0,0 +1,154 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from bson.objectid import ObjectId
+from hr_series import HrSeries
+import repository
+
+# forecast_job.py
+# Batch ARIMA forecasting for the whole user base. Users are sharded across a
+# process pool, every worker fits fit_arima_model per user, and results stream
+# back to the parent, which persists them with bulk writes. Finished user ids
+# are appended to a checkpoint file so an interrupted run resumes where it
+# stopped instead of refitting everyone.
+
+DEFAULT_CHECKPOINT = 'forecast_job.checkpoint'
+
+
+def forecast_shard(shard, forecast_steps):
+    """Worker: fit and forecast every (user id, HrSeries) in a shard.
+
+    Returns a list of (user id, forecast series or None, error message or None).
+    Runs in a child process, so it only imports the ARIMA code there.
+    """
+    from arima_model2 import process_hr_data, fit_arima_model, generate_forecast, create_forecast_series
+
+    results = []
+    for user_id, series in shard:
+        try:
+            hr_series = process_hr_data(series)
+            model_fit = fit_arima_model(hr_series)
+            forecast = generate_forecast(model_fit, steps=forecast_steps)
+            results.append((user_id, create_forecast_series(forecast, hr_series, forecast_steps), None))
+        except Exception as e:
+            results.append((user_id, None, str(e)))
+    return results
+
+
+def load_checkpoint(path):
+    """Ids of the users a previous run already forecast and persisted."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def iter_shards(done, shard_size):
+    # Shards of (user id, HrSeries) for users not in the checkpoint, plus their documents
+    shard = []
+    docs = {}
+    for user in repository.iter_users():
+        user_id = str(user['_id'])
+        if user_id in done:
+            continue
+        series = HrSeries.from_document(user)
+        if not len(series):
+            continue
+        shard.append((user_id, series))
+        docs[user_id] = user
+        if len(shard) >= shard_size:
+            yield shard, docs
+            shard, docs = [], {}
+    if shard:
+        yield shard, docs
+
+
+def run_forecast_job(forecast_steps=10, workers=None, shard_size=32, checkpoint=DEFAULT_CHECKPOINT,
+                     flush_size=500, restart=False, report_every=5.0):
+    """Forecast every user in parallel and persist the results; returns (forecast, failed)."""
+    # Imported here so workers do not pay for the parent's persistence imports
+    from arima_model2 import bulk_update_forecasts
+
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = load_checkpoint(checkpoint)
+    if done:
+        print(f"Resuming: skipping {len(done)} users that are already forecast.")
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2  # Bounded so memory stays flat on large user bases
+    forecast_count = 0
+    failed_count = 0
+    pending_results = []
+    in_flight = {}
+    started = time.monotonic()
+    last_report = started
+
+    def flush(checkpoint_file):
+        nonlocal pending_results
+        if not pending_results:
+            return
+        bulk_update_forecasts(
+            [(ObjectId(user_id), forecast_series) for user_id, forecast_series, _ in pending_results],
+            user_docs={ObjectId(user_id): doc for user_id, _, doc in pending_results},
+        )
+        # Only checkpoint users whose forecast is safely written
+        checkpoint_file.write(''.join(f"{user_id}\n" for user_id, _, _ in pending_results))
+        checkpoint_file.flush()
+        pending_results = []
+
+    def collect(futures, checkpoint_file):
+        nonlocal forecast_count, failed_count
+        for future in futures:
+            docs = in_flight.pop(future)
+            for user_id, forecast_series, error in future.result():
+                if error is not None:
+                    failed_count += 1
+                    print(f"Forecast failed for user {user_id}: {error}")
+                    continue
+                pending_results.append((user_id, forecast_series, docs[user_id]))
+                forecast_count += 1
+        if len(pending_results) >= flush_size:
+            flush(checkpoint_file)
+
+    with open(checkpoint, 'a') as checkpoint_file, ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for shard, docs in iter_shards(done, shard_size):
+                if len(in_flight) >= max_in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished, checkpoint_file)
+                in_flight[executor.submit(forecast_shard, shard, forecast_steps)] = docs
+
+                now = time.monotonic()
+                if now - last_report >= report_every:
+                    rate = forecast_count / (now - started)
+                    print(f"{forecast_count} users forecast, {failed_count} failed, {rate:.1f} users/s")
+                    last_report = now
+
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished, checkpoint_file)
+        finally:
+            # Persist whatever finished, even when interrupted
+            flush(checkpoint_file)
+
+    elapsed = time.monotonic() - started
+    rate = forecast_count / elapsed if elapsed > 0 else 0.0
+    print(f"Forecast {forecast_count} users ({failed_count} failed) in {elapsed:.1f}s: {rate:.1f} users/s")
+    return forecast_count, failed_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Forecast heart rates for every user with ARIMA in parallel.')
+    parser.add_argument('--steps', type=int, default=10, help='Number of half-hour steps to forecast')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--shard-size', type=int, default=32, help='Users per worker task')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help='File of finished user ids for resuming')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and forecast everyone again')
+    args = parser.parse_args()
+    run_forecast_job(args.steps, args.workers, args.shard_size, args.checkpoint, restart=args.restart)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import time
+import cv2
+import numpy as np
+
+# frame_sources.py
+# Where the heart-rate pipeline gets its frames from. Every source returns
+# (ok, frame, timestamp in seconds) from read(), so the capture thread and the
+# offline benchmark work the same on a live camera, a recorded video or a
+# synthetic fingertip signal with a known BPM.
+
+
+class FrameSource:
+    """Base class: a stream of BGR frames with timestamps."""
+
+    ground_truth_bpm = None  # Known BPM for recordings and synthetic signals, when available
+    live = False  # A live source failing to read is an error, not the end of a recording
+
+    def opened(self):
+        return True
+
+    def read(self):
+        """Return (ok, frame, timestamp); ok is False at the end of the stream."""
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    """Live camera; timestamps come from the monotonic clock."""
+
+    live = True
+
+    def __init__(self, index=0):
+        self.capture = cv2.VideoCapture(index)
+
+    def opened(self):
+        return self.capture.isOpened()
+
+    def read(self):
+        ret, frame = self.capture.read()
+        return ret, frame, time.monotonic()
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileSource(FrameSource):
+    """Recorded video; timestamps come from the file, so it can be replayed faster than real time."""
+
+    def __init__(self, path, ground_truth_bpm=None):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.ground_truth_bpm = ground_truth_bpm
+        self._frame_index = 0
+
+    def opened(self):
+        return self.capture.isOpened()
+
+    def read(self):
+        ret, frame = self.capture.read()
+        timestamp = self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if timestamp <= 0:
+            timestamp = self._frame_index / self.fps  # Some containers do not report positions
+        self._frame_index += 1
+        return ret, frame, timestamp
+
+    def release(self):
+        self.capture.release()
+
+
+class SyntheticPpgSource(FrameSource):
+    """Synthetic fingertip-over-lens frames with a known heart rate.
+
+    The red-dominated frame brightness follows a pulse waveform (fundamental
+    plus a harmonic) at `bpm`, with slow baseline drift, per-pixel sensor
+    noise, timing jitter and, optionally, motion artefacts (sudden brightness
+    jumps that decay) at `motion_rate` events per second.
+    """
+
+    def __init__(self, bpm=72.0, fps=30.0, duration=20.0, size=(64, 64), noise=2.0, pulse_amplitude=2.0,
+                 drift=3.0, motion_rate=0.0, motion_amplitude=25.0, jitter=0.002, seed=None, realtime=False):
+        self.ground_truth_bpm = bpm
+        self.fps = fps
+        self.duration = duration
+        self.size = size
+        self.noise = noise
+        self.pulse_amplitude = pulse_amplitude
+        self.drift = drift
+        self.motion_amplitude = motion_amplitude
+        self.jitter = jitter
+        self.realtime = realtime  # Pace frames like a real camera instead of as fast as possible
+        self.rng = np.random.default_rng(seed)
+        self._frame_index = 0
+        self._started = None
+        self._drift_phase = self.rng.uniform(0, 2 * np.pi)
+        count = self.rng.poisson(motion_rate * duration) if motion_rate > 0 else 0
+        self._motion_times = np.sort(self.rng.uniform(0, duration, count))
+        self._motion_signs = self.rng.choice([-1.0, 1.0], count)
+        self._base = np.array([40.0, 35.0, 170.0])  # BGR of a lit fingertip
+
+    def brightness(self, t):
+        """Noise-free brightness offset at time t (pulse + drift + motion)."""
+        phase = 2 * np.pi * self.ground_truth_bpm / 60.0 * t
+        pulse = self.pulse_amplitude * (np.sin(phase) + 0.3 * np.sin(2 * phase + 0.5))
+        drift = self.drift * np.sin(2 * np.pi * 0.05 * t + self._drift_phase)
+        since = t - self._motion_times
+        active = since >= 0
+        motion = (self._motion_signs[active] * self.motion_amplitude * np.exp(-since[active] / 0.5)).sum()
+        return pulse + drift + motion
+
+    def read(self):
+        t = self._frame_index / self.fps + self.rng.normal(0, self.jitter)
+        if self._frame_index / self.fps >= self.duration:
+            return False, None, t
+        if self.realtime:
+            if self._started is None:
+                self._started = time.monotonic()
+            delay = self._started + self._frame_index / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self._frame_index += 1
+
+        level = self._base + self.brightness(t) * np.array([0.3, 0.3, 1.0])
+        frame = level + self.rng.normal(0, self.noise, (*self.size, 3))
+        return True, np.clip(frame, 0, 255).astype(np.uint8), t
@@ -1,38 +1,38 @@
+import numpy as np
 import matplotlib.pyplot as plt
-from pymongo import MongoClient
 from collections import defaultdict
+from hr_series import HrSeries
+import repository
 
 def fetch_data():
-    # Connect to MongoDB
-    client = MongoClient('mongodb://localhost:27017/')  # Adjust the connection string as needed
-    db = client['HRMonitoring']  # Replace with your database name
-    users_collection = db['Users']  # Replace with your collection name
-
-    # Fetch all users
-    users = list(users_collection.find({}))
+    # Fetch all users (profile and heart-rate fields only) over the shared connection
+    users = repository.find_all_users()
     print(f"Fetched {len(users)} users.")  # Debug: number of users fetched
     return users
 
+def fetch_data_batched(batch_size=500):
+    # Lazily iterate over all users; only one cursor batch is held in memory at a time
+    return repository.iter_users(batch_size=batch_size)
+
 def group_users(users):
     groups = defaultdict(lambda: defaultdict(list))
     for user in users:
         age = user.get('Age')
         gender = user.get('Gender')
         heart_problems = user.get('Heart Problems')
-        heart_rates = [value for key, value in user.items() if key.startswith('HR at') and isinstance(value, (int, float))]
+        heart_rates = HrSeries.from_document(user).present_values().tolist()
 
         # Debug: Print user details and heart rates
         print(f"User: {user.get('Name')}, Age: {age}, Gender: {gender}, Heart Problems: {heart_problems}")
         print(f"Heart Rates: {heart_rates}")
 
         if heart_rates:  # Ensure there are heart rates to process
-            for rate in heart_rates:
-                if age is not None:
-                    groups['age'][age].append(rate)
-                if gender is not None:
-                    groups['gender'][gender].append(rate)
-                if heart_problems is not None:
-                    groups['heart_problems'][heart_problems].append(rate)
+            if age is not None:
+                groups['age'][age].extend(heart_rates)
+            if gender is not None:
+                groups['gender'][gender].extend(heart_rates)
+            if heart_problems is not None:
+                groups['heart_problems'][heart_problems].extend(heart_rates)
     
     # Debug: Print grouped data
     for category, subgroups in groups.items():
@@ -60,10 +60,246 @@ def analyze_heart_rates(groups):
     return analysis
 
 
-def plot_general_analysis(analysis):
+# Histogram used by OnlineStats: one bin per BPM between HIST_MIN and HIST_MAX
+HIST_MIN = 0
+HIST_MAX = 250
+
+
+class OnlineStats:
+    """Mergeable running statistics for one cohort: count, mean, M2, min, max and a BPM histogram.
+
+    Memory is fixed no matter how many values are added, so a cohort costs the
+    same for ten users as for ten million.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.histogram = np.zeros(HIST_MAX - HIST_MIN + 1, dtype=np.int64)
+
+    def update(self, values):
+        """Add a batch of values (vectorized Welford/Chan update)."""
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return
+        batch_mean = values.mean()
+        batch_m2 = ((values - batch_mean) ** 2).sum()
+        self._combine(n, batch_mean, batch_m2, values.min(), values.max())
+        bins = np.clip(np.floor(values).astype(np.int64) - HIST_MIN, 0, len(self.histogram) - 1)
+        self.histogram += np.bincount(bins, minlength=len(self.histogram))
+
+    def merge(self, other):
+        """Fold another OnlineStats into this one (e.g. from another batch or process)."""
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+            self.histogram += other.histogram
+        return self
+
+    def _combine(self, n, mean, m2, low, high):
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    @property
+    def variance(self):
+        """Sample variance (0 for fewer than two values)."""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return self.variance ** 0.5
+
+    def __len__(self):
+        return self.count
+
+    def distinct_rates(self):
+        """Heart-rate values (histogram bins) that occur at least once, for scatter plots."""
+        return (np.flatnonzero(self.histogram) + HIST_MIN).tolist()
+
+    def quantiles(self, qs):
+        """Approximate quantiles (to the 1 BPM bin) read from the histogram."""
+        return histogram_quantiles(self.histogram, qs)
+
+
+def rate_histogram(rates):
+    """BPM histogram of a cohort: the OnlineStats histogram, or binned from a plain list of rates."""
+    if isinstance(rates, OnlineStats):
+        return rates.histogram
+    bins = np.clip(np.floor(np.asarray(rates, dtype=np.float64)).astype(np.int64) - HIST_MIN, 0, HIST_MAX - HIST_MIN)
+    return np.bincount(bins, minlength=HIST_MAX - HIST_MIN + 1)
+
+
+def histogram_quantiles(histogram, qs):
+    cumulative = np.cumsum(histogram)
+    if cumulative[-1] == 0:
+        return np.full(len(qs), np.nan)
+    return np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1]) + HIST_MIN
+
+
+def stream_groups(users):
+    """Group heart rates by age, gender and heart problems in one pass with constant memory.
+
+    `users` can be any iterable of user documents, typically the batched cursor
+    from fetch_data_batched(). Returns the same categories and keys as
+    analyze_heart_rates(group_users(...)), with an OnlineStats per cohort.
+    """
+    groups = {
+        'age': defaultdict(OnlineStats),
+        'gender': defaultdict(OnlineStats),
+        'heart_problems': defaultdict(OnlineStats),
+    }
+    user_count = 0
+    for user in users:
+        user_count += 1
+        heart_rates = HrSeries.from_document(user).present_values()
+        if not len(heart_rates):
+            continue
+        # Summarise the user once and merge that summary into each of its cohorts
+        user_stats = OnlineStats()
+        user_stats.update(heart_rates)
+        for category, field in (('age', 'Age'), ('gender', 'Gender'), ('heart_problems', 'Heart Problems')):
+            key = user.get(field)
+            if key is not None:
+                groups[category][key].merge(user_stats)
+
+    print(f"Streamed {user_count} users.")
+    for category, subgroups in groups.items():
+        for key, stats in subgroups.items():
+            print(f"Group - Category: {category}, Key: {key}, Heart Rates Count: {stats.count}")
+
+    return groups
+
+
+def plot_rates(rates):
+    # Cohorts are either plain lists of rates or OnlineStats from stream_groups
+    if isinstance(rates, OnlineStats):
+        return rates.distinct_rates()
+    return rates
+
+
+def analysis_plot_data(analysis):
+    """The rates each cohort contributes to the scatter plots, as plain lists (hashable plot data)."""
+    return {
+        category: {key: plot_rates(rates) for key, rates in groups.items()}
+        for category, groups in analysis.items()
+    }
+
+
+def draw_population_analysis(fig, plot_data):
+    """Draw heart rate vs age, gender and heart problems side by side on a matplotlib Figure."""
+    ax1, ax2, ax3 = fig.subplots(1, 3)
+    panels = [
+        (ax1, 'age', 'Age', 'Age', 'Heart Rate vs Age'),
+        (ax2, 'gender', 'Gender', 'Gender', 'Heart Rate vs Gender'),
+        (ax3, 'heart_problems', 'Heart Problems', 'Heart Problems Status', 'Heart Rate vs Heart Problems'),
+    ]
+    for ax, category, label, xlabel, title in panels:
+        for key, rates in plot_data[category].items():
+            ax.scatter([str(key) if category != 'age' else key] * len(rates), rates, alpha=0.7,
+                       label=f'{label}: {key}' if category == 'heart_problems' else f'{label} {key}')
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('Heart Rate')
+        ax.set_title(title)
+        ax.legend()
+        ax.grid(True)
+    fig.tight_layout()
+
+
+def histogram_plot_data(analysis):
+    """Per-cohort BPM histograms: the whole input of the density plots, bounded by the number of bins."""
+    return {
+        category: {key: rate_histogram(rates) for key, rates in groups.items()}
+        for category, groups in analysis.items()
+    }
+
+
+def _sorted_keys(groups):
+    return sorted(groups, key=lambda key: (not isinstance(key, (int, float)), key if isinstance(key, (int, float)) else str(key)))
+
+
+def _draw_heatmap(fig, ax, groups, keys, rows):
+    # Columns are cohorts, rows BPM bins; each column is normalised so small cohorts stay visible
+    counts = np.array([groups[key][rows] for key in keys], dtype=np.float64).T
+    totals = counts.sum(axis=0, keepdims=True)
+    density = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+    mesh = ax.pcolormesh(np.arange(len(keys) + 1) - 0.5, np.append(rows, rows[-1] + 1) + HIST_MIN - 0.5,
+                         np.ma.masked_equal(density, 0), cmap='viridis', shading='flat')
+    fig.colorbar(mesh, ax=ax, label='Share of cohort')
+
+
+def _draw_bands(ax, groups, keys):
+    # Median with 25-75% and 5-95% bands per cohort, i.e. a box plot read off the histogram
+    positions = np.arange(len(keys))
+    q = np.array([histogram_quantiles(groups[key], [0.05, 0.25, 0.5, 0.75, 0.95]) for key in keys], dtype=np.float64)
+    ax.vlines(positions, q[:, 0], q[:, 4], color='tab:blue', linewidth=2, alpha=0.4, label='5-95%')
+    ax.vlines(positions, q[:, 1], q[:, 3], color='tab:blue', linewidth=8, alpha=0.7, label='25-75%')
+    ax.scatter(positions, q[:, 2], color='white', edgecolor='black', zorder=3, label='Median')
+    ax.set_xlim(-0.75, len(keys) - 0.25)
+    ax.legend()
+
+
+def draw_population_density(fig, hist_data, modes=None):
+    """Density version of draw_population_analysis, drawn from per-cohort histograms.
+
+    `modes` maps each category to 'heatmap' (2-D histogram over cohorts and BPM)
+    or 'bands' (quantile bands); by default ages are a heatmap and the other
+    categories bands. Drawing cost depends on cohorts x bins, not on the number of values.
+    """
+    modes = {'age': 'heatmap', 'gender': 'bands', 'heart_problems': 'bands', **(modes or {})}
+    panels = [
+        ('age', 'Age', 'Heart Rate vs Age'),
+        ('gender', 'Gender', 'Heart Rate vs Gender'),
+        ('heart_problems', 'Heart Problems Status', 'Heart Rate vs Heart Problems'),
+    ]
+    # Show only the BPM range that actually occurs
+    occupied = np.zeros(HIST_MAX - HIST_MIN + 1, dtype=bool)
+    for groups in hist_data.values():
+        for histogram in groups.values():
+            occupied |= np.asarray(histogram) > 0
+    present = np.flatnonzero(occupied)
+    rows = np.arange(present[0], present[-1] + 1) if len(present) else np.arange(60 - HIST_MIN, 101 - HIST_MIN)
+
+    for ax, (category, xlabel, title) in zip(fig.subplots(1, 3), panels):
+        groups = hist_data.get(category, {})
+        keys = _sorted_keys(groups)
+        if keys:
+            if modes[category] == 'heatmap':
+                _draw_heatmap(fig, ax, groups, keys, rows)
+            else:
+                _draw_bands(ax, groups, keys)
+            # Label at most ~12 ticks so many ages stay readable
+            step = max(1, len(keys) // 12)
+            ax.set_xticks(np.arange(len(keys))[::step])
+            ax.set_xticklabels([str(key) for key in keys[::step]])
+        ax.set_ylim(rows[0] + HIST_MIN - 0.5, rows[-1] + HIST_MIN + 0.5)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('Heart Rate')
+        ax.set_title(title)
+        ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+
+def plot_general_analysis(analysis, mode='scatter'):
+    """Plot the cohorts; mode='density' draws the histogram heatmap and quantile bands instead of scatters."""
+    if mode == 'density':
+        fig = plt.figure(figsize=(15, 5))
+        draw_population_density(fig, histogram_plot_data(analysis))
+        fig.savefig('population_density.png')
+        plt.close(fig)
+        return
+
     # Plot heart rates by age
     plt.figure(figsize=(12, 6))
     for age, rates in analysis['age'].items():
+        rates = plot_rates(rates)
         plt.scatter([age] * len(rates), rates, alpha=0.7, label=f'Age {age}')
     plt.xlabel('Age')
     plt.ylabel('Heart Rate')
@@ -78,6 +314,7 @@ def plot_general_analysis(analysis):
     gender_map = {'male': 1, 'female': 2, 'other': 3}
     plt.figure(figsize=(12, 6))
     for gender, rates in analysis['gender'].items():
+        rates = plot_rates(rates)
         if gender in gender_map:
             plt.scatter([gender_map[gender]] * len(rates), rates, alpha=0.7, label=f'Gender {gender}')
         else:
@@ -94,6 +331,7 @@ def plot_general_analysis(analysis):
     heart_problems_map = {True: 1, False: 0}
     plt.figure(figsize=(12, 6))
     for heart_problems, rates in analysis['heart_problems'].items():
+        rates = plot_rates(rates)
         if heart_problems in heart_problems_map:
             plt.scatter([heart_problems_map[heart_problems]] * len(rates), rates, alpha=0.7, label=f'Heart Problems {heart_problems}')
         else:
@@ -0,0 +1,116 @@
+import numpy as np
+from datetime import datetime, timedelta
+
+# hr_series.py
+# A user's week of heart-rate slots held as one fixed float32 array instead of
+# 336 separate "HR at HH:MM (Day)" document keys. The documents keep the key
+# layout, which single-slot writes and the server-side aggregations rely on;
+# it is parsed once into the array when a user is read.
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SLOTS_PER_DAY = 48  # 48 half-hour intervals in a day
+NUM_SLOTS = SLOTS_PER_DAY * len(DAYS)
+
+
+def slot_key(index):
+    """Return the legacy document key for a slot index (0 = Monday 00:00)."""
+    day, slot = divmod(index, SLOTS_PER_DAY)
+    hour, half = divmod(slot, 2)
+    return f"HR at {hour:02}:{half * 30:02} ({DAYS[day]})"
+
+
+# Built once so parsing a legacy document is a dict lookup per key, not a strptime
+SLOT_KEYS = [slot_key(i) for i in range(NUM_SLOTS)]
+KEY_TO_INDEX = {key: i for i, key in enumerate(SLOT_KEYS)}
+
+
+def slot_index(dt):
+    """Return the slot index of the half-hour that contains the datetime `dt`."""
+    return dt.weekday() * SLOTS_PER_DAY + dt.hour * 2 + (1 if dt.minute >= 30 else 0)
+
+
+def slot_time(index):
+    """Return the time of day of a slot as a datetime on 1900-01-01 (as strptime did)."""
+    return datetime(1900, 1, 1) + timedelta(minutes=30 * (index % SLOTS_PER_DAY))
+
+
+class HrSeries:
+    """A week of heart-rate values in 336 half-hour slots with a missing-value mask."""
+
+    __slots__ = ('values', 'mask')
+
+    def __init__(self, values=None, mask=None):
+        if values is None:
+            values = np.full(NUM_SLOTS, np.nan, dtype=np.float32)
+        values = np.asarray(values, dtype=np.float32)
+        if values.shape != (NUM_SLOTS,):
+            raise ValueError(f"HrSeries needs exactly {NUM_SLOTS} slots, got {values.shape}")
+        if mask is None:
+            mask = ~np.isnan(values)
+        self.values = values
+        self.mask = np.asarray(mask, dtype=bool)
+
+    @classmethod
+    def from_legacy(cls, doc):
+        """Parse the legacy "HR at ..." keys of a user document in one pass."""
+        series = cls()
+        for key, value in doc.items():
+            index = KEY_TO_INDEX.get(key)
+            if index is not None:
+                series.set(index, value)
+        return series
+
+    @classmethod
+    def from_document(cls, doc):
+        """Build the series from a user document."""
+        return cls.from_legacy(doc)
+
+    @classmethod
+    def coerce(cls, data):
+        """Accept an HrSeries, a user document or a dict of legacy keys."""
+        if isinstance(data, cls):
+            return data
+        return cls.from_document(data)
+
+    def set(self, index, value):
+        """Store a value in a slot; non-numeric values mark the slot as missing."""
+        if isinstance(value, (int, float, np.number)) and not isinstance(value, bool) and value == value:
+            self.values[index] = value
+            self.mask[index] = True
+        else:
+            self.values[index] = np.nan
+            self.mask[index] = False
+
+    def get(self, index):
+        """Return the value of a slot, or None when it is missing."""
+        return float(self.values[index]) if self.mask[index] else None
+
+    def copy(self):
+        return HrSeries(self.values.copy(), self.mask.copy())
+
+    def __len__(self):
+        return int(self.mask.sum())
+
+    def present_indices(self):
+        """Slot indices that hold a value, in week order."""
+        return np.flatnonzero(self.mask)
+
+    def present_values(self):
+        """Values of the slots that hold a value, in week order."""
+        return self.values[self.mask]
+
+    def keys(self):
+        """Legacy keys of the slots that hold a value, in week order."""
+        return [SLOT_KEYS[i] for i in self.present_indices()]
+
+    def times(self):
+        """Time of day of the slots that hold a value, in week order."""
+        return [slot_time(i) for i in self.present_indices()]
+
+    def day(self, day):
+        """The 48 slots of one day (0 = Monday) as a view into the week."""
+        return self.values[day * SLOTS_PER_DAY:(day + 1) * SLOTS_PER_DAY]
+
+    def to_legacy_dict(self):
+        """Return the present slots as {"HR at ...": value} for the legacy layout."""
+        return {SLOT_KEYS[i]: float(self.values[i]) for i in self.present_indices()}
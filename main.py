@@ -1,32 +1,56 @@
+import matplotlib
+matplotlib.use('Agg')  # Plots are only saved to PNG, and analysis jobs draw from worker threads
 import toga
 from toga.style import Pack
 from toga.style.pack import COLUMN, ROW
-from pymongo import MongoClient
-import cv2
 import numpy as np
-from scipy.signal import find_peaks
 import asyncio
-import random
-from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-from general_users import fetch_data, group_users, analyze_heart_rates
+from datetime import datetime
+from general_users import (fetch_data_batched, stream_groups, analysis_plot_data, draw_population_analysis,
+                           histogram_plot_data, draw_population_density)
 from toga import ScrollContainer
 from collections import defaultdict
-import os
 import statistics 
 
 # Import algorithms from different files
-from OCSVM import detect_anomalies_ocsvm
-from IsolationForests import detect_anomalies
+from anomaly_engine import DETECTORS, user_features, anomaly_result, score_with_models, print_anomalies
+from model_registry import ModelRegistry
+from online_anomaly import OnlineAnomalyDetector, LEGACY_THRESHOLD, score_and_commit
 from arima_model2 import arima_forecast_for_user
-from moving_average import moving_average_forecast, plot_moving_avg_forecast
+from arima_cache import ArimaModelCache
+from analysis_service import AnalysisService
+from capture import CaptureThread
+from bpm_estimator import (StreamingBpmEstimator, estimate_bpm, AdaptiveStop, finger_coverage, spectral_snr_db,
+                           MIN_CONFIDENCE)
+from moving_average import draw_moving_avg_forecast
+from render_service import RenderService
+from fleet_forecast import fleet_forecast, week_history, METHODS
+from hr_series import HrSeries, SLOT_KEYS, slot_index
+import repository
+from user_directory import UserDirectory
+from measurement_store import ensure_measurement_indexes, measurement_update
+from write_behind import WriteBehindQueue
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+from seed_users import week_heart_rates
+from population_stats import (aggregate_population_stats, print_population_stats, get_age_group,
+                              load_population_stats, record_new_user, slot_change_operations)
+
+# Owner of analysis jobs that are not tied to the user being typed, so they survive name changes
+POPULATION_JOBS = 'population'
+
+
+def calculate_and_print_heart_rate_averages(users=None):
+    """Print overall, per-gender and per-age-group heart-rate statistics and return them.
+
+    With no `users` the statistics are computed by a server-side aggregation in
+    a single round trip; passing a list of user documents computes them in Python.
+    """
+    if users is None:
+        stats = aggregate_population_stats()
+        print_population_stats(stats)
+        return stats
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client['HRMonitoring']  # Ensure the database name is correct
-users_collection = db['Users']
-
-
-def calculate_and_print_heart_rate_averages(users):
     # Initialize data structures
     total_heart_rate_all = 0
     count_all = 0
@@ -34,26 +58,12 @@ def calculate_and_print_heart_rate_averages(users):
     gender_heart_rates = defaultdict(list)
     age_group_heart_rates = defaultdict(list)
     
-    # Age groups
-    age_groups = [(10, 20), (20, 30), (30, 40), (40, 50), (50, 60), (60, 70), (70, 80), (80, 90)]
-
-    def get_age_group(age):
-        for low, high in age_groups:
-            if low <= age < high:
-                return f"{low}-{high}"
-        return "90+"
-    
     # Process each user
     for user in users:
-        # Initialize variables for calculating average heart rate for this user
-        total_heart_rate = 0
-        count = 0
-        
         # Calculate total heart rate and count for the user
-        for key, value in user.items():
-            if key.startswith('HR at') and isinstance(value, (int, float)):
-                total_heart_rate += value
-                count += 1
+        heart_rates = HrSeries.from_document(user).present_values()
+        total_heart_rate = float(heart_rates.sum(dtype=np.float64))
+        count = len(heart_rates)
         
         # Calculate average heart rate for the user
         if count > 0:
@@ -76,43 +86,54 @@ def calculate_and_print_heart_rate_averages(users):
             age_group = get_age_group(age)
             age_group_heart_rates[age_group].append(average_heart_rate)
     
-    # Calculate and print overall average and standard deviation
-    if count_all > 0:
-        overall_average_heart_rate = total_heart_rate_all / count_all
-        print(f"Overall Average Heart Rate: {overall_average_heart_rate:.2f}")
-    else:
-        overall_average_heart_rate = 0
-        print("Overall Average Heart Rate: N/A")
-    
-    # Calculate and print average and standard deviation by gender
-    for gender, rates in gender_heart_rates.items():
-        if rates:
-            average_rate = sum(rates) / len(rates)
-            stddev = statistics.stdev(rates) if len(rates) > 1 else 0
-            print(f"Average Heart Rate for {gender}: {average_rate:.2f}, Standard Deviation: {stddev:.2f}")
-        else:
-            print(f"Average Heart Rate for {gender}: N/A, Standard Deviation: N/A")
-    
-    # Calculate and print average and standard deviation by age group
-    for age_group, rates in age_group_heart_rates.items():
-        if rates:
-            average_rate = sum(rates) / len(rates)
-            stddev = statistics.stdev(rates) if len(rates) > 1 else 0
-            print(f"Average Heart Rate for Age Group {age_group}: {average_rate:.2f}, Standard Deviation: {stddev:.2f}")
-        else:
-            print(f"Average Heart Rate for Age Group {age_group}: N/A, Standard Deviation: N/A")
+    # Calculate overall average and, per cohort, average and standard deviation
+    stats = {
+        'overall': {
+            'mean': total_heart_rate_all / count_all if count_all > 0 else None,
+            'count': count_all,
+        },
+        'gender': {},
+        'age_group': {},
+    }
+    for category, cohorts in (('gender', gender_heart_rates), ('age_group', age_group_heart_rates)):
+        for key, rates in cohorts.items():
+            stats[category][key] = {
+                'mean': sum(rates) / len(rates) if rates else None,
+                'stddev': statistics.stdev(rates) if len(rates) > 1 else 0,
+                'count': len(rates),
+            }
+    
+    print_population_stats(stats)
+    return stats
 
     
 class HeartRateApp(toga.App):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.db = MongoClient("mongodb://localhost:27017/")['HRMonitoring']
-        self.users_collection = self.db['Users']
-        self.heart_rate_collection = self.db['heart_rate']
+        self.db = repository.get_db()  # Shared pooled connection
+        self.users_collection = repository.users_collection()
+        self.heart_rate_collection = repository.heart_rate_collection()
+        self.model_cache = ArimaModelCache()  # Fitted ARIMA models, extended with each new measurement
+        self.analysis = AnalysisService()  # Model fitting runs here, off the event loop
+        self.online_detector = OnlineAnomalyDetector()  # Scores each new measurement in constant time
+        self.model_registry = ModelRegistry()  # Population-trained anomaly models (python model_registry.py)
+        self.show_camera_preview = False  # Set to True to show the camera frames while measuring
+        self.adaptive_measurement = True  # Stop measuring once the BPM estimate has converged
         self.check_user_task = None
         self.image_view = None  # Add this line inside the __init__ method
+        self.renderer = RenderService()  # Plots are drawn off the event loop and cached as PNG bytes
+        self.population_plot_mode = 'density'  # 'density' (bounded by histogram bins) or 'scatter'
+        self.user_directory = UserDirectory()  # Name autocomplete and cached profiles
+        self.write_queue = WriteBehindQueue()  # Measurement writes are batched into bulk writes
+        self.anomaly_results = {}  # Structured detector results from the last personal analysis
         
     def startup(self):
+        # Unique index on Name, so every lookup by name is an index hit instead of a collection scan
+        repository.ensure_indexes()
+        ensure_measurement_indexes()
+        asyncio.ensure_future(self.load_user_directory())
+        self.write_queue.start()
+
         self.main_window = toga.MainWindow(title=self.formal_name, size=(800, 600))  # Adjust size as needed
     
         # Main layout
@@ -141,6 +162,7 @@ class HeartRateApp(toga.App):
         self.user_name_label = toga.Label('Enter your name:', style=Pack(padding=(0, 5)))
         self.user_name_input = toga.TextInput(on_change=self.on_user_name_change, style=Pack(flex=1))
         self.user_name_box = toga.Box(children=[self.user_name_label, self.user_name_input], style=Pack(direction=ROW, padding=(0, 5)))
+        self.suggestions_label = toga.Label('', style=Pack(padding=(0, 5)))  # Autocomplete while typing
     
         # Measure Heart Rate button
         self.measure_heart_rate_button = toga.Button(
@@ -157,12 +179,16 @@ class HeartRateApp(toga.App):
         self.main_box.add(self.welcome_label)
         self.main_box.add(self.info_label)
         self.main_box.add(self.user_name_box)
+        self.main_box.add(self.suggestions_label)
         self.main_box.add(self.measure_heart_rate_button)
         self.main_box.add(self.personal_analysis_button)
     
         self.heart_rate_label = toga.Label('Heart Rate: Not measured yet', style=Pack(padding=10))
         self.main_box.add(self.heart_rate_label)
     
+        self.analysis_status_label = toga.Label('', style=Pack(padding=(0, 10)))
+        self.main_box.add(self.analysis_status_label)
+    
         # Add the Show HR Analysis button
         self.show_analysis_button = toga.Button('Show HR Analysis', on_press=self.show_hr_analysis, style=Pack(padding=10))
         self.main_box.add(self.show_analysis_button)
@@ -188,87 +214,33 @@ class HeartRateApp(toga.App):
 
 
 
-    def show_hr_analysis(self, widget):
-        
-        
-        users = fetch_data()
-        groups = group_users(users)
-        analysis = analyze_heart_rates(groups)
-        
-        calculate_and_print_heart_rate_averages(users)
-        # Remove any previous content from the main window
-        if self.image_view is not None:
-            self.main_box.remove(self.image_view)
-        
-        # Create a figure with three subplots
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(12, 4))  # Three side-by-side graphs
-        
-        # Plot heart rates by age on the first axis
-        ax1.clear()
-        for age, rates in analysis['age'].items():
-            ax1.scatter([age] * len(rates), rates, alpha=0.7, label=f'Age {age}')
-        ax1.set_xlabel('Age')
-        ax1.set_ylabel('Heart Rate')
-        ax1.set_title('Heart Rate vs Age')
-        ax1.legend()
-        ax1.grid(True)
-        
-        # Plot heart rates by gender on the second axis
-        ax2.clear()
-        for gender, rates in analysis['gender'].items():
-            ax2.scatter([gender] * len(rates), rates, alpha=0.7, label=f'Gender {gender}')
-        ax2.set_xlabel('Gender')
-        ax2.set_ylabel('Heart Rate')
-        ax2.set_title('Heart Rate vs Gender')
-        ax2.legend()
-        ax2.grid(True)
-    
-        # Plot average heart rates by gender on the second axis
-        # Create a bar plot for average heart rates
-        
-        ax2.set_xlabel('Gender')
-        ax2.set_ylabel('Average Heart Rate')
-        ax2.set_title('Average Heart Rate by Gender')
-        
-        # Plot heart rates by heart problems status on the third axis
-        ax3.clear()
-        for heart_problems_status, rates in analysis['heart_problems'].items():
-            ax3.scatter([heart_problems_status] * len(rates), rates, alpha=0.7, label=f'Heart Problems: {heart_problems_status}')
-        ax3.set_xlabel('Heart Problems Status')
-        ax3.set_ylabel('Heart Rate')
-        ax3.set_title('Heart Rate vs Heart Problems')
-        ax3.legend()
-        ax3.grid(True)
-    
-        # Adjust layout to prevent overlap
-        plt.tight_layout()
-        
-        # Save the plot to an image file
-        plot_image_path = 'hr_analysis_plot.png'
-        
-        # Ensure the directory exists and check permissions
-        if not os.access(os.path.dirname(plot_image_path), os.W_OK):
-            plot_image_path = os.path.join(os.getenv('TEMP', '.'), 'hr_analysis_plot.png')
-        
+    async def show_hr_analysis(self, widget):
+        # Stream users through per-cohort accumulators in the analysis pool instead of loading the whole collection
         try:
-            fig.savefig(plot_image_path, format='png')
-        except PermissionError:
-            print(f"PermissionError: Unable to save the file at {plot_image_path}.")
+            analysis = await self.analysis.submit(POPULATION_JOBS, stream_groups, fetch_data_batched())
+        except asyncio.CancelledError:
+            self.analysis_status_label.text = 'Population analysis was cancelled.'
             return
         
-        plt.close(fig)
-        
-        # Load the image into an ImageView
-        image = toga.Image(path=plot_image_path)
-        self.image_view = toga.ImageView(image, style=Pack(padding=12))
+        # Read the incrementally maintained aggregates instead of recomputing them
+        print_population_stats(load_population_stats())
         
-        # Add the new ImageView to the main box
+        # Drawn in the render worker, or straight from the cache when the data has not changed
+        if self.population_plot_mode == 'density':
+            png = await self.renderer.render(draw_population_density, histogram_plot_data(analysis), figsize=(15, 5))
+        else:
+            png = await self.renderer.render(draw_population_analysis, analysis_plot_data(analysis), figsize=(12, 4))
+        self.show_plot(png)
+
+    def show_plot(self, png):
+        """Replace the current plot with PNG bytes, without going through a file."""
+        if self.image_view is not None:
+            self.main_box.remove(self.image_view)
+        self.image_view = toga.ImageView(toga.Image(data=png), style=Pack(padding=12))
         self.main_box.add(self.image_view)
         
         # Refresh the main window
         self.main_window.content = self.scroll_container  # Change to set the scroll container as the main content
-        
-    
 
     async def show_personal_analysis(self, widget):
         user_name = self.user_name_input.value.strip()
@@ -277,65 +249,94 @@ class HeartRateApp(toga.App):
             await self.main_window.info_dialog('Error', 'Please enter your name to proceed with personal analysis.')
             return
     
-        user = self.read_user_by_name(user_name)
+        user = repository.find_user_with_series(self.user_directory.user_id(user_name), include_labels=True)
     
         if not user:
+            self.user_directory.invalidate(user_name, removed=True)
             await self.main_window.info_dialog('Error', 'You need to be in the database to perform this action.')
             return
     
         # Fetch personal heart rate data
-        heart_rate_data = {key: value for key, value in user.items() if key.startswith('HR at')}
+        heart_rate_data = HrSeries.from_document(user)
     
-        if not heart_rate_data:
+        if not len(heart_rate_data):
             await self.main_window.info_dialog('No Data', 'No heart rate data available for personal analysis.')
             return
     
         # Extract time and heart rate values for plotting
-        times = [datetime.strptime(key, 'HR at %H:%M (%A)') for key in heart_rate_data.keys()]
-        heart_rates = [float(value) for value in heart_rate_data.values()]
-    
-        # Detect anomalies using Isolation Forest
-        detect_anomalies(user['_id'])
-        
-        # Detect anomalies using OC-SVM
-        detect_anomalies_ocsvm(user['_id'])
+        times = heart_rate_data.times()
+        heart_rates = heart_rate_data.present_values().tolist()
+    
+        # Featurise the already loaded series once
+        features = user_features(user)
+        _, models = self.model_registry.models_for(user)
+        if models is not None:
+            # Pre-trained cohort models only need a predict call
+            self.anomaly_results = score_with_models(features, models)
+        else:
+            # No trained models yet: fit every detector on this user in the analysis pool
+            self.anomaly_results = await self.fit_user_detectors(user_name, features)
+            if self.anomaly_results is None:
+                return
+        print_anomalies(self.anomaly_results)
+
     
-        # Calculate the moving average forecast
-        moving_avg_value = moving_average_forecast(heart_rates, window_size=3)
+        # Set the number of future points to forecast
+        num_future_points = 10  # Adjust as needed
+
+        # Forecast with SMA, EWMA and seasonal naive and keep the method with the lowest backtest error.
+        # The stored week is exactly one season, which leaves seasonal naive nothing to backtest, so it
+        # is never picked here; SMA or EWMA wins
+        history = week_history(heart_rate_data, heart_rate_data.present_indices()[-1])
+        result = fleet_forecast(history, horizon=num_future_points, window=3)
+        forecast = result['forecasts'][METHODS[result['best'][0]]][0]
+        if np.isnan(forecast).any():
+            forecast = result['forecasts']['sma'][0]  # Seasonal naive has gaps where last week had no value
     
         # Prepare forecast
-        if moving_avg_value is not None:
-            # Set the number of future points to forecast
-            num_future_points = 10  # Adjust as needed
-    
-            # Prepare forecast as a list filled with the moving average value
-            forecast = [moving_avg_value] * num_future_points
+        if len(heart_rates) >= 3 and not np.isnan(forecast).any():
+            forecast = forecast.tolist()
             
-            # Plot the forecast
-            plot_moving_avg_forecast(times, heart_rates, forecast, num_future_points)
-    
-            # Load and display the generated plots
-            plot_file = 'C:/Users/PC/.spyder-py3/moving_avg_plot.png'  # Full path to the plot
-            if os.path.isfile(plot_file):
-                # Remove previous content
-                if self.image_view is not None:
-                    self.main_box.remove(self.image_view)
-    
-                # Load new image
-                image = toga.Image(path=plot_file)
-                self.image_view = toga.ImageView(image, style=Pack(padding=12))
-                self.main_box.add(self.image_view)
-            else:
-                await self.main_window.info_dialog('Error', f"Plot file '{plot_file}' does not exist.")
+            # Plot the forecast in the render worker; unchanged data comes straight from the cache
+            png = await self.renderer.render(draw_moving_avg_forecast, (times, heart_rates, forecast))
+            self.show_plot(png)
         else:
             await self.main_window.info_dialog('Error', 'Could not calculate moving average.')
-        
-        # Refresh the main window
-        self.main_window.content = self.scroll_container
+
+    async def fit_user_detectors(self, user_name, features):
+        """Fit every detector on one user's features in the analysis pool; None if cancelled."""
+        try:
+            raw_results = await self.analysis.run_all(
+                user_name, [(name, fn, features['X']) for name, fn in DETECTORS.items()],
+                progress=self.show_analysis_progress)
+        except asyncio.CancelledError:
+            # The user name changed while the detectors were running
+            self.analysis_status_label.text = ''
+            return None
+        return {
+            name: result if isinstance(result, Exception) else anomaly_result(features, *result)
+            for name, result in raw_results.items()
+        }
+
+    def show_analysis_progress(self, done, total, name):
+        if done == total:
+            self.analysis_status_label.text = ''
+        elif name is None:
+            self.analysis_status_label.text = f'Analysing... 0/{total}'
+        else:
+            self.analysis_status_label.text = f'Analysing... {done}/{total} ({name} done)'
 
     async def on_user_name_change(self, widget):
         if self.check_user_task and not self.check_user_task.done():
             self.check_user_task.cancel()  # Cancel the previous task if a new change is detected
+        
+        # Results computed for a previous user are no longer wanted
+        prefix = self.user_name_input.value.strip()
+        self.analysis.cancel_others(prefix, keep=(POPULATION_JOBS,))
+
+        # Suggestions come from the local name trie, without a database round trip
+        matches = self.user_directory.complete(prefix)
+        self.suggestions_label.text = f"Existing users: {', '.join(matches)}" if matches else ''
 
         self.check_user_task = asyncio.ensure_future(self.check_user_existence())
 
@@ -348,7 +349,12 @@ class HeartRateApp(toga.App):
             self.measure_heart_rate_button.enabled = False
             return
         
-        user = self.read_user_by_name(user_name)
+        # A name the loaded directory does not know goes straight to sign-up without a query; if another
+        # client created it meanwhile, the unique Name index turns the insert away (see submit_new_user)
+        if self.user_directory.known(user_name) is False:
+            user = None
+        else:
+            user = self.read_user_by_name(user_name)
 
         if user:
             await self.handle_existing_user(user)
@@ -357,7 +363,13 @@ class HeartRateApp(toga.App):
             await self.open_create_user_window(user_name)
 
     def read_user_by_name(self, name):
-        return self.users_collection.find_one({"Name": name})
+        # Profile fields only, cached by name; callers that need heart-rate slots ask the repository for them
+        return self.user_directory.lookup(name)
+
+    async def load_user_directory(self):
+        loop = asyncio.get_running_loop()
+        count = await loop.run_in_executor(None, self.user_directory.load)
+        print(f"Loaded {count} user names for autocomplete.")
 
     async def open_create_user_window(self, user_name):
         self.create_user_window = toga.Window(title='Create New User', size=(300, 400))
@@ -448,39 +460,9 @@ class HeartRateApp(toga.App):
             await self.create_user_window.error_dialog('Invalid Input', str(e))
             return
     
-        # Create heart rate data
-        heart_rate_data = {}
-        start_time = datetime.strptime("00:00", "%H:%M")
-        
-        for _ in range(48):  # 48 half-hour intervals in a day
-            for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]:
-                # Determine heart rate range based on age and gender
-                if 6 <= age <= 14:
-                    initial_hr = random.randint(70, 110)
-                elif 15 <= age <= 60:
-                    if gender == "male":
-                        initial_hr = random.randint(60, 100)
-                    else:
-                        initial_hr = random.randint(70, 110)
-                elif age > 60:
-                    initial_hr = random.randint(50, 90)
-                else:
-                    initial_hr = random.randint(60, 100)  # Default if age doesn't fit in any category
-                
-                # Adjust heart rate based on smoking or heart problems
-                if smoking_status or heart_problems:
-                    initial_hr = random.randint(80, 120)
-                    
-                # Adjust heart rate based on activity level
-                if activity_level == 3 or activity_level == 4:
-                    initial_hr += 5
-                elif activity_level == 5:
-                    initial_hr += 10
-    
-                hr_field = f"HR at {start_time.strftime('%H:%M')} ({day})"
-                heart_rate_data[hr_field] = initial_hr
-            
-            start_time += timedelta(minutes=30)
+        # Create heart rate data with the same rules the load-test seeder uses (seed_users.py)
+        rates = week_heart_rates(np.random.default_rng(), age, gender, smoking_status, heart_problems, activity_level)
+        heart_rate_data = dict(zip(SLOT_KEYS, rates[0].tolist()))
     
         # Create user data dictionary
         user_data = {
@@ -498,12 +480,20 @@ class HeartRateApp(toga.App):
         try:
             result = self.users_collection.insert_one(user_data)
             if result.inserted_id:
+                self.user_directory.add(user_data)  # insert_one set user_data['_id']
+                await asyncio.get_running_loop().run_in_executor(None, record_new_user, user_data,
+                                                                 HrSeries.from_legacy(heart_rate_data))
                 await self.create_user_window.dialog(toga.InfoDialog('Success', 'New user created successfully!'))
                 self.create_user_window.close()
                 self.measure_heart_rate_button.enabled = True
                 self.personal_analysis_button.enabled = True
             else:
                 await self.create_user_window.dialog(toga.ErrorDialog('Error', 'Failed to create new user.'))
+        except DuplicateKeyError:
+            # Created elsewhere since the directory was loaded: reading it adds the name to the trie
+            self.user_directory.invalidate(name)
+            self.user_directory.lookup(name)
+            await self.create_user_window.error_dialog('Error', f'A user named {name} already exists.')
         except Exception as e:
             await self.create_user_window.error_dialog('Error', f'An error occurred while creating the user: {e}')
 
@@ -516,63 +506,89 @@ class HeartRateApp(toga.App):
         """
         This function will measure the heart rate, either manually or automatically.
         """
-        # Perform any ARIMA forecasting or preprocessing if needed
-        
-        arima_forecast_for_user(self.user_name_input.value.strip(), 10)
+        # Start the ARIMA forecast in the analysis pool; the measurement does not wait for it
+        user_name = self.user_name_input.value.strip()
+        self.analysis.submit(user_name, arima_forecast_for_user, user_name, 10, self.model_cache)
     
-        cap = cv2.VideoCapture(0)  # Open the camera (0 is the default camera)
+        # Frames are read on a capture thread into a preallocated ring buffer
+        capture = CaptureThread(0, preview=self.show_camera_preview)  # 0 is the default camera
     
-        if not cap.isOpened():
+        if not capture.opened():
+            capture.stop()
             await self.main_window.info_dialog('Error', 'Could not open camera.')
             return
     
         if widget is not None:  # If called via button press, show dialog
             await self.main_window.info_dialog('Measure Heart Rate', 'Place your finger on the camera and press OK to continue.')
     
-        times = []
-        signal = []
         bpm = None
-        start_time = datetime.now()
+        estimator = StreamingBpmEstimator()
+        # Adaptive mode stops as soon as the estimate converges (4-20 s); otherwise measure for 10 seconds
+        stop_rule = AdaptiveStop() if self.adaptive_measurement else None
+        last_estimate = 0.0
     
         try:
-            while (datetime.now() - start_time).total_seconds() < 10:  # Measure for 10 seconds
-                ret, frame = cap.read()
-                if not ret:
-                    await self.main_window.info_dialog('Error', 'Failed to capture image.')
-                    break
-    
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                mean_intensity = np.mean(gray)
-                times.append(datetime.now())
-                signal.append(mean_intensity)
-    
-                cv2.imshow('Frame', frame)
-    
-                if cv2.waitKey(1) & 0xFF == ord('q'):
+            capture.start()
+            while capture.is_alive():
+                elapsed = capture.elapsed()
+                if stop_rule is None and elapsed >= 10:
                     break
-    
-            # Calculate BPM
-            if len(times) > 1:
-                times = np.array(times)
-                signal = np.array(signal)
-                fps = len(times) / (times[-1] - times[0]).total_seconds()
-                peaks, _ = find_peaks(signal, height=np.mean(signal), distance=int(fps * 0.6))
-                bpm = len(peaks) / (times[-1] - times[0]).total_seconds() * 60
-                self.heart_rate_label.text = f"Heart Rate: {bpm:.2f} BPM"
+                await asyncio.sleep(0.05)  # The event loop stays free while the thread captures
+                
+                # Publish a live estimate a few times per second
+                if elapsed - last_estimate >= 0.25:
+                    last_estimate = elapsed
+                    samples = capture.buffer.snapshot()
+                    live_bpm, confidence = estimator.update(samples[:, 0], samples[:, 1])
+                    covered = finger_coverage(samples)
+                    if not covered:
+                        self.heart_rate_label.text = 'Heart Rate: cover the camera completely with your finger...'
+                    elif live_bpm is not None:
+                        self.heart_rate_label.text = f"Heart Rate: {live_bpm:.1f} BPM (confidence {confidence:.2f}, measuring...)"
+                    if stop_rule is not None and stop_rule.should_stop(elapsed, live_bpm, confidence, covered):
+                        break
+            capture.stop()
+    
+            if capture.error:
+                await self.main_window.info_dialog('Error', capture.error)
+    
+            # Calculate BPM over the whole recording
+            samples = capture.buffer.snapshot()
+            bpm, confidence = estimate_bpm(samples[:, 0], samples[:, 1])
+            covered = bool(finger_coverage(samples))
+            if bpm is not None and (not covered or confidence < MIN_CONFIDENCE):
+                # Stopped at the time limit without a trustworthy signal: nothing is stored or checked
+                self.heart_rate_label.text = f"Heart Rate: unreliable reading (confidence {confidence:.2f})"
+                reason = 'your finger did not cover the camera' if not covered else 'the signal was too noisy'
+                await self.main_window.info_dialog(
+                    'Measurement Failed',
+                    f'The heart rate could not be measured reliably because {reason}. Please measure again.')
+                bpm = None
+            if bpm is not None:
+                duration = samples[-1, 0] - samples[0, 0]
+                self.heart_rate_label.text = f"Heart Rate: {bpm:.2f} BPM (confidence {confidence:.2f}, {duration:.1f} s)"
+                snr = spectral_snr_db(samples[:, 0], samples[:, 1])
+                measurement = {
+                    'BPM': bpm,
+                    'Duration (s)': round(float(duration), 2),
+                    'Confidence': round(confidence, 3),
+                    'SNR (dB)': None if snr is None else round(snr, 1),
+                    'Finger Covered': covered,
+                    'Time': datetime.now(),
+                }
     
                 # Update the database with the heart rate
                 user_name = self.user_name_input.value.strip()
-                try:
-                    await self.check_for_discrepancy(user_name, bpm)
-                finally:
-                    await self.update_heart_rate_in_db(user_name, bpm)
+                # Scored against the state from before the write; one atomic write returns the slot's previous value
+                user = await self.update_heart_rate_in_db(user_name, bpm, measurement)
+                if user is not None:
+                    await self.check_for_discrepancy(user_name, bpm, user['score'], user['slot'], user['previous'])
                     
         except Exception as e:
             await self.main_window.error_dialog('Error', f'An error occurred while measuring heart rate: {e}')
     
         finally:
-            cap.release()
-            cv2.destroyAllWindows()
+            capture.stop()
        
     async def periodic_measurement(self, interval=1800):#change this to 1800 (30 min)
     # Wait interval seconds before the first measurement
@@ -590,74 +606,96 @@ class HeartRateApp(toga.App):
 
 
         
-    async def update_heart_rate_in_db(self, user_name, heart_rate):
-        user = self.read_user_by_name(user_name)
-        
-        if user:
-            # Get current day of the week and time in 30-minute intervals
-            current_time = datetime.now()
-            day_of_week = current_time.strftime('%A')  
-            
-            # Round the time to the nearest 30-minute interval
-            hour = current_time.hour
-            minute = current_time.minute
+    async def update_heart_rate_in_db(self, user_name, heart_rate, measurement=None):
+        """Score and commit a measurement.
+
+        Returns the user's profile with the slot's 'previous' value, its 'slot'
+        index and the online detector's 'score' of the measurement, or None.
+        """
+        current_time = datetime.now()
+        index = slot_index(current_time)
+        time_slot = SLOT_KEYS[index]
+    
+        extra = {}
+        if measurement is not None:
+            # Duration and quality of the measurement are kept alongside the result
+            extra['Last Measurement'] = {**measurement, 'Slot': time_slot}
         
-            if minute < 30:
-                time_slot = f"HR at {hour:02}:00 ({day_of_week})"
-            else:
-                time_slot = f"HR at {hour:02}:30 ({day_of_week})"
+        try:
+            # Score first, then a single find_one_and_update writes the slot and returns only what it replaced
+            loop = asyncio.get_running_loop()
+            result, user = await loop.run_in_executor(None, score_and_commit, self.online_detector, user_name,
+                                                      self.user_directory.user_id(user_name), index, heart_rate, extra)
+        except Exception as e:
+            await self.main_window.error_dialog('Error', f'Failed to update heart rate: {e}')
+            return None
         
-            # Prepare the update query
-            update_query = {time_slot: heart_rate}
-            
-            try:
-                # Update the user's heart rate at the specific time slot
-                result = self.users_collection.update_one(
-                    {"Name": user_name},
-                    {"$set": update_query}
-                )
-                
-                if result.modified_count > 0:
-                    await self.main_window.info_dialog('Success', f'Heart rate of {heart_rate:.2f} BPM updated at {time_slot} for {user_name}.')
-                else:
-                    await self.main_window.error_dialog('Update Failed', f'Failed to update heart rate for {user_name}. No changes made.')
-                    
-            except Exception as e:
-                await self.main_window.error_dialog('Error', f'Failed to update heart rate: {e}')
-        else:
+        if user is None:
+            # The cached _id or trie entry is stale (e.g. the user was removed by another client)
+            self.user_directory.invalidate(user_name, removed=True)
             await self.main_window.error_dialog('User Not Found', f'User {user_name} does not exist.')
+            return None
+        # The write returned the current profile, so the cached one is refreshed for free
+        self.user_directory.add(user)
+        
+        # The history append and the population aggregates go through the write-behind queue
+        # One write id per measurement makes both idempotent, so the queue can retry them safely
+        write_id = ObjectId()
+        await self.write_queue.put(self.heart_rate_collection,
+                                   measurement_update(user['_id'], current_time, heart_rate, write_id))
+        totals = user.get('totals') or {}
+        for operation in slot_change_operations(user, user['previous'], heart_rate, totals.get('sum', 0),
+                                                totals.get('count', 0), write_id):
+            await self.write_queue.put(repository.population_stats_collection(), operation)
+        
+        # Extend the cached forecasting model with the new observation instead of refitting. This saves a
+        # pickle and sometimes refits, so it runs in a worker thread rather than on the event loop
+        try:
+            await loop.run_in_executor(None, self.model_cache.update, user_name, [heart_rate])
+        except Exception as e:
+            print(f"Could not update the forecasting model of {user_name}: {e}")
+        # A status line instead of a dialog per write, so periodic measurements do not block
+        self.analysis_status_label.text = f'Heart rate of {heart_rate:.2f} BPM saved at {time_slot} for {user_name}.'
+        user['slot'] = index
+        user['score'] = result
+        return user
+
+    async def check_for_discrepancy(self, user_name, measured_bpm, result, index, previous_bpm=None):
+        """Fold a measurement into the online state and ask for a reason when it was scored anomalous for its slot.
 
-    async def check_for_discrepancy(self, user_name, measured_bpm):
-        user = self.read_user_by_name(user_name)
+        `result` is the online detector's score taken before the measurement was written.
+        """
+        # Fold the measurement into the online state before any dialog waits on the user; persisting
+        # the state is a MongoDB write, so it runs in a worker thread like score_and_commit
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.online_detector.update, user_name, index,
+                                                             measured_bpm)
+        except Exception as e:
+            print(f"Could not update the online anomaly state of {user_name}: {e}")
+        
+        if result is not None:
+            expected = result['expected']
+            is_anomaly = result['is_anomaly']
+        elif previous_bpm is not None:
+            # No online state: compare with the value this measurement replaced
+            expected = previous_bpm
+            is_anomaly = abs(previous_bpm - measured_bpm) > LEGACY_THRESHOLD
+        else:
+            print("No stored heart rate to compare with.")
+            return
         
-        if user:
-            current_time = datetime.now()
-            day_of_week = current_time.strftime('%A')
-            
-            hour = current_time.hour
-            minute = current_time.minute
-            
-            if minute < 30:
-                time_slot = f"HR at {hour:02}:00 ({day_of_week})"
-            else:
-                time_slot = f"HR at {hour:02}:30 ({day_of_week})"
-            
-            stored_heart_rate = user.get(time_slot)
-            
-            print(f"Measured BPM: {measured_bpm}, Stored HR: {stored_heart_rate}, Discrepancy: {abs(stored_heart_rate - measured_bpm)}")
+        print(f"Measured BPM: {measured_bpm}, Previous HR: {previous_bpm}, Expected HR: {expected:.1f}")
+        
+        if is_anomaly:
+            heart_rate_status = 'High' if measured_bpm > expected else 'Low'
             
-            if stored_heart_rate is not None and abs(stored_heart_rate - measured_bpm) > 30:
-                heart_rate_status = 'High' if measured_bpm < stored_heart_rate else 'Low'
+            reason = await self.ask_for_reason(heart_rate_status)
+            if reason:
+                user_name = self.user_name_input.value.strip()
+                
                 
-                reason = await self.ask_for_reason(heart_rate_status)
-                if reason:
-                    user_name = self.user_name_input.value.strip()
-                    
-                    
-            else:
-                print("No significant discrepancy found.")
         else:
-            await self.main_window.error_dialog('User Not Found', f'User {user_name} does not exist.')
+            print("No significant discrepancy found.")
 
     
     async def ask_for_reason(self, heart_rate_status):
@@ -723,6 +761,13 @@ class HeartRateApp(toga.App):
 
         
 
+    def on_exit(self):
+        # Persist whatever the write-behind queue still holds before the app closes
+        self.write_queue.flush_sync()
+        print(f"Write-behind queue at exit: {self.write_queue.stats()}")
+        return True
+
+
 def main():
     return HeartRateApp('Heart Rate Monitoring App', 'org.example.heart_rate_app')
 
@@ -0,0 +1,235 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from hr_series import HrSeries, SLOTS_PER_DAY
+from write_behind import bulk_write_idempotent
+import repository
+
+# measurement_store.py
+# Append-only measurement history in the heart_rate collection, using the
+# bucket pattern: one document per user per day,
+#
+#   {user_id, day, count, sum, min, max, offsets: [seconds into the day, ...], bpm: [...]}
+#
+# A new measurement is one upsert that $pushes onto that day's arrays and
+# updates the summary fields, so nothing is ever overwritten. Range queries
+# read only the buckets of the days they cover, and daily analytics can use
+# the summary fields without unpacking the arrays. The compound index on
+# (user_id, day) serves both. Every measurement carries a write id that is
+# pushed with it, so re-sending an append that already happened is a no-op.
+#
+#   python measurement_store.py migrate [--week-start 2024-01-01]
+
+# Set on a user document once all of its legacy slots are in day buckets
+MIGRATED_FIELD = 'Slots Migrated'
+
+
+def ensure_measurement_indexes():
+    collection = repository.heart_rate_collection()
+    collection.create_index([('user_id', ASCENDING), ('day', ASCENDING)], unique=True, name='user_day')
+    collection.create_index([('day', ASCENDING)], name='day')  # Population-wide queries over a date range
+
+
+def day_start(dt):
+    return datetime(dt.year, dt.month, dt.day)
+
+
+def _bucket_update(user_id, timestamp, bpm, write_id=None):
+    # (filter, update) that appends one measurement to its day bucket, at most once per write id.
+    # Once applied the filter no longer matches, and the upsert fails on the unique user_day index.
+    day = day_start(timestamp)
+    if write_id is None:
+        write_id = ObjectId()
+    return (
+        {'user_id': user_id, 'day': day, 'write_ids': {'$ne': write_id}},
+        {
+            '$push': {'offsets': int((timestamp - day).total_seconds()), 'bpm': float(bpm), 'write_ids': write_id},
+            '$inc': {'count': 1, 'sum': float(bpm)},
+            '$min': {'min': float(bpm)},
+            '$max': {'max': float(bpm)},
+            '$setOnInsert': {'source': 'measurement'},
+        },
+    )
+
+
+def measurement_update(user_id, timestamp, bpm, write_id=None):
+    """UpdateOne that appends one measurement to its day bucket, creating the bucket if needed.
+
+    The operation is idempotent: sent twice with the same `write_id` (a new
+    ObjectId by default) it is applied once.
+    """
+    return UpdateOne(*_bucket_update(user_id, timestamp, bpm, write_id), upsert=True)
+
+
+def record_measurement(user_id, timestamp, bpm):
+    """Append a single measurement to the store."""
+    repository.heart_rate_collection().update_one(*_bucket_update(user_id, timestamp, bpm), upsert=True)
+
+
+def record_measurements(items):
+    """Append many (user_id, timestamp, bpm) measurements in one unordered bulk write."""
+    operations = [measurement_update(user_id, timestamp, bpm) for user_id, timestamp, bpm in items]
+    if operations:
+        return repository.heart_rate_collection().bulk_write(operations, ordered=False)
+    return None
+
+
+def _bucket_query(user_id, start, end):
+    return {'user_id': user_id, 'day': {'$gte': day_start(start), '$lte': day_start(end)}}
+
+
+def find_measurements(user_id, start, end):
+    """(datetime64[s] times, float bpm) of a user's measurements in [start, end), oldest first."""
+    buckets = repository.heart_rate_collection().find(
+        _bucket_query(user_id, start, end), {'day': 1, 'offsets': 1, 'bpm': 1, '_id': 0}
+    ).sort('day', ASCENDING)
+    times = []
+    values = []
+    for bucket in buckets:
+        times.append(np.datetime64(bucket['day'], 's') + np.asarray(bucket['offsets'], dtype='timedelta64[s]'))
+        values.append(np.asarray(bucket['bpm'], dtype=np.float64))
+    if not times:
+        return np.array([], dtype='datetime64[s]'), np.array([])
+    times = np.concatenate(times)
+    values = np.concatenate(values)
+    order = np.argsort(times, kind='stable')
+    times, values = times[order], values[order]
+    keep = (times >= np.datetime64(start, 's')) & (times < np.datetime64(end, 's'))
+    return times[keep], values[keep]
+
+
+def daily_summaries(user_id, start, end):
+    """Per-day count, mean, min and max from the bucket summaries only (the arrays are not read)."""
+    buckets = repository.heart_rate_collection().find(
+        _bucket_query(user_id, start, end), {'day': 1, 'count': 1, 'sum': 1, 'min': 1, 'max': 1, '_id': 0}
+    ).sort('day', ASCENDING)
+    return [
+        {'day': b['day'], 'count': b['count'], 'mean': b['sum'] / b['count'] if b['count'] else None,
+         'min': b.get('min'), 'max': b.get('max')}
+        for b in buckets
+    ]
+
+
+def legacy_buckets(user_id, series, week_start):
+    """Day bucket documents for the legacy week of an HrSeries, dated in the week starting at `week_start`."""
+    buckets = []
+    for day in range(7):
+        slots = np.arange(day * SLOTS_PER_DAY, (day + 1) * SLOTS_PER_DAY)
+        present = slots[series.mask[slots]]
+        if not len(present):
+            continue
+        bpm = series.values[present].astype(np.float64)
+        buckets.append({
+            'user_id': user_id,
+            'day': week_start + timedelta(days=day),
+            'offsets': ((present - day * SLOTS_PER_DAY) * 1800).tolist(),
+            'bpm': bpm.tolist(),
+            'count': len(bpm),
+            'sum': float(bpm.sum()),
+            'min': float(bpm.min()),
+            'max': float(bpm.max()),
+        })
+    return buckets
+
+
+def _merge_bucket(bucket, write_id):
+    # Upsert that merges a migrated bucket into whatever the day already holds, once per write id
+    return UpdateOne(
+        {'user_id': bucket['user_id'], 'day': bucket['day'], 'write_ids': {'$ne': write_id}},
+        {
+            '$push': {'offsets': {'$each': bucket['offsets']}, 'bpm': {'$each': bucket['bpm']}, 'write_ids': write_id},
+            '$inc': {'count': bucket['count'], 'sum': bucket['sum']},
+            '$min': {'min': bucket['min']},
+            '$max': {'max': bucket['max']},
+            '$set': {'migrated': True},
+            '$setOnInsert': {'source': 'migrated'},
+        },
+        upsert=True,
+    )
+
+
+def migrate_legacy_slots(week_start, batch_size=500):
+    """Copy every user's "HR at ..." slots into day buckets; users already migrated are skipped.
+
+    The legacy week has no dates, so slot i is placed at week_start + i * 30 minutes.
+    A user is marked with MIGRATED_FIELD only once all of their buckets are
+    written. The merges carry a write id for the week, so re-running after an
+    interruption completes partly migrated users without duplicating buckets.
+    """
+    ensure_measurement_indexes()
+    collection = repository.heart_rate_collection()
+    write_id = f"legacy-slots-{week_start:%Y-%m-%d}"
+    started = time.perf_counter()
+    users = migrated = buckets_written = 0
+
+    batch = []
+
+    def flush():
+        nonlocal migrated, buckets_written
+        operations = []
+        owners = []
+        for user_id, series in batch:
+            for bucket in legacy_buckets(user_id, series, week_start):
+                operations.append(_merge_bucket(bucket, write_id))
+                owners.append(user_id)
+        # A duplicate key means the bucket was merged by an earlier, interrupted run, or that the upsert
+        # lost a race with a live measurement creating the same day; the re-send tells them apart
+        errors = bulk_write_idempotent(collection, operations)
+        failed = set()
+        for error in errors:
+            failed.add(owners[error['index']])
+            print(f"Could not migrate a bucket of user {owners[error['index']]}: {error.get('errmsg')}")
+        buckets_written += len(operations) - len(errors)
+        done = [user_id for user_id, _ in batch if user_id not in failed]
+        if done:
+            repository.users_collection().update_many({'_id': {'$in': done}}, {'$set': {MIGRATED_FIELD: week_start}})
+            migrated += len(done)
+        batch.clear()
+
+    projection = {**repository.HR_PROJECTION, MIGRATED_FIELD: 1}
+    for user in repository.iter_users(projection, batch_size=batch_size):
+        users += 1
+        if user.get(MIGRATED_FIELD) is not None:
+            continue
+        series = HrSeries.from_document(user)
+        if len(series):
+            batch.append((user['_id'], series))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"Migrated {migrated} of {users} users into {buckets_written} day buckets in {elapsed:.1f}s "
+          f"({users / elapsed if elapsed else 0:.0f} users/s).")
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bucketed heart-rate measurement store.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate = commands.add_parser('migrate', help='Copy the legacy "HR at ..." slots into day buckets')
+    migrate.add_argument('--week-start', help='Monday the legacy week is dated to (YYYY-MM-DD); default: last week')
+    migrate.add_argument('--batch-size', type=int, default=500)
+    commands.add_parser('indexes', help='Create the bucket indexes')
+    args = parser.parse_args()
+
+    if args.command == 'indexes':
+        ensure_measurement_indexes()
+    else:
+        if args.week_start:
+            week_start = datetime.strptime(args.week_start, '%Y-%m-%d')
+        else:
+            # Last week, so no legacy slot is dated in the future or into the days the app is writing now
+            today = day_start(datetime.now())
+            week_start = today - timedelta(days=today.weekday() + 7)
+        if week_start.weekday() != 0:
+            parser.error('--week-start must be a Monday')
+        migrate_legacy_slots(week_start, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
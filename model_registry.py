@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+import sklearn
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import OneClassSVM
+from hr_series import HrSeries
+from population_stats import AGE_GROUPS, get_age_group
+from anomaly_engine import FEATURE_NAMES, build_features
+from IsolationForests import CONTAMINATION_RATE
+from OCSVM import NU
+import repository
+
+# model_registry.py
+# Anomaly models trained once on the population instead of per request. An
+# offline job fits an Isolation Forest and an OC-SVM per cohort (age group x
+# gender x heart problems) and writes them as a new numbered version:
+#
+#   anomaly_models/LATEST                 current version number
+#   anomaly_models/v<N>/metadata.json     cohorts, sample sizes, parameters
+#   anomaly_models/v<N>/<cohort>.pkl      {detector name: {'scaler', 'model'}}
+#
+# The app loads a cohort's models lazily and keeps them in memory, so scoring
+# a user is a predict call rather than a fit.
+
+DEFAULT_REGISTRY_DIR = 'anomaly_models'
+ALL_USERS = 'all'  # Population-wide models, used when a user's cohort has none
+
+
+def cohort_key(profile):
+    """Model cohort of a user profile, e.g. '30-40_male_False'."""
+    age = profile.get('Age')
+    # get_age_group files every age outside its groups under 90+, children included
+    age_group = get_age_group(age) if isinstance(age, int) and age >= AGE_GROUPS[0][0] else 'unknown'
+    gender = profile.get('Gender') if profile.get('Gender') in ['male', 'female'] else 'unknown'
+    return f"{age_group}_{gender}_{profile.get('Heart Problems')}"
+
+
+class ModelRegistry:
+    """Versioned on-disk store of per-cohort anomaly models with an in-process LRU cache."""
+
+    def __init__(self, root=DEFAULT_REGISTRY_DIR, capacity=64):
+        self.root = root
+        self.capacity = capacity
+        self._models = OrderedDict()
+        self._metadata = {}
+        self._lock = threading.RLock()  # Used from the event loop and from analysis worker threads
+
+    def _version_dir(self, version):
+        return os.path.join(self.root, f"v{version}")
+
+    def latest_version(self):
+        """Current version number, or None if nothing has been trained yet."""
+        try:
+            with open(os.path.join(self.root, 'LATEST')) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(name[1:]) for name in os.listdir(self.root) if name[:1] == 'v' and name[1:].isdigit())
+
+    def metadata(self, version=None):
+        version = self.latest_version() if version is None else version
+        if version is None:
+            return None
+        with self._lock:
+            if version not in self._metadata:
+                try:
+                    with open(os.path.join(self._version_dir(version), 'metadata.json')) as f:
+                        self._metadata[version] = json.load(f)
+                except (OSError, ValueError):
+                    return None
+            return self._metadata[version]
+
+    def load(self, cohort, version=None):
+        """{detector name: {'scaler', 'model'}} for a cohort, or None if it has no models."""
+        version = self.latest_version() if version is None else version
+        if version is None:
+            return None
+        key = (version, cohort)
+        with self._lock:
+            models = self._models.get(key)
+            if models is not None:
+                self._models.move_to_end(key)
+                return models
+            metadata = self.metadata(version)
+            if metadata is None or cohort not in metadata['cohorts']:
+                return None
+            with open(os.path.join(self._version_dir(version), metadata['cohorts'][cohort]['file']), 'rb') as f:
+                models = pickle.load(f)
+            self._models[key] = models
+            while len(self._models) > self.capacity:
+                self._models.popitem(last=False)
+            return models
+
+    def models_for(self, profile, version=None):
+        """(cohort, models) for a user profile, falling back to the population-wide models."""
+        cohort = cohort_key(profile)
+        models = self.load(cohort, version)
+        if models is None:
+            cohort, models = ALL_USERS, self.load(ALL_USERS, version)
+        return (cohort, models) if models is not None else (None, None)
+
+    def save_version(self, cohort_models, metadata):
+        """Write {cohort: models} as a new version and make it the latest; returns the version number."""
+        with self._lock:
+            version = max(self.versions(), default=0) + 1
+            directory = self._version_dir(version)
+            os.makedirs(directory)
+            metadata = {**metadata, 'version': version, 'cohorts': dict(metadata.get('cohorts', {}))}
+            for cohort, models in cohort_models.items():
+                filename = f"{cohort}.pkl"
+                with open(os.path.join(directory, filename), 'wb') as f:
+                    pickle.dump(models, f, protocol=pickle.HIGHEST_PROTOCOL)
+                metadata['cohorts'].setdefault(cohort, {})['file'] = filename
+            with open(os.path.join(directory, 'metadata.json'), 'w') as f:
+                json.dump(metadata, f, indent=2)
+            # Readers switch to the new version only once every file is in place
+            latest = os.path.join(self.root, 'LATEST')
+            with open(latest + '.tmp', 'w') as f:
+                f.write(str(version))
+            os.replace(latest + '.tmp', latest)
+            return version
+
+    def clear_cache(self):
+        with self._lock:
+            self._models.clear()
+            self._metadata.clear()
+
+
+class Reservoir:
+    """Uniform random sample of at most `size` feature rows from a stream of row blocks.
+
+    Storage grows geometrically as rows arrive, so small cohorts only hold
+    what they have seen rather than `size` preallocated rows.
+    """
+
+    def __init__(self, size, width, rng):
+        self.size = size
+        self.rows = np.empty((0, width))
+        self.seen = 0
+        self.rng = rng
+
+    def _reserve(self, needed):
+        if needed > len(self.rows):
+            grown = np.empty((min(max(needed, 2 * len(self.rows), 1024), self.size), self.rows.shape[1]))
+            filled = min(self.seen, self.size)
+            grown[:filled] = self.rows[:filled]
+            self.rows = grown
+
+    def add(self, block):
+        size = self.size
+        filled = min(self.seen, size)
+        direct = block[:max(size - filled, 0)]
+        self._reserve(filled + len(direct))
+        self.rows[filled:filled + len(direct)] = direct
+        self.seen += len(direct)
+        rest = block[len(direct):]
+        if len(rest):
+            # Algorithm R, vectorized: row number k replaces a random slot with probability size / k
+            positions = self.rng.integers(0, self.seen + np.arange(1, len(rest) + 1))
+            keep = positions < size
+            self.rows[positions[keep]] = rest[keep]
+            self.seen += len(rest)
+
+    def sample(self):
+        return self.rows[:min(self.seen, self.size)]
+
+
+def fit_detectors(X, ocsvm_samples, rng):
+    """Fit both detectors on one cohort's raw feature rows."""
+    scaler = StandardScaler().fit(X)
+    scaled = scaler.transform(X)
+    iso_forest = IsolationForest(contamination=CONTAMINATION_RATE, random_state=42).fit(scaled)
+    # Kernel OC-SVM training is quadratic in the rows, so it gets a smaller subsample
+    subset = scaled[rng.choice(len(scaled), min(len(scaled), ocsvm_samples), replace=False)]
+    ocsvm = OneClassSVM(nu=NU).fit(subset)
+    return {
+        'Isolation Forest': {'scaler': scaler, 'model': iso_forest},
+        'OC-SVM': {'scaler': scaler, 'model': ocsvm},
+    }
+
+
+def train_cohort_models(registry=None, max_samples=50000, ocsvm_samples=5000, min_users=20, seed=0):
+    """Fit per-cohort models on the whole population and save them as a new registry version."""
+    registry = registry or ModelRegistry()
+    rng = np.random.default_rng(seed)
+    width = len(FEATURE_NAMES)
+    reservoirs = {}
+    users = {}
+    started = time.perf_counter()
+
+    for user in repository.iter_users():
+        series = HrSeries.from_document(user)
+        if len(series) < 2:
+            continue
+        features = build_features(series)
+        for cohort in (cohort_key(user), ALL_USERS):
+            reservoir = reservoirs.get(cohort)
+            if reservoir is None:
+                reservoir = reservoirs[cohort] = Reservoir(max_samples, width, rng)
+            reservoir.add(features)
+            users[cohort] = users.get(cohort, 0) + 1
+
+    cohort_models = {}
+    cohorts = {}
+    for cohort, reservoir in reservoirs.items():
+        if users[cohort] < min_users and cohort != ALL_USERS:
+            continue  # Too few users for a cohort model; they are scored by the population model
+        sample = reservoir.sample()
+        cohort_models[cohort] = fit_detectors(sample, ocsvm_samples, rng)
+        cohorts[cohort] = {'users': users[cohort], 'rows': reservoir.seen, 'trained_rows': len(sample)}
+        print(f"Trained {cohort}: {users[cohort]} users, {len(sample)} of {reservoir.seen} rows")
+
+    if not cohort_models:
+        print("No users with heart-rate data; nothing to train.")
+        return None
+
+    version = registry.save_version(cohort_models, {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'feature_names': list(FEATURE_NAMES),
+        'parameters': {'contamination': CONTAMINATION_RATE, 'nu': NU, 'max_samples': max_samples,
+                       'ocsvm_samples': ocsvm_samples, 'min_users': min_users, 'seed': seed},
+        'sklearn_version': sklearn.__version__,
+        'cohorts': cohorts,
+    })
+    print(f"Saved model version {version} with {len(cohort_models)} cohorts "
+          f"in {time.perf_counter() - started:.1f}s.")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train per-cohort anomaly models into the model registry.')
+    parser.add_argument('--registry', default=DEFAULT_REGISTRY_DIR)
+    parser.add_argument('--max-samples', type=int, default=50000, help='Rows kept per cohort for training')
+    parser.add_argument('--ocsvm-samples', type=int, default=5000, help='Rows the OC-SVM is fitted on')
+    parser.add_argument('--min-users', type=int, default=20, help='Smallest cohort that gets its own models')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    train_cohort_models(ModelRegistry(args.registry), args.max_samples, args.ocsvm_samples, args.min_users,
+                        args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,39 +21,48 @@ def moving_average_forecast(hr_data, window_size=3):
         print(f"Moving Average could not be used due to: {e}")
         return None
 
+def forecast_times(hr_times, num_forecast_points):
+    """Half-hourly time points following the last historical time."""
+    last_time = hr_times[-1]
+    return [last_time + timedelta(minutes=30 * (i + 1)) for i in range(num_forecast_points)]
+
+def draw_moving_avg_forecast(fig, data):
+    """Draw history and forecast on a matplotlib Figure; `data` is (hr_times, hr_data, forecast)."""
+    hr_times, hr_data, forecast = data
+    future_times = forecast_times(hr_times, len(forecast))
+
+    # Convert datetime objects to time strings for plotting
+    hr_times_str = [t.strftime('%H:%M') for t in hr_times]
+    future_times_str = [t.strftime('%H:%M') for t in future_times]
+
+    ax = fig.subplots()
+    ax.plot(hr_times_str, hr_data, label='Historical Heart Rate Data', marker='o')
+
+    # Plot forecasted values
+    ax.plot(future_times_str, forecast, 'gx--', label='Moving Average Forecasted Heart Rate', markersize=10)
+
+    ax.set_title('Moving Average Heart Rate Forecast')
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Heart Rate')
+    ax.legend()
+    ax.grid(True)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+
 def plot_moving_avg_forecast(hr_times, hr_data, forecast, num_forecast_points):
     try:
         if not hr_times or not hr_data or forecast is None:
             raise ValueError("Insufficient data for plotting.")
-        
-        # Generate future time points based on the number of forecasts
-        last_time = hr_times[-1]
-        future_times = [last_time + timedelta(minutes=30 * (i + 1)) for i in range(num_forecast_points)]
-        
-        # Convert datetime objects to time strings for plotting
-        hr_times_str = [t.strftime('%H:%M') for t in hr_times]
-        future_times_str = [t.strftime('%H:%M') for t in future_times]
-
-        # Ensure forecast has the same length as future_times
-        if len(future_times) != len(forecast):
-            forecast = [forecast[0]] * len(future_times)  # Fill with the last moving average value
-
-        plt.figure(figsize=(12, 6))
-        plt.plot(hr_times_str, hr_data, label='Historical Heart Rate Data', marker='o')
-        
-        # Plot forecasted values
-        plt.plot(future_times_str, forecast, 'gx--', label='Moving Average Forecasted Heart Rate', markersize=10)
-        
-        plt.title('Moving Average Heart Rate Forecast')
-        plt.xlabel('Time')
-        plt.ylabel('Heart Rate')
-        plt.legend()
-        plt.grid(True)
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        
+
+        # Ensure forecast has one value per future time point
+        if num_forecast_points != len(forecast):
+            forecast = [forecast[0]] * num_forecast_points  # Fill with the last moving average value
+
+        fig = plt.figure(figsize=(12, 6))
+        draw_moving_avg_forecast(fig, (hr_times, hr_data, forecast))
+
         # Save the plot to a file
-        plt.savefig('moving_avg_plot.png')
-        plt.close()
+        fig.savefig('moving_avg_plot.png')
+        plt.close(fig)
     except Exception as e:
         print(f"Plotting could not be done due to: {e}")
@@ -0,0 +1,280 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from bson.binary import Binary
+from hr_series import NUM_SLOTS, SLOTS_PER_DAY
+import repository
+
+# online_anomaly.py
+# Constant-time anomaly scoring of single new measurements. Every user keeps a
+# small running state per half-hour slot (EWMA mean and variance, plus a
+# frugal streaming median and MAD that outliers barely move), and optionally
+# the mass profile of a half-space-trees forest. Scoring a value reads one slot
+# (and one root-to-leaf path per tree) and updating it writes them in place,
+# so nothing is refitted on the user's history.
+
+# Rows of the per-slot state array
+COUNT, MEAN, VAR, MEDIAN, MAD = range(5)
+STATE_ROWS = 5
+
+MAD_TO_STD = 1.4826  # MAD of a normal distribution times this is its standard deviation
+LEGACY_THRESHOLD = 30  # BPM difference check_for_discrepancy used before there was any state
+
+
+class HalfSpaceTrees:
+    """Streaming half-space-trees forest (Tan, Ting & Liu 2011) over (value, time of day).
+
+    The random tree structure is shared by every user and rebuilt from the
+    seed; a user only owns two mass arrays. Masses counted over the latest
+    `window_size` points become the reference profile the next points are
+    scored against.
+    """
+
+    def __init__(self, n_trees=10, depth=8, window_size=NUM_SLOTS, size_limit=8, seed=7, min_value=30.0, max_value=220.0):
+        self.n_trees = n_trees
+        self.depth = depth
+        self.window_size = window_size
+        self.size_limit = size_limit
+        self.min_value = min_value
+        self.max_value = max_value
+        rng = np.random.default_rng(seed)
+        n_nodes = 2 ** (depth + 1) - 1
+        self.split_dim = np.zeros((n_trees, n_nodes), dtype=np.int64)
+        self.split_value = np.zeros((n_trees, n_nodes))
+        for tree in range(n_trees):
+            self._build(rng, tree, 0, 0, np.zeros(2), np.ones(2))
+
+    def _build(self, rng, tree, node, level, low, high):
+        if level == self.depth:
+            return
+        dim = rng.integers(2)
+        split = rng.uniform(low[dim], high[dim])  # Random cut of the node's box, so trees differ
+        self.split_dim[tree, node] = dim
+        self.split_value[tree, node] = split
+        left_high, right_low = high.copy(), low.copy()
+        left_high[dim] = split
+        right_low[dim] = split
+        self._build(rng, tree, 2 * node + 1, level + 1, low, left_high)
+        self._build(rng, tree, 2 * node + 2, level + 1, right_low, high)
+
+    def new_state(self):
+        n_nodes = self.split_dim.shape[1]
+        return {'reference': np.zeros((self.n_trees, n_nodes), dtype=np.int32),
+                'latest': np.zeros((self.n_trees, n_nodes), dtype=np.int32), 'count': 0, 'typical': None}
+
+    def point(self, slot, value):
+        scaled = (value - self.min_value) / (self.max_value - self.min_value)
+        return np.array([min(max(scaled, 0.0), 1.0), (slot % SLOTS_PER_DAY) / SLOTS_PER_DAY])
+
+    def path(self, x):
+        """Node indices from root to leaf in every tree, shape (n_trees, depth + 1)."""
+        trees = np.arange(self.n_trees)
+        nodes = np.zeros(self.n_trees, dtype=np.int64)
+        path = [nodes]
+        for _ in range(self.depth):
+            right = x[self.split_dim[trees, nodes]] >= self.split_value[trees, nodes]
+            nodes = 2 * nodes + 1 + right
+            path.append(nodes)
+        return np.stack(path, axis=1)
+
+    def mass(self, state, x):
+        """Reference mass profile of x summed over trees, relative to the window size; None before a reference exists."""
+        reference = state['reference']
+        if not reference[:, 0].any():
+            return None
+        path = self.path(x)
+        masses = np.take_along_axis(reference, path, axis=1)
+        # Stop in each tree at the first node whose reference mass is below the size limit
+        small = masses < self.size_limit
+        stop = np.where(small.any(axis=1), small.argmax(axis=1), self.depth)
+        mass = masses[np.arange(self.n_trees), stop] * 2.0 ** stop
+        return float(mass.sum() / (self.n_trees * self.window_size))
+
+    def score(self, state, x):
+        """Anomaly score in [0, 1] (higher is more anomalous), or None before a reference window exists.
+
+        The mass of x is compared with the typical mass of recently seen points,
+        so 0.9 means x sits in a region ten times sparser than usual.
+        """
+        mass = self.mass(state, x)
+        if mass is None or state['typical'] is None:
+            return None
+        return float(1.0 - min(mass / state['typical'], 1.0))
+
+    def update(self, state, x):
+        mass = self.mass(state, x)
+        if mass is not None and mass > 0:
+            # Geometric running mean of the mass of incoming points
+            typical = state['typical']
+            state['typical'] = mass if typical is None else float(np.exp(0.98 * np.log(typical) + 0.02 * np.log(mass)))
+        path = self.path(x)
+        np.add.at(state['latest'], (np.arange(self.n_trees)[:, None], path), 1)
+        state['count'] += 1
+        if state['count'] >= self.window_size:
+            state['reference'] = state['latest']
+            state['latest'] = np.zeros_like(state['latest'])
+            state['count'] = 0
+
+
+def initial_slot_state(series, min_std=5.0):
+    """Per-slot state seeded from a user's stored week: each stored value counts as one observation."""
+    state = np.zeros((STATE_ROWS, NUM_SLOTS))
+    values = series.present_values().astype(np.float64)
+    mean = values.mean() if len(values) else 70.0
+    std = max(values.std() if len(values) > 1 else 0.0, min_std)
+    state[MEAN] = mean
+    state[MEDIAN] = mean
+    state[MEAN, series.mask] = series.values[series.mask]
+    state[MEDIAN, series.mask] = series.values[series.mask]
+    state[COUNT, series.mask] = 1
+    state[VAR] = std ** 2  # Prior spread until a slot has seen real variation
+    state[MAD] = std / MAD_TO_STD
+    return state
+
+
+class OnlineAnomalyDetector:
+    """Per-user, per-slot streaming anomaly scores, kept in memory and persisted in MongoDB.
+
+    score() is a pure read and update() changes the state in place; both touch
+    one slot, so their cost does not grow with the user's history.
+    """
+
+    def __init__(self, alpha=0.2, threshold=3.5, warmup=3, min_std=5.0, use_forest=False,
+                 forest_threshold=0.9, capacity=256, collection=None):
+        self.alpha = alpha  # EWMA weight of a new value; each slot recurs once a week
+        self.threshold = threshold  # in (robust) standard deviations
+        self.warmup = warmup  # observations before the robust median/MAD is trusted over the EWMA
+        self.min_std = min_std
+        self.forest = HalfSpaceTrees() if use_forest else None
+        self.forest_threshold = forest_threshold
+        self.capacity = capacity
+        self._collection = collection
+        self._states = OrderedDict()
+        self._lock = threading.RLock()
+
+    def collection(self):
+        return self._collection if self._collection is not None else repository.anomaly_state_collection()
+
+    def _load(self, user_key):
+        doc = self.collection().find_one({'_id': user_key})
+        if doc is None:
+            series = repository.find_hr_series(user_key)
+            if series is None:
+                return None
+            state = {'slots': initial_slot_state(series, self.min_std)}
+        else:
+            slots = np.frombuffer(bytes(doc['slots']), dtype='<f8').reshape(STATE_ROWS, NUM_SLOTS).copy()
+            state = {'slots': slots}
+            if 'forest' in doc:
+                masses = np.frombuffer(bytes(doc['forest']), dtype='<i4').reshape(2, -1)
+                n_trees = doc['forest_trees']
+                state['forest'] = {'reference': masses[0].reshape(n_trees, -1).copy(),
+                                   'latest': masses[1].reshape(n_trees, -1).copy(),
+                                   'count': doc['forest_count'], 'typical': doc.get('forest_typical')}
+        if self.forest is not None and 'forest' not in state:
+            state['forest'] = self.forest.new_state()
+        return state
+
+    def _save(self, user_key, state):
+        fields = {'slots': Binary(state['slots'].astype('<f8').tobytes())}
+        forest = state.get('forest')
+        if forest is not None:
+            masses = np.stack([forest['reference'].ravel(), forest['latest'].ravel()]).astype('<i4')
+            fields.update({'forest': Binary(masses.tobytes()), 'forest_trees': len(forest['reference']),
+                           'forest_count': forest['count'], 'forest_typical': forest['typical']})
+        self.collection().update_one({'_id': user_key}, {'$set': fields}, upsert=True)
+
+    def state(self, user_key):
+        """A user's state from memory, MongoDB or their stored week, or None for an unknown user."""
+        with self._lock:
+            state = self._states.get(user_key)
+            if state is not None:
+                self._states.move_to_end(user_key)
+                return state
+            state = self._load(user_key)
+            if state is not None:
+                self._states[user_key] = state
+                while len(self._states) > self.capacity:
+                    self._states.popitem(last=False)  # Persisted on every update, reloaded on next use
+            return state
+
+    def score(self, user_key, slot, value):
+        """Score a new value for a slot without changing any state.
+
+        Returns {'z', 'robust_z', 'forest', 'score', 'expected', 'is_anomaly'},
+        or None for an unknown user. 'score' is the robust z-score once the slot
+        is warmed up and the EWMA z-score before that.
+        """
+        with self._lock:
+            state = self.state(user_key)
+            if state is None:
+                return None
+            slots = state['slots']
+            count, mean, var, median, mad = slots[:, slot]
+            z = (value - mean) / max(np.sqrt(var), self.min_std)
+            robust_z = (value - median) / max(mad * MAD_TO_STD, self.min_std)
+            score = abs(robust_z) if count >= self.warmup else abs(z)
+            forest_score = None
+            if self.forest is not None:
+                forest_score = self.forest.score(state['forest'], self.forest.point(slot, value))
+            is_anomaly = score > self.threshold
+            if count == 0:
+                # Nothing measured in this slot yet: keep the old fixed-difference rule
+                is_anomaly = abs(value - mean) > LEGACY_THRESHOLD
+            if forest_score is not None and forest_score > self.forest_threshold:
+                is_anomaly = True
+            return {
+                'z': float(z),
+                'robust_z': float(robust_z),
+                'forest': forest_score,
+                'score': float(score),
+                'expected': float(median if count >= self.warmup else mean),
+                'is_anomaly': bool(is_anomaly),
+            }
+
+    def update(self, user_key, slot, value, persist=True):
+        """Fold a new value into the slot's running state in place."""
+        with self._lock:
+            state = self.state(user_key)
+            if state is None:
+                return
+            slots = state['slots']
+            count, mean, var, median, mad = slots[:, slot]
+            if count == 0:
+                slots[MEAN, slot] = value
+                slots[MEDIAN, slot] = value
+            else:
+                delta = value - mean
+                slots[MEAN, slot] = mean + self.alpha * delta
+                slots[VAR, slot] = (1 - self.alpha) * (var + self.alpha * delta ** 2)
+                # Frugal streaming median and MAD: move a bounded step towards the new value
+                step = max(mad * self.alpha, 0.5)
+                slots[MEDIAN, slot] = median + np.clip(value - median, -step, step)
+                slots[MAD, slot] = max(mad + np.clip(abs(value - median) - mad, -step, step) * 0.5, 0.5)
+            slots[COUNT, slot] = count + 1
+            if self.forest is not None:
+                self.forest.update(state['forest'], self.forest.point(slot, value))
+            if persist:
+                self._save(user_key, state)
+
+    def score_and_update(self, user_key, slot, value):
+        result = self.score(user_key, slot, value)
+        self.update(user_key, slot, value)
+        return result
+
+    def forget(self, user_key):
+        with self._lock:
+            self._states.pop(user_key, None)
+            self.collection().delete_one({'_id': user_key})
+
+
+def score_and_commit(detector, user_key, user, slot, value, extra=None):
+    """Score a measurement against the state from before it, then write it with one atomic update.
+
+    Returns (score result or None, the document repository.set_slot_returning_previous
+    returned or None for an unknown user). Scoring has to come first: a user
+    without persisted state is seeded from their stored week, which after the
+    write already holds `value`.
+    """
+    result = detector.score(user_key, slot, value)
+    return result, repository.set_slot_returning_previous(user, slot, value, extra)
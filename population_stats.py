@@ -0,0 +1,374 @@
+import numpy as np
+from pymongo import UpdateOne
+import repository
+from hr_series import HrSeries
+
+# population_stats.py
+# Population heart-rate statistics (overall, per gender, per age group), either
+# aggregated on demand or read from the incrementally maintained
+# `population_stats` collection.
+
+# Age groups
+AGE_GROUPS = [(10, 20), (20, 30), (30, 40), (40, 50), (50, 60), (60, 70), (70, 80), (80, 90)]
+
+
+def get_age_group(age):
+    for low, high in AGE_GROUPS:
+        if low <= age < high:
+            return f"{low}-{high}"
+    return "90+"
+
+
+def _age_group_expression():
+    """$switch equivalent of get_age_group for the aggregation pipeline."""
+    return {
+        "$switch": {
+            "branches": [
+                {
+                    "case": {"$and": [{"$gte": ["$Age", low]}, {"$lt": ["$Age", high]}]},
+                    "then": f"{low}-{high}",
+                }
+                for low, high in AGE_GROUPS
+            ],
+            "default": "90+",
+        }
+    }
+
+
+def _cohort_group(key):
+    # Mean, sample standard deviation and size of the per-user averages in a cohort
+    return {
+        "$group": {
+            "_id": key,
+            "mean": {"$avg": "$average"},
+            "stddev": {"$stdDevSamp": "$average"},
+            "count": {"$sum": 1},
+        }
+    }
+
+
+def population_pipeline():
+    """Aggregation pipeline that computes the population statistics on the server.
+
+    Every user is reduced to the sum, count and average of its numeric
+    "HR at ..." slot fields (the same slots HrSeries reads), then a $facet groups those rows overall, by gender and
+    by age group. Only the handful of result rows cross the wire.
+    """
+    return [
+        {"$project": {
+            "Gender": 1,
+            "Age": 1,
+            "rates": repository.slot_rates_expression(),
+        }},
+        {"$project": {
+            "Gender": 1,
+            "Age": 1,
+            "total": {"$sum": "$rates.v"},
+            "count": {"$size": "$rates"},
+        }},
+        {"$addFields": {
+            # Users without any heart-rate value count as an average of 0, as in the Python path
+            "average": {"$cond": [{"$gt": ["$count", 0]}, {"$divide": ["$total", "$count"]}, 0]},
+        }},
+        {"$facet": {
+            "overall": [
+                {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": "$count"}}},
+            ],
+            "gender": [
+                {"$match": {"Gender": {"$in": ['male', 'female']}}},
+                _cohort_group("$Gender"),
+                {"$sort": {"_id": 1}},
+            ],
+            "age_group": [
+                {"$match": {"Age": {"$type": ["int", "long"]}}},
+                {"$addFields": {"age_group": _age_group_expression()}},
+                _cohort_group("$age_group"),
+                {"$sort": {"_id": 1}},
+            ],
+        }},
+    ]
+
+
+def aggregate_population_stats(collection=None):
+    """Compute the population statistics in one aggregation round trip.
+
+    Returns {'overall': {'mean', 'count'}, 'gender': {gender: {'mean', 'stddev', 'count'}},
+    'age_group': {group: {...}}}, the same numbers calculate_and_print_heart_rate_averages prints.
+    """
+    if collection is None:
+        collection = repository.users_collection()
+    result = next(collection.aggregate(population_pipeline()), None) or {}
+
+    overall = (result.get('overall') or [{}])[0]
+    count_all = overall.get('count', 0)
+    stats = {
+        'overall': {
+            'mean': overall['total'] / count_all if count_all else None,
+            'count': count_all,
+        },
+        'gender': {},
+        'age_group': {},
+    }
+    for category in ('gender', 'age_group'):
+        for row in result.get(category, []):
+            stats[category][row['_id']] = {
+                'mean': row['mean'],
+                'stddev': row['stddev'] or 0,  # $stdDevSamp is null for a single user
+                'count': row['count'],
+            }
+    return stats
+
+
+def print_population_stats(stats):
+    """Print population statistics in the format of the original dashboard."""
+    if stats['overall']['count'] > 0:
+        print(f"Overall Average Heart Rate: {stats['overall']['mean']:.2f}")
+    else:
+        print("Overall Average Heart Rate: N/A")
+
+    for gender, cohort in stats['gender'].items():
+        if cohort['count']:
+            print(f"Average Heart Rate for {gender}: {cohort['mean']:.2f}, Standard Deviation: {cohort['stddev']:.2f}")
+        else:
+            print(f"Average Heart Rate for {gender}: N/A, Standard Deviation: N/A")
+
+    for age_group, cohort in stats['age_group'].items():
+        if cohort['count']:
+            print(f"Average Heart Rate for Age Group {age_group}: {cohort['mean']:.2f}, Standard Deviation: {cohort['stddev']:.2f}")
+        else:
+            print(f"Average Heart Rate for Age Group {age_group}: N/A, Standard Deviation: N/A")
+
+
+# ---------------------------------------------------------------------------
+# Materialised aggregates
+#
+# One document per cohort ("overall", "gender:male", "age_group:20-30",
+# "heart_problems:True", ...) holds sums that can be updated with $inc:
+#   count, sum, sum_sq           over every stored heart-rate value
+#   users, avg_sum, avg_sum_sq   over the per-user average heart rates
+# A write subtracts the user's old contribution and adds the new one, so the
+# dashboard reads O(cohorts) documents instead of scanning every user.
+# ---------------------------------------------------------------------------
+
+def user_cohorts(profile):
+    """Cohort ids a user contributes to, as (cohort id, category, key) tuples."""
+    cohorts = [("overall", "overall", None)]
+    gender = profile.get('Gender')
+    if gender in ['male', 'female']:
+        cohorts.append((f"gender:{gender}", 'gender', gender))
+    age = profile.get('Age')
+    if isinstance(age, int):
+        age_group = get_age_group(age)
+        cohorts.append((f"age_group:{age_group}", 'age_group', age_group))
+    heart_problems = profile.get('Heart Problems')
+    if heart_problems is not None:
+        cohorts.append((f"heart_problems:{heart_problems}", 'heart_problems', heart_problems))
+    return cohorts
+
+
+def _contribution(series):
+    # (count, sum, sum of squares, average) of one user's stored values
+    values = series.present_values().astype(np.float64)
+    total = float(values.sum())
+    average = total / len(values) if len(values) else 0.0
+    return len(values), total, float((values ** 2).sum()), average
+
+
+_cache_built = False
+
+
+def cache_is_built():
+    """Whether the aggregates exist; incremental updates are skipped until they do."""
+    global _cache_built
+    if not _cache_built:
+        _cache_built = repository.population_stats_collection().find_one({'_id': 'overall'}, {'_id': 1}) is not None
+    return _cache_built
+
+
+def _increments(profile, old_series, new_series, new_user):
+    # $inc document that moves one user's contribution from old_series to new_series
+    old_count, old_sum, old_sum_sq, old_avg = _contribution(old_series)
+    new_count, new_sum, new_sum_sq, new_avg = _contribution(new_series)
+    return {
+        'count': new_count - old_count,
+        'sum': new_sum - old_sum,
+        'sum_sq': new_sum_sq - old_sum_sq,
+        'users': 1 if new_user else 0,
+        'avg_sum': new_avg - old_avg,
+        'avg_sum_sq': new_avg ** 2 - old_avg ** 2,
+    }
+
+
+# Recent write ids kept on each cohort document, so a retried increment is not applied twice
+APPLIED_WRITE_IDS = 1000
+
+
+def _cohort_operations(increments, write_id=None):
+    # One $inc upsert per cohort for (profile, inc) pairs, with increments summed per cohort first.
+    # With a write id the $inc is guarded: once applied, the filter no longer matches the cohort.
+    per_cohort = {}
+    for profile, inc in increments:
+        for cohort_id, category, key in user_cohorts(profile):
+            entry = per_cohort.setdefault(cohort_id, (category, key, dict.fromkeys(inc, 0)))
+            for field, value in inc.items():
+                entry[2][field] += value
+    operations = []
+    for cohort_id, (category, key, inc) in per_cohort.items():
+        query = {'_id': cohort_id}
+        update = {'$inc': inc, '$setOnInsert': {'category': category, 'key': key}}
+        if write_id is not None:
+            query['applied'] = {'$ne': write_id}
+            update['$push'] = {'applied': {'$each': [write_id], '$slice': -APPLIED_WRITE_IDS}}
+        operations.append(UpdateOne(query, update, upsert=True))
+    return operations
+
+
+def apply_series_changes(changes):
+    """Apply many (profile, old_series, new_series, new_user) changes in one unordered bulk write.
+
+    Increments are summed per cohort first, so the write touches each cohort
+    document once no matter how many users changed.
+    """
+    if not cache_is_built():
+        # The first dashboard read rebuilds everything, including these changes
+        return
+    operations = _cohort_operations(
+        (profile, _increments(profile, old_series, new_series, new_user))
+        for profile, old_series, new_series, new_user in changes
+    )
+    if operations:
+        repository.population_stats_collection().bulk_write(operations, ordered=False)
+
+
+def slot_change_operations(profile, old_value, new_value, total, count, write_id=None):
+    """Cohort updates for one slot going from `old_value` (None if empty) to `new_value`.
+
+    `total` and `count` are the sum and number of the user's stored values
+    before the change, so the per-user average moves without reading the week.
+    With a `write_id` the updates are applied at most once, so they can be
+    retried. Returns [] while the cache is not built.
+    """
+    if not cache_is_built():
+        return []
+    old = 0.0 if old_value is None else float(old_value)
+    added = 1 if old_value is None else 0
+    new_total = total - old + new_value
+    old_avg = total / count if count else 0.0
+    new_avg = new_total / (count + added)
+    inc = {
+        'count': added,
+        'sum': new_value - old,
+        'sum_sq': new_value ** 2 - old ** 2,
+        'users': 0,
+        'avg_sum': new_avg - old_avg,
+        'avg_sum_sq': new_avg ** 2 - old_avg ** 2,
+    }
+    return _cohort_operations([(profile, inc)], write_id)
+
+
+def apply_series_change(profile, old_series, new_series, new_user=False):
+    """Move a user's contribution in every cohort from `old_series` to `new_series`."""
+    apply_series_changes([(profile, old_series, new_series, new_user)])
+
+
+def record_new_user(profile, series):
+    """Add a newly created user to the materialised aggregates."""
+    apply_series_change(profile, HrSeries(), series, new_user=True)
+
+
+def _with_updates(series, updates):
+    new_series = series.copy()
+    for index, value in updates.items():
+        new_series.set(index, value)
+    return new_series
+
+
+def record_slot_updates(profile, old_series, updates):
+    """Apply {slot index: new value} writes for an existing user to the aggregates."""
+    apply_series_change(profile, old_series, _with_updates(old_series, updates))
+
+
+def record_many_slot_updates(items):
+    """Batch form of record_slot_updates for (profile, old_series, updates) triples."""
+    apply_series_changes(
+        (profile, old_series, _with_updates(old_series, updates), False)
+        for profile, old_series, updates in items
+    )
+
+
+def rebuild_population_stats():
+    """Recompute the materialised aggregates from scratch with one streaming pass over the users."""
+    totals = {}
+    for user in repository.iter_users():
+        count, total, total_sq, average = _contribution(HrSeries.from_document(user))
+        for cohort_id, category, key in user_cohorts(user):
+            doc = totals.setdefault(cohort_id, {
+                '_id': cohort_id, 'category': category, 'key': key,
+                'count': 0, 'sum': 0.0, 'sum_sq': 0.0, 'users': 0, 'avg_sum': 0.0, 'avg_sum_sq': 0.0,
+            })
+            doc['count'] += count
+            doc['sum'] += total
+            doc['sum_sq'] += total_sq
+            doc['users'] += 1
+            doc['avg_sum'] += average
+            doc['avg_sum_sq'] += average ** 2
+
+    global _cache_built
+    collection = repository.population_stats_collection()
+    collection.delete_many({})
+    if totals:
+        collection.insert_many(list(totals.values()))
+    _cache_built = bool(totals)
+    return len(totals)
+
+
+def _sample_stddev(n, total, total_sq):
+    if n < 2:
+        return 0
+    # Clamped at 0 because the subtraction can go slightly negative in floating point
+    return (max(total_sq - total * total / n, 0.0) / (n - 1)) ** 0.5
+
+
+def read_population_stats():
+    """Read the materialised aggregates in the same shape as aggregate_population_stats.
+
+    Returns None when the cache has not been built yet. Value-level statistics
+    for every cohort (including heart problems) are under 'values'.
+    """
+    docs = list(repository.population_stats_collection().find({}))
+    if not docs:
+        return None
+
+    stats = {'overall': {'mean': None, 'count': 0}, 'gender': {}, 'age_group': {}, 'values': {}}
+    for doc in sorted(docs, key=lambda d: d['_id']):
+        count = doc.get('count', 0)
+        stats['values'][doc['_id']] = {
+            'mean': doc['sum'] / count if count else None,
+            'stddev': _sample_stddev(count, doc['sum'], doc['sum_sq']),
+            'count': count,
+        }
+        if doc['category'] == 'overall':
+            stats['overall'] = {'mean': doc['sum'] / count if count else None, 'count': count}
+        elif doc['category'] in ('gender', 'age_group'):
+            users = doc.get('users', 0)
+            stats[doc['category']][doc['key']] = {
+                'mean': doc['avg_sum'] / users if users else None,
+                'stddev': _sample_stddev(users, doc['avg_sum'], doc['avg_sum_sq']),
+                'count': users,
+            }
+    return stats
+
+
+def load_population_stats():
+    """Precomputed statistics for the dashboard, building the cache on first use."""
+    stats = read_population_stats()
+    if stats is None:
+        rebuild_population_stats()
+        stats = read_population_stats()
+    if stats is None:  # No users yet
+        stats = {'overall': {'mean': None, 'count': 0}, 'gender': {}, 'age_group': {}, 'values': {}}
+    return stats
+
+
+if __name__ == '__main__':
+    print(f"Rebuilt {rebuild_population_stats()} population cohorts.")
@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# render_service.py
+# Draws analysis plots off the event loop and keeps the PNG bytes in memory.
+# Figures are built with the object-oriented Figure + Agg canvas API (no
+# pyplot global state, so a worker thread can draw safely), and every PNG is
+# cached under a hash of the data and plot parameters: showing the same data
+# again is a dict lookup, and the app hands the bytes to toga without a file.
+
+
+def _feed(hasher, value):
+    # Canonical, type-tagged encoding of plot data for hashing
+    if isinstance(value, np.ndarray):
+        hasher.update(b'A' + str(value.dtype).encode() + str(value.shape).encode())
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        hasher.update(b'D%d' % len(value))
+        for key in sorted(value, key=repr):
+            _feed(hasher, key)
+            _feed(hasher, value[key])
+    elif isinstance(value, (list, tuple)):
+        hasher.update(b'L%d' % len(value))
+        for item in value:
+            _feed(hasher, item)
+    elif isinstance(value, datetime):
+        hasher.update(b'T' + value.isoformat().encode())
+    else:
+        hasher.update(b'V' + repr(value).encode())
+
+
+def render_key(name, data, params):
+    """Content hash of a plot: the drawing function's name, its data and its parameters."""
+    hasher = hashlib.sha1(name.encode())
+    _feed(hasher, data)
+    _feed(hasher, params)
+    return hasher.hexdigest()
+
+
+def render_png(draw, data, figsize=(12, 6), dpi=100, **params):
+    """Draw `draw(fig, data, **params)` on a fresh Agg figure and return the PNG bytes."""
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    draw(fig, data, **params)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+class RenderService:
+    """Renders plots in a worker thread and caches the PNG bytes by content."""
+
+    def __init__(self, capacity=32, max_workers=1):
+        self.capacity = capacity
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='render')
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def cached(self, key):
+        with self._lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+            return png
+
+    def _store(self, key, png):
+        with self._lock:
+            self._cache[key] = png
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    async def render(self, draw, data, figsize=(12, 6), dpi=100, **params):
+        """PNG bytes of a plot, from the cache or drawn in the worker.
+
+        Concurrent requests for the same plot share one render.
+        """
+        key = render_key(draw.__qualname__, data, {'figsize': figsize, 'dpi': dpi, **params})
+        png = self.cached(key)
+        if png is not None:
+            return png
+        future = self._in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, lambda: render_png(draw, data, figsize, dpi, **params))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda f: self._in_flight.pop(key, None))
+        png = await asyncio.shield(future)
+        self._store(key, png)
+        return png
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,150 @@
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import OperationFailure
+from bson.objectid import ObjectId
+from hr_series import HrSeries, SLOT_KEYS
+
+# repository.py
+# The one place that talks to MongoDB. It owns a single pooled client that is
+# created on first use and shared by the app and every analysis module.
+
+MONGO_URI = "mongodb://localhost:27017/"
+DB_NAME = 'HRMonitoring'
+MAX_POOL_SIZE = 50
+
+PROFILE_FIELDS = ['Name', 'Age', 'Gender', 'Smoking', 'Heart Problems', 'Smart Watch', 'Activity Level (1-5)']
+
+# Projections so that queries only ship the fields their caller needs
+PROFILE_PROJECTION = {field: 1 for field in PROFILE_FIELDS}
+HR_PROJECTION = {key: 1 for key in SLOT_KEYS}
+LABEL_PROJECTION = {f"{key}_label": 1 for key in SLOT_KEYS}
+
+_client = None
+
+
+def get_client():
+    """Return the shared MongoClient, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = MongoClient(MONGO_URI, maxPoolSize=MAX_POOL_SIZE)
+    return _client
+
+
+def close_client():
+    """Close the shared client (e.g. on app exit); the next call reconnects."""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def get_db():
+    return get_client()[DB_NAME]
+
+
+def users_collection():
+    return get_db()['Users']
+
+
+def heart_rate_collection():
+    return get_db()['heart_rate']
+
+
+def population_stats_collection():
+    return get_db()['population_stats']
+
+
+def anomaly_state_collection():
+    return get_db()['anomaly_state']
+
+
+def ensure_indexes():
+    """Create the indexes the app's lookups rely on; safe to call on every start."""
+    users = users_collection()
+    try:
+        users.create_index('Name', unique=True, name='name_unique')
+    except OperationFailure as e:
+        # Existing duplicate names prevent a unique index; index the field anyway so lookups stay fast
+        print(f"Could not create a unique index on Name ({e}); using a non-unique index.")
+        users.create_index('Name', name='name')
+
+
+def user_query(user):
+    """Build the filter for a user given either its ObjectId or its name."""
+    if isinstance(user, ObjectId):
+        return {"_id": user}
+    return {"Name": user}
+
+
+def find_profile(user):
+    """Profile fields only (name, age, gender, ...), without any heart-rate slots."""
+    return users_collection().find_one(user_query(user), PROFILE_PROJECTION)
+
+
+def find_user_with_series(user, include_labels=False):
+    """Profile fields plus the heart-rate slots, or None if the user does not exist."""
+    projection = {**PROFILE_PROJECTION, **HR_PROJECTION}
+    if include_labels:
+        projection.update(LABEL_PROJECTION)
+    return users_collection().find_one(user_query(user), projection)
+
+
+def find_hr_series(user):
+    """The user's week as an HrSeries, or None if the user does not exist."""
+    doc = users_collection().find_one(user_query(user), HR_PROJECTION)
+    if doc is None:
+        return None
+    return HrSeries.from_document(doc)
+
+
+def slot_rates_expression():
+    """Aggregation expression for a user's numeric "HR at ..." fields as [{k, v}, ...] pairs."""
+    return {"$filter": {
+        "input": {"$objectToArray": "$$ROOT"},
+        "cond": {"$and": [
+            {"$in": ["$$this.k", SLOT_KEYS]},
+            {"$isNumber": "$$this.v"},
+        ]},
+    }}
+
+
+def set_slot_returning_previous(user, index, value, extra=None):
+    """Write one slot (plus `extra` fields) and return what it replaced, in a single round trip.
+
+    One atomic find_one_and_update whose projection returns the profile, the
+    slot's previous value under 'previous' (None if it was empty) and the
+    sum and count of the user's stored slots before the write under 'totals',
+    computed on the server. Returns None if the user does not exist.
+    """
+    key = SLOT_KEYS[index]
+    projection = {
+        **PROFILE_PROJECTION,
+        key: 1,
+        # Aggregation expressions in a find projection need MongoDB 4.4+
+        "totals": {"$let": {
+            "vars": {"rates": slot_rates_expression()},
+            "in": {"sum": {"$sum": "$$rates.v"}, "count": {"$size": "$$rates"}},
+        }},
+    }
+    doc = users_collection().find_one_and_update(
+        user_query(user),
+        {"$set": {key: value, **(extra or {})}},
+        projection=projection,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if doc is None:
+        return None
+    previous = doc.pop(key, None)
+    doc['previous'] = previous if isinstance(previous, (int, float)) else None
+    return doc
+
+
+def iter_users(projection=None, batch_size=500):
+    """Iterate over all users with a batched cursor (profile and HR slots by default)."""
+    if projection is None:
+        projection = {**PROFILE_PROJECTION, **HR_PROJECTION}
+    return users_collection().find({}, projection, batch_size=batch_size)
+
+
+def find_all_users(projection=None):
+    """All users as a list (profile and HR slots by default)."""
+    return list(iter_users(projection))
@@ -0,0 +1,172 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pymongo.errors import BulkWriteError
+from hr_series import SLOT_KEYS, NUM_SLOTS, SLOTS_PER_DAY
+from population_stats import cache_is_built, rebuild_population_stats
+import repository
+
+# seed_users.py
+# Synthetic users for load and capacity testing. Profiles and their week of
+# heart-rate slots are drawn with numpy for a whole batch at once, using the
+# same age, gender, smoking, heart-problem and activity rules as a user
+# created in the app, and inserted with chunked unordered insert_many calls.
+#
+#   python seed_users.py 100000 [--circadian 8] [--anomaly-rate 0.01 --labels]
+
+HR_RANGE_WIDTH = 40  # Every rule draws from a 40 BPM wide range, e.g. 60-100
+MIN_AGE, MAX_AGE = 6, 90
+
+
+def resting_hr_low(age, gender, smoking, heart_problems):
+    """Lower bound of the slot heart rates for a profile; scalars or arrays of profiles.
+
+    Ages 6-14 start at 70, ages 15-60 at 60 for men and 70 for women, over 60
+    at 50 and anything else at 60. Smokers and users with heart problems start at 80.
+    """
+    age = np.asarray(age)
+    male = np.asarray(gender) == 'male'
+    adult = (age >= 15) & (age <= 60)
+    low = np.select([(age >= 6) & (age <= 14), adult & male, adult, age > 60], [70, 60, 70, 50], 60)
+    return np.where(np.asarray(smoking) | np.asarray(heart_problems), 80, low)
+
+
+def activity_offset(activity_level):
+    """BPM added for activity levels 3-4 (+5) and 5 (+10)."""
+    level = np.asarray(activity_level)
+    return np.select([(level == 3) | (level == 4), level == 5], [5, 10], 0)
+
+
+def circadian_shape():
+    """Daily rhythm over the week's slots in [-1, 1]: lowest around 04:00, highest around 16:00."""
+    hours = (np.arange(NUM_SLOTS) % SLOTS_PER_DAY) / 2.0
+    return -np.cos(2 * np.pi * (hours - 4) / 24)
+
+
+def week_heart_rates(rng, age, gender, smoking, heart_problems, activity_level, circadian=0.0):
+    """(n_users, NUM_SLOTS) integer heart rates for arrays of profile fields.
+
+    Each slot is uniform in the profile's range plus its activity offset;
+    `circadian` adds a daily rhythm of that many BPM around it.
+    """
+    low = resting_hr_low(age, gender, smoking, heart_problems) + activity_offset(activity_level)
+    low = np.atleast_1d(low)[:, None]
+    rates = rng.integers(low, low + HR_RANGE_WIDTH, size=(len(low), NUM_SLOTS), endpoint=True)
+    if circadian:
+        rates += np.rint(circadian * circadian_shape()).astype(rates.dtype)
+    return rates
+
+
+def inject_anomalies(rng, rates, rate, magnitude=(30, 60)):
+    """Push a `rate` fraction of slots up or down by `magnitude` BPM in place; returns the boolean mask."""
+    anomalies = rng.random(rates.shape) < rate
+    count = int(anomalies.sum())
+    signs = np.where(rng.random(count) < 0.7, 1, -1)  # Spikes are more common than drops
+    rates[anomalies] += signs * rng.integers(magnitude[0], magnitude[1], count, endpoint=True)
+    np.clip(rates, 30, 220, out=rates)
+    return anomalies
+
+
+def random_profiles(rng, n):
+    """Column arrays of n random profiles."""
+    return {
+        'Age': rng.integers(MIN_AGE, MAX_AGE, n, endpoint=True),
+        'Gender': np.where(rng.random(n) < 0.5, 'male', 'female'),
+        'Smoking': rng.random(n) < 0.15,
+        'Heart Problems': rng.random(n) < 0.1,
+        'Smart Watch': rng.random(n) < 0.4,
+        'Activity Level (1-5)': rng.integers(1, 5, n, endpoint=True),
+    }
+
+
+def generate_users(rng, first, n, prefix='seed-user-', circadian=0.0, anomaly_rate=0.0, labels=False):
+    """User documents number `first` to `first + n - 1` in the app's legacy layout."""
+    profiles = random_profiles(rng, n)
+    rates = week_heart_rates(rng, profiles['Age'], profiles['Gender'], profiles['Smoking'],
+                             profiles['Heart Problems'], profiles['Activity Level (1-5)'], circadian)
+    anomalies = inject_anomalies(rng, rates, anomaly_rate) if anomaly_rate > 0 else None
+
+    # Python scalars for BSON; tolist() converts a whole column in one call
+    columns = {field: values.tolist() for field, values in profiles.items()}
+    rows = rates.tolist()
+    label_keys = [f"{key}_label" for key in SLOT_KEYS]
+    label_rows = anomalies.astype(int).tolist() if labels and anomalies is not None else None
+
+    docs = []
+    for i in range(n):
+        doc = {'Name': f"{prefix}{first + i:07d}"}
+        for field, values in columns.items():
+            doc[field] = values[i]
+        doc.update(zip(SLOT_KEYS, rows[i]))
+        if label_rows is not None:
+            doc.update(zip(label_keys, label_rows[i]))  # 1 marks an injected anomaly
+        docs.append(doc)
+    return docs
+
+
+def _insert(collection, docs):
+    try:
+        return len(collection.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        # Names already seeded by an earlier run hit the unique index; the rest are still inserted
+        return e.details.get('nInserted', 0)
+
+
+def seed_users(count, chunk_size=5000, workers=2, first=0, prefix='seed-user-', circadian=0.0,
+               anomaly_rate=0.0, labels=False, seed=None):
+    """Insert `count` synthetic users and return how many were inserted.
+
+    The next chunk is generated while up to `workers` earlier chunks are being
+    inserted, so generation and the round trips to MongoDB overlap.
+    """
+    repository.ensure_indexes()
+    collection = repository.users_collection()
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    generating = 0.0
+    inserted = 0
+    pending = []
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='seed') as executor:
+        for start in range(0, count, chunk_size):
+            chunk_started = time.perf_counter()
+            docs = generate_users(rng, first + start, min(chunk_size, count - start), prefix, circadian,
+                                  anomaly_rate, labels)
+            generating += time.perf_counter() - chunk_started
+            pending.append(executor.submit(_insert, collection, docs))
+            while len(pending) > workers:
+                inserted += pending.pop(0).result()
+            print(f"  {start + len(docs)}/{count} generated, {inserted} inserted", end='\r')
+        for future in pending:
+            inserted += future.result()
+
+    elapsed = time.perf_counter() - started
+    print()
+    print(f"Inserted {inserted} of {count} users in {elapsed:.1f}s ({inserted / elapsed if elapsed else 0:.0f} users/s; "
+          f"generation alone {count / generating if generating else 0:.0f} users/s).")
+    return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Insert synthetic users for load and scale testing.')
+    parser.add_argument('count', type=int, help='Number of users to insert')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Users per insert_many call')
+    parser.add_argument('--workers', type=int, default=2, help='Concurrent insert_many calls')
+    parser.add_argument('--first', type=int, default=0, help='Number of the first user, to extend an earlier run')
+    parser.add_argument('--prefix', default='seed-user-', help='Name prefix of the generated users')
+    parser.add_argument('--circadian', type=float, default=0.0, help='Amplitude in BPM of a daily rhythm')
+    parser.add_argument('--anomaly-rate', type=float, default=0.0, help='Fraction of slots with injected anomalies')
+    parser.add_argument('--labels', action='store_true', help='Store "<slot>_label" ground truth for every slot')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    seed_users(args.count, args.chunk_size, args.workers, args.first, args.prefix, args.circadian,
+               args.anomaly_rate, args.labels, args.seed)
+    if cache_is_built():
+        # Inserted users bypass the incremental aggregates, so recompute them once
+        print(f"Rebuilt {rebuild_population_stats()} population statistics documents.")
+
+
+if __name__ == '__main__':
+    main()
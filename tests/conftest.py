@@ -0,0 +1,44 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+mongomock = pytest.importorskip('mongomock')
+from mongomock.collection import Collection
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import repository
+import population_stats
+
+
+def _bulk_write(self, requests, ordered=True, **kwargs):
+    # mongomock's own bulk_write does not accept the operations of current pymongo versions,
+    # so apply them one at a time and report failures the way the server does
+    result = {'nInserted': 0, 'nMatched': 0, 'nModified': 0, 'nUpserted': 0, 'writeErrors': []}
+    for index, request in enumerate(requests):
+        try:
+            if isinstance(request, InsertOne):
+                self.insert_one(request._doc)
+                result['nInserted'] += 1
+            else:
+                outcome = self.update_one(request._filter, request._doc, upsert=request._upsert)
+                result['nMatched'] += outcome.matched_count
+                result['nModified'] += outcome.modified_count
+                result['nUpserted'] += outcome.upserted_id is not None
+        except DuplicateKeyError as e:
+            result['writeErrors'].append({'index': index, 'code': 11000, 'errmsg': str(e), 'op': request})
+            if ordered:
+                break
+    if result['writeErrors']:
+        raise BulkWriteError(result)
+    return result
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """An in-memory MongoDB behind repository's shared client."""
+    monkeypatch.setattr(Collection, 'bulk_write', _bulk_write)
+    monkeypatch.setattr(repository, '_client', mongomock.MongoClient())
+    monkeypatch.setattr(population_stats, '_cache_built', False)
+    return repository.get_db()
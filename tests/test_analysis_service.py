@@ -0,0 +1,21 @@
+import asyncio
+import threading
+from analysis_service import AnalysisService
+
+
+def test_cancel_others_keeps_shared_owners():
+    release = threading.Event()
+
+    async def scenario():
+        service = AnalysisService(max_workers=1)
+        blocker = service.submit('ann', release.wait)  # Occupies the only worker
+        population = service.submit('population', sum, [1, 2, 3])
+        stale = service.submit('an', sum, [1])
+        service.cancel_others('ann', keep=('population',))
+        release.set()
+        await blocker
+        assert await population == 6
+        assert stale.cancelled()
+        service.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,36 @@
+import threading
+import arima_cache
+from arima_cache import ArimaModelCache
+
+
+def test_slow_fit_does_not_block_other_users(tmp_path, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    fits = []
+
+    def slow_fit(values):
+        fits.append(len(values))
+        started.set()
+        release.wait(5)
+        return 'model'
+
+    monkeypatch.setattr(arima_cache, 'fit_arima_model', slow_fit)
+    cache = ArimaModelCache(cache_dir=str(tmp_path))
+    cache.fit('bob', [70.0])
+    fits.clear()
+
+    fitting = [threading.Thread(target=cache.get_or_fit, args=('ann', [70.0, 72.0])) for _ in range(2)]
+    for thread in fitting:
+        thread.start()
+    assert started.wait(5)
+    # Another user's lookup goes through while ann's fit is still running
+    lookup = []
+    reader = threading.Thread(target=lambda: lookup.append(cache.get('bob')))
+    reader.start()
+    reader.join(2)
+    assert lookup and lookup[0]['fit'] == 'model'
+    release.set()
+    for thread in fitting:
+        thread.join(5)
+
+    assert fits == [2]  # The second caller waited for the first fit instead of fitting again
+    assert cache.get('ann')['fit'] == 'model'
@@ -0,0 +1,29 @@
+import numpy as np
+from bpm_estimator import estimate_bpm, spectral_snr_db, MIN_CONFIDENCE
+from capture import frame_sample
+from frame_sources import SyntheticPpgSource
+
+
+def _recording(**kwargs):
+    source = SyntheticPpgSource(duration=15, seed=1, **kwargs)
+    rows = []
+    while True:
+        ok, frame, timestamp = source.read()
+        if not ok:
+            return np.array(rows)
+        rows.append((timestamp, *frame_sample(frame)))
+
+
+def test_clean_pulse_is_trusted():
+    samples = _recording(bpm=75, noise=1.0)
+    bpm, confidence = estimate_bpm(samples[:, 0], samples[:, 1])
+    assert abs(bpm - 75) < 2
+    assert confidence >= MIN_CONFIDENCE
+
+
+def test_snr_is_measured_from_the_spectrum():
+    clean = _recording(bpm=75, noise=1.0)
+    no_pulse = _recording(bpm=75, noise=6.0, pulse_amplitude=0.0)
+    _, confidence = estimate_bpm(no_pulse[:, 0], no_pulse[:, 1])
+    assert confidence < MIN_CONFIDENCE
+    assert spectral_snr_db(clean[:, 0], clean[:, 1]) > spectral_snr_db(no_pulse[:, 0], no_pulse[:, 1]) + 10
@@ -0,0 +1,46 @@
+import numpy as np
+from fleet_forecast import (METHODS, rolling_sma, rolling_ewma, seasonal_naive, fleet_forecast, week_history,
+                            _flat_backtest, _seasonal_backtest)
+from hr_series import HrSeries, NUM_SLOTS
+
+nan = np.nan
+
+
+def test_rolling_sma_skips_missing_slots():
+    assert np.allclose(rolling_sma([[1, 2, nan, 4, 5, 6]], 3), [[1, 1.5, 1.5, 3, 4.5, 5]])
+    assert np.allclose(rolling_sma([[nan, nan, 3]], 2), [[nan, nan, 3]], equal_nan=True)
+
+
+def test_rolling_ewma_carries_the_level_over_gaps():
+    # alpha 0.5: 2, then 2 again over the gap, then (0.25 * 2 + 0.5 * 4) / (0.25 * 0.5 + 0.5)
+    assert np.allclose(rolling_ewma([[2, nan, 4]], 0.5), [[2, 2, 3.6]])
+
+
+def test_seasonal_naive_repeats_the_last_season():
+    assert np.allclose(seasonal_naive([[1, 2, 3, 4, 5, 6]], 4, season=3), [[4, 5, 6, 4]])
+    # Less than a season of history: the first step has nothing to repeat
+    assert np.allclose(seasonal_naive([[1, 2, 3]], 2, season=4), [[nan, 1]], equal_nan=True)
+
+
+def test_backtests():
+    Y = np.array([[1.0, 2, 3]])
+    assert np.allclose(_flat_backtest(Y, Y, 1), [1])
+    assert np.allclose(_flat_backtest(Y, Y, 2), [4 / 3])  # |2-1|, |3-2| and |3-1|
+    assert np.allclose(_seasonal_backtest(np.array([[1, 2, nan, 2, 4, 6]]), 3), [1.5])
+    assert np.isnan(_seasonal_backtest(Y, 3)).all()
+
+
+def test_periodic_history_picks_seasonal_naive():
+    result = fleet_forecast([[1, 5, 9] * 3, [70, 71, 70, 71, 70, 71, 70, 71, 70]], horizon=3, season=3)
+    assert METHODS[result['best'][0]] == 'seasonal_naive'
+    assert np.allclose(result['forecasts']['seasonal_naive'][0], [1, 5, 9])
+    assert METHODS[result['best'][1]] != 'seasonal_naive'
+
+
+def test_week_history_ends_at_the_origin():
+    series = HrSeries()
+    series.set(0, 60)
+    series.set(5, 65)
+    history = week_history(series, 5)
+    assert history.shape == (NUM_SLOTS,)
+    assert history[-1] == 65 and history[-6] == 60 and np.isnan(history[0])
@@ -0,0 +1,18 @@
+import numpy as np
+from hr_series import HrSeries, NUM_SLOTS
+from forecast_job import forecast_shard
+
+
+def test_forecast_shard_forecasts_every_user():
+    rng = np.random.default_rng(0)
+    shard = []
+    for i in range(2):
+        values = np.full(NUM_SLOTS, np.nan, dtype=np.float32)
+        values[:96] = 70 + 5 * np.sin(np.arange(96) / 8) + rng.normal(0, 2, 96)
+        shard.append((f"user-{i}", HrSeries(values)))
+
+    results = forecast_shard(shard, 10)
+
+    assert [error for _, _, error in results] == [None, None]
+    for _, forecast, _ in results:
+        assert len(forecast) == 10 and np.isfinite(forecast.to_numpy()).all()
@@ -0,0 +1,67 @@
+from datetime import datetime
+import numpy as np
+from pymongo.errors import BulkWriteError
+from hr_series import HrSeries, SLOT_KEYS
+from measurement_store import (MIGRATED_FIELD, ensure_measurement_indexes, legacy_buckets, _merge_bucket,
+                               measurement_update, migrate_legacy_slots)
+import repository
+
+WEEK = datetime(2024, 1, 1)
+
+
+def test_interrupted_migration_is_completed_without_duplicates(mongo):
+    ensure_measurement_indexes()
+    slots = {SLOT_KEYS[i]: 60 + i % 40 for i in range(0, 336, 7)}
+    user_id = repository.users_collection().insert_one({'Name': 'ann', **slots}).inserted_id
+    buckets = legacy_buckets(user_id, HrSeries.from_legacy(slots), WEEK)
+
+    # An earlier run wrote two buckets and died before the rest
+    repository.heart_rate_collection().bulk_write(
+        [_merge_bucket(bucket, f"legacy-slots-{WEEK:%Y-%m-%d}") for bucket in buckets[:2]])
+    assert repository.users_collection().find_one({'_id': user_id}).get(MIGRATED_FIELD) is None
+
+    assert migrate_legacy_slots(WEEK) == 1
+    stored = list(repository.heart_rate_collection().find({'user_id': user_id}).sort('day', 1))
+    assert [b['count'] for b in stored] == [b['count'] for b in buckets]
+    assert np.concatenate([b['bpm'] for b in stored]).tolist() == np.concatenate([b['bpm'] for b in buckets]).tolist()
+    assert repository.users_collection().find_one({'_id': user_id})[MIGRATED_FIELD] == WEEK
+
+    # Marked users are skipped
+    assert migrate_legacy_slots(WEEK) == 0
+
+
+class RacingCollection:
+    """heart_rate collection where a live measurement creates the first bucket's day during the first bulk write."""
+
+    def __init__(self, collection, user_id, when):
+        self.collection = collection
+        self.user_id = user_id
+        self.when = when
+        self.raced = False
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, operations, ordered=True):
+        if self.raced:
+            return self.collection.bulk_write(operations, ordered=ordered)
+        self.raced = True
+        self.collection.bulk_write([measurement_update(self.user_id, self.when, 99.0)])
+        self.collection.bulk_write(operations[1:], ordered=ordered)
+        # The first upsert tried to insert the day at the same moment and lost
+        raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'E11000 duplicate key',
+                                               'op': operations[0]}]})
+
+
+def test_upsert_that_lost_a_race_with_a_live_write_is_merged(mongo, monkeypatch):
+    ensure_measurement_indexes()
+    slots = {SLOT_KEYS[i]: 70 for i in range(0, 336, 7)}
+    user_id = repository.users_collection().insert_one({'Name': 'ann', **slots}).inserted_id
+    buckets = legacy_buckets(user_id, HrSeries.from_legacy(slots), WEEK)
+    racing = RacingCollection(repository.heart_rate_collection(), user_id, buckets[0]['day'])
+    monkeypatch.setattr(repository, 'heart_rate_collection', lambda: racing)
+
+    assert migrate_legacy_slots(WEEK) == 1
+    first_day = racing.collection.find_one({'user_id': user_id, 'day': buckets[0]['day']})
+    assert first_day['count'] == buckets[0]['count'] + 1
+    assert sorted(first_day['bpm']) == sorted(buckets[0]['bpm'] + [99.0])
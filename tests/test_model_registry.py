@@ -0,0 +1,25 @@
+import numpy as np
+from model_registry import Reservoir, cohort_key
+
+
+def test_reservoir_grows_to_its_size_and_samples_uniformly():
+    rng = np.random.default_rng(0)
+    small = Reservoir(50000, 2, rng)
+    small.add(np.ones((300, 2)))
+    assert len(small.rows) < 50000
+    assert small.sample().shape == (300, 2)
+
+    reservoir = Reservoir(2000, 1, rng)
+    for start in range(0, 100000, 700):
+        reservoir.add(np.arange(start, min(start + 700, 100000), dtype=float)[:, None])
+    sample = reservoir.sample()[:, 0]
+    assert len(reservoir.rows) == 2000 and len(sample) == 2000
+    assert len(np.unique(sample)) == 2000
+    assert abs(sample.mean() - 50000) < 2500  # Uniform over the stream, not biased to its start
+
+
+def test_cohort_key_keeps_children_out_of_the_oldest_cohort():
+    assert cohort_key({'Age': 35, 'Gender': 'male', 'Heart Problems': False}) == '30-40_male_False'
+    assert cohort_key({'Age': 95, 'Gender': 'female', 'Heart Problems': True}) == '90+_female_True'
+    assert cohort_key({'Age': 7, 'Gender': 'female', 'Heart Problems': False}) == 'unknown_female_False'
+    assert cohort_key({'Gender': 'other'}) == 'unknown_unknown_None'
@@ -0,0 +1,49 @@
+import pytest
+from pymongo import ReturnDocument
+from hr_series import SLOT_KEYS, HrSeries
+from online_anomaly import OnlineAnomalyDetector, score_and_commit
+import repository
+
+
+def _set_slot_returning_previous(user, index, value, extra=None):
+    # mongomock cannot evaluate the aggregation projection, so the totals are computed here
+    doc = repository.users_collection().find_one_and_update(
+        repository.user_query(user), {'$set': {SLOT_KEYS[index]: value, **(extra or {})}},
+        return_document=ReturnDocument.BEFORE)
+    if doc is None:
+        return None
+    values = HrSeries.from_document(doc).present_values()
+    return {'_id': doc['_id'], 'previous': doc.get(SLOT_KEYS[index]),
+            'totals': {'sum': float(values.sum()), 'count': len(values)}}
+
+
+@pytest.fixture
+def users(mongo, monkeypatch):
+    monkeypatch.setattr(repository, 'set_slot_returning_previous', _set_slot_returning_previous)
+    collection = repository.users_collection()
+    collection.insert_one({'Name': 'ann', 'Age': 30, 'Gender': 'female', SLOT_KEYS[10]: 72, SLOT_KEYS[11]: 74})
+    return collection
+
+
+def test_new_value_is_scored_against_the_week_before_it_is_written(users):
+    # No persisted anomaly_state: the detector seeds itself from the stored week
+    detector = OnlineAnomalyDetector()
+    result, doc = score_and_commit(detector, 'ann', 'ann', 10, 180)
+
+    assert result['is_anomaly']
+    assert result['expected'] == 72
+    assert doc['previous'] == 72
+    assert users.find_one({'Name': 'ann'})[SLOT_KEYS[10]] == 180
+
+
+def test_unknown_user(users):
+    result, doc = score_and_commit(OnlineAnomalyDetector(), 'bob', 'bob', 10, 180)
+    assert result is None and doc is None
+
+
+def test_robust_score_ignores_a_single_outlier(users):
+    detector = OnlineAnomalyDetector(warmup=3)
+    for value in (70, 72, 71, 73, 180, 72):
+        detector.update('ann', 10, value, persist=False)
+    assert not detector.score('ann', 10, 74)['is_anomaly']
+    assert detector.score('ann', 10, 150)['is_anomaly']
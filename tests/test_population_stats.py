@@ -0,0 +1,36 @@
+from hr_series import HrSeries, SLOT_KEYS
+from population_stats import slot_change_operations, rebuild_population_stats, read_population_stats
+import repository
+
+
+def _cohorts():
+    return {doc['_id']: doc for doc in repository.population_stats_collection().find({}, {'applied': 0})}
+
+
+def test_slot_change_operations_match_a_rebuild(mongo):
+    users = repository.users_collection()
+    users.insert_one({'Name': 'ann', 'Age': 30, 'Gender': 'female', 'Heart Problems': False,
+                      SLOT_KEYS[0]: 60, SLOT_KEYS[1]: 70})
+    users.insert_one({'Name': 'bob', 'Age': 70, 'Gender': 'male', 'Heart Problems': True, SLOT_KEYS[0]: 80})
+    rebuild_population_stats()
+
+    # Replace one of ann's values and fill an empty slot of bob's, as update_heart_rate_in_db does
+    operations = []
+    for name, index, value in (('ann', 1, 90), ('bob', 5, 100)):
+        doc = users.find_one({'Name': name})
+        values = HrSeries.from_document(doc).present_values()
+        operations += slot_change_operations(doc, doc.get(SLOT_KEYS[index]), value, float(values.sum()), len(values))
+        users.update_one({'_id': doc['_id']}, {'$set': {SLOT_KEYS[index]: value}})
+    repository.population_stats_collection().bulk_write(operations)
+    incremental = _cohorts()
+
+    rebuild_population_stats()
+    rebuilt = _cohorts()
+    assert incremental.keys() == rebuilt.keys()
+    for cohort, doc in rebuilt.items():
+        for field, value in doc.items():
+            if isinstance(value, float):
+                assert abs(incremental[cohort][field] - value) < 1e-6, (cohort, field)
+            else:
+                assert incremental[cohort][field] == value, (cohort, field)
+    assert read_population_stats()['overall'] == {'mean': 82.5, 'count': 4}
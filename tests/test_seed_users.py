@@ -0,0 +1,37 @@
+import numpy as np
+from hr_series import NUM_SLOTS, SLOT_KEYS
+from seed_users import week_heart_rates, generate_users, seed_users
+import repository
+
+
+def test_heart_rate_ranges_follow_the_new_user_rules():
+    rng = np.random.default_rng(0)
+    #            (age, gender, smoking, heart problems, activity) -> inclusive range
+    cases = [((10, 'male', False, False, 1), (70, 110)),
+             ((30, 'male', False, False, 1), (60, 100)),
+             ((30, 'female', False, False, 1), (70, 110)),
+             ((70, 'female', False, False, 1), (50, 90)),
+             ((3, 'male', False, False, 1), (60, 100)),
+             ((30, 'male', True, False, 1), (80, 120)),
+             ((70, 'male', False, True, 1), (80, 120)),
+             ((30, 'male', False, False, 4), (65, 105)),
+             ((30, 'female', True, False, 5), (90, 130))]
+    profiles = list(zip(*[profile for profile, _ in cases]))
+    rates = week_heart_rates(rng, *[np.array(column) for column in profiles])
+
+    assert rates.shape == (len(cases), NUM_SLOTS)
+    for row, (_, (low, high)) in zip(rates, cases):
+        assert row.min() == low and row.max() == high
+
+
+def test_injected_anomalies_are_labelled():
+    docs = generate_users(np.random.default_rng(1), 0, 50, anomaly_rate=0.05, labels=True)
+    labels = np.array([[doc[f"{key}_label"] for key in SLOT_KEYS] for doc in docs])
+    assert 0.03 < labels.mean() < 0.07
+    assert [doc['Name'] for doc in docs[:2]] == ['seed-user-0000000', 'seed-user-0000001']
+
+
+def test_seeding_twice_skips_existing_names(mongo):
+    assert seed_users(120, chunk_size=50, seed=0) == 120
+    assert seed_users(130, chunk_size=50, seed=0) == 10
+    assert repository.users_collection().count_documents({}) == 130
@@ -0,0 +1,38 @@
+from user_directory import UserDirectory
+import repository
+
+
+def test_directory_follows_writes(mongo):
+    users = repository.users_collection()
+    users.insert_one({'Name': 'Anna', 'Age': 30})
+    directory = UserDirectory()
+    directory.load()
+    assert directory.complete('an') == ['Anna']
+
+    # A user created through the app is added without reloading
+    profile = {'Name': 'Andy', 'Age': 40}
+    users.insert_one(profile)
+    directory.add(profile)
+    assert directory.complete('an') == ['Andy', 'Anna']
+    assert directory.user_id('Andy') == profile['_id']
+
+    # A user removed elsewhere is dropped from the cache and the trie
+    users.delete_one({'Name': 'Andy'})
+    directory.invalidate('Andy', removed=True)
+    assert directory.user_id('Andy') == 'Andy'
+    assert directory.lookup('Andy') is None
+    assert directory.complete('an') == ['Anna']
+
+
+def test_existence_is_answered_from_the_trie_once_loaded(mongo):
+    repository.users_collection().insert_one({'Name': 'Anna', 'Age': 30})
+    directory = UserDirectory()
+    assert directory.known('Anna') is None  # Not loaded yet: ask the database
+    directory.load()
+    assert directory.known('Anna') is True
+    assert directory.known('Bob') is False
+
+    # Created by another client after load(): found by a lookup, which teaches the trie
+    repository.users_collection().insert_one({'Name': 'Bob', 'Age': 50})
+    assert directory.lookup('Bob')['Age'] == 50
+    assert directory.known('Bob') is True
@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import AutoReconnect, OperationFailure
+from measurement_store import ensure_measurement_indexes, measurement_update
+from population_stats import slot_change_operations, rebuild_population_stats
+from write_behind import WriteBehindQueue
+import repository
+
+
+class FlakyCollection:
+    """Collection whose first `failures` bulk writes raise AutoReconnect, after applying them if `applied`."""
+
+    def __init__(self, collection, failures=1, applied=True):
+        self.collection = collection
+        self.name = collection.name
+        self.full_name = collection.full_name
+        self.failures = failures
+        self.applied = applied
+
+    def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            if self.applied:
+                self.collection.bulk_write(operations, ordered=ordered)  # Applied, but the reply is lost
+            raise AutoReconnect('connection reset')
+        return self.collection.bulk_write(operations, ordered=ordered)
+
+
+class BrokenCollection(FlakyCollection):
+    """Collection whose bulk writes fail with an error that is not worth retrying."""
+
+    def bulk_write(self, operations, ordered=True):
+        raise OperationFailure('document failed validation', code=121)
+
+
+@pytest.fixture
+def store(mongo):
+    ensure_measurement_indexes()
+    profile = {'Name': 'ann', 'Age': 30, 'Gender': 'female', 'Heart Problems': False}
+    profile['_id'] = repository.users_collection().insert_one(dict(profile)).inserted_id
+    rebuild_population_stats()
+    return profile
+
+
+def _operations(profile, bpm=80.0, cohort_failures=1):
+    # One measurement as update_heart_rate_in_db queues it: a bucket append and the cohort updates
+    write_id = ObjectId()
+    buckets = FlakyCollection(repository.heart_rate_collection())
+    cohorts = FlakyCollection(repository.population_stats_collection(), cohort_failures)
+    items = [(buckets, measurement_update(profile['_id'], datetime(2024, 1, 1, 8, 0), bpm, write_id))]
+    items += [(cohorts, operation) for operation in slot_change_operations(profile, None, bpm, 0.0, 0, write_id)]
+    return items
+
+
+def _counts():
+    bucket = repository.heart_rate_collection().find_one({})
+    overall = repository.population_stats_collection().find_one({'_id': 'overall'})
+    return bucket['count'], len(bucket['bpm']), overall['count'], overall['sum']
+
+
+def test_retried_batch_is_applied_once(store):
+    async def scenario():
+        queue = WriteBehindQueue(flush_interval=0.01, retry_delay=0.01).start()
+        for collection, operation in _operations(store):
+            await queue.put(collection, operation)
+        await queue.close()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert _counts() == (1, 1, 1, 80.0)
+    assert queue.retries == 2 and queue.failed == 0
+
+
+def test_batch_cancelled_during_backoff_is_written_at_exit(store):
+    items = _operations(store, cohort_failures=0)
+    items[0][0].applied = False
+
+    async def scenario():
+        queue = WriteBehindQueue(flush_interval=0.01, retry_delay=60).start()
+        for collection, operation in items:
+            await queue.put(collection, operation)
+        while queue.retries == 0:
+            await asyncio.sleep(0.01)
+        queue._task.cancel()  # Shutting down while the flusher waits to retry
+        with pytest.raises(asyncio.CancelledError):
+            await queue._task
+        queue._task = None
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert repository.heart_rate_collection().find_one({}) is None
+    queue.flush_sync()
+    assert _counts() == (1, 1, 1, 80.0)
+
+
+def test_failed_write_does_not_stop_the_flusher(store):
+    broken = BrokenCollection(repository.heart_rate_collection())
+
+    async def scenario():
+        queue = WriteBehindQueue(flush_interval=0.01, max_pending=2).start()
+        await queue.put(broken, measurement_update(store['_id'], datetime(2024, 1, 1, 7, 0), 70.0))
+        await asyncio.wait_for(queue._queue.join(), 5)
+        for collection, operation in _operations(store, cohort_failures=0):
+            collection.failures = 0
+            await asyncio.wait_for(queue.put(collection, operation), 5)
+        await asyncio.wait_for(queue.close(), 5)
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert _counts() == (1, 1, 1, 80.0)
+    assert queue.failed == 1 and queue.retries == 0
@@ -0,0 +1,148 @@
+import threading
+from collections import OrderedDict
+from bson.objectid import ObjectId
+import repository
+
+# user_directory.py
+# In-process view of who exists. Every user name lives in a prefix trie, so the
+# name field can autocomplete and check names locally while the user types, and
+# looked-up profiles are cached by name so repeated lookups skip the database.
+# Writes that change a profile go through add() / invalidate() to keep both in step.
+
+
+class _TrieNode:
+    __slots__ = ('children', 'names')
+
+    def __init__(self):
+        self.children = {}
+        self.names = None  # Original spellings of the names that end here
+
+
+class PrefixTrie:
+    """Case-insensitive prefix trie of names."""
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self.size = 0
+
+    def _node(self, prefix):
+        node = self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def add(self, name):
+        node = self.root
+        for char in name.lower():
+            node = node.children.setdefault(char, _TrieNode())
+        if node.names is None:
+            node.names = set()
+        if name not in node.names:
+            node.names.add(name)
+            self.size += 1
+
+    def remove(self, name):
+        node = self._node(name)
+        if node is not None and node.names and name in node.names:
+            node.names.discard(name)
+            self.size -= 1
+
+    def __contains__(self, name):
+        node = self._node(name)
+        return node is not None and bool(node.names) and name in node.names
+
+    def complete(self, prefix, limit=5):
+        """Up to `limit` names starting with `prefix`, shortest and then alphabetically first."""
+        start = self._node(prefix)
+        if start is None:
+            return []
+        results = []
+        level = [start]
+        # Breadth-first, so shorter completions come first and the walk stops early
+        while level and len(results) < limit:
+            next_level = []
+            for node in level:
+                if node.names:
+                    results.extend(sorted(node.names))
+                next_level.extend(node.children[char] for char in sorted(node.children))
+            level = next_level
+        return results[:limit]
+
+
+class UserDirectory:
+    """Name trie for autocomplete plus an LRU cache of name -> profile (with _id)."""
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.trie = PrefixTrie()
+        self.loaded = False
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()  # load() runs in a worker thread
+
+    def load(self, batch_size=5000):
+        """Read every user name (only the indexed Name field) into the trie."""
+        trie = PrefixTrie()
+        for doc in repository.iter_users({'Name': 1, '_id': 0}, batch_size=batch_size):
+            if doc.get('Name'):
+                trie.add(doc['Name'])
+        with self._lock:
+            # Users created while loading are cached, so they are kept
+            for name in self._profiles:
+                trie.add(name)
+            self.trie = trie
+            self.loaded = True
+        return trie.size
+
+    def complete(self, prefix, limit=5):
+        if not prefix:
+            return []
+        with self._lock:
+            return self.trie.complete(prefix, limit)
+
+    def known(self, name):
+        """True/False once the names are loaded; None while it cannot be decided locally."""
+        with self._lock:
+            if name in self.trie:
+                return True
+            return False if self.loaded else None
+
+    def lookup(self, name):
+        """Profile of a user by name, from the cache or one indexed query; None if there is no such user."""
+        with self._lock:
+            profile = self._profiles.get(name)
+            if profile is not None:
+                self._profiles.move_to_end(name)
+                return profile
+        # Not trusting a trie miss: another client may have created the user since load()
+        profile = repository.find_profile(name)
+        if profile is not None:
+            self._remember(profile)
+        return profile
+
+    def user_id(self, name):
+        """Cached ObjectId of a user, or the name itself for repository queries when it is not cached."""
+        with self._lock:
+            profile = self._profiles.get(name)
+        return profile['_id'] if profile is not None and isinstance(profile.get('_id'), ObjectId) else name
+
+    def _remember(self, profile):
+        with self._lock:
+            self._profiles[profile['Name']] = profile
+            self._profiles.move_to_end(profile['Name'])
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+            self.trie.add(profile['Name'])
+
+    def add(self, profile):
+        """Record a newly created user (the inserted document, with its _id)."""
+        profile = {field: profile[field] for field in ['_id', *repository.PROFILE_FIELDS] if field in profile}
+        self._remember(profile)
+
+    def invalidate(self, name, removed=False):
+        """Drop a cached profile after it changed; `removed` also takes the name out of the trie."""
+        with self._lock:
+            self._profiles.pop(name, None)
+            if removed:
+                self.trie.remove(name)
@@ -0,0 +1,221 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from pymongo.errors import AutoReconnect, BulkWriteError, ConnectionFailure, NetworkTimeout
+
+# write_behind.py
+# Buffers MongoDB write operations on the event loop and persists them in
+# batches: a batch is flushed when it reaches `max_batch` operations or when
+# its oldest operation has waited `flush_interval` seconds. Each flush is one
+# unordered bulk_write per collection, run in a worker thread so the loop never
+# blocks on the network. The buffer is bounded: put() waits while it is full,
+# which slows producers down instead of growing memory without limit.
+#
+# After a network error a batch is sent again, although the server may have
+# applied it, so queued operations must be idempotent: an $inc or $push upsert
+# carries a write id in its filter (see measurement_update), and once applied
+# it no longer matches and fails with a duplicate key instead of applying twice.
+
+# Errors worth retrying: the server or network went away, the operations themselves are fine
+TRANSIENT_ERRORS = (AutoReconnect, ConnectionFailure, NetworkTimeout)
+DUPLICATE_KEY = 11000
+
+
+def bulk_write_idempotent(collection, operations):
+    """Unordered bulk_write that counts already applied operations as written; returns the other write errors.
+
+    Operations that fail with a duplicate key are sent once more: an upsert
+    that lost a race to create its document succeeds then, while one that was
+    already applied fails the same way again and is done. Each returned error's
+    'index' is the position of its operation in `operations`.
+    """
+    try:
+        collection.bulk_write(operations, ordered=False)
+        return []
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+    resent = [error['index'] for error in errors if error.get('code') == DUPLICATE_KEY]
+    errors = [error for error in errors if error.get('code') != DUPLICATE_KEY]
+    if resent:
+        try:
+            collection.bulk_write([operations[index] for index in resent], ordered=False)
+        except BulkWriteError as e:
+            errors += [dict(error, index=resent[error['index']]) for error in e.details.get('writeErrors', [])
+                       if error.get('code') != DUPLICATE_KEY]
+    return errors
+
+
+class WriteBehindQueue:
+    """Asyncio write-behind buffer of (collection, operation) pairs flushed as unordered bulk writes."""
+
+    def __init__(self, max_batch=500, flush_interval=1.0, max_pending=10000, max_retries=5, retry_delay=0.5,
+                 executor=None):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay  # doubled after every failed attempt
+        self._executor = executor
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._task = None
+        self._collecting = None  # Batch the flusher is still filling, so a shutdown flush can write it too
+        self._in_flight = []  # Items of the batch being written that are not confirmed yet
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+        self._latencies = deque(maxlen=100)
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+        self.retries = 0
+
+    def start(self):
+        """Start the background flusher on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def put(self, collection, operation):
+        """Queue one pymongo write operation (UpdateOne, InsertOne, ...); waits while the buffer is full."""
+        if self._closed:
+            raise RuntimeError('Write-behind queue is closed')
+        await self._queue.put((collection, operation))
+
+    def depth(self):
+        """Operations waiting to be written."""
+        return self._queue.qsize()
+
+    def stats(self):
+        latencies = list(self._latencies)
+        return {
+            'depth': self.depth(),
+            'flushed': self.flushed,
+            'failed': self.failed,
+            'batches': self.batches,
+            'retries': self.retries,
+            'last_flush_ms': latencies[-1] * 1000 if latencies else None,
+            'mean_flush_ms': sum(latencies) / len(latencies) * 1000 if latencies else None,
+            'max_flush_ms': max(latencies) * 1000 if latencies else None,
+        }
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            # Items handed back by a cancelled write go out with the next batch
+            batch = self._collecting = (self._collecting or []) + [first]
+            deadline = time.monotonic() + self.flush_interval
+            # Keep collecting until the batch is full or the oldest item has waited long enough
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._collecting = None
+            await self._write(batch)
+
+    def _drain(self):
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+    async def _write(self, batch):
+        async with self._flush_lock:
+            per_collection = defaultdict(list)
+            collections = {}
+            for collection, operation in batch:
+                per_collection[collection.full_name].append(operation)
+                collections[collection.full_name] = collection
+
+            loop = asyncio.get_running_loop()
+            started = time.monotonic()
+            self._in_flight = list(batch)
+            try:
+                for name, operations in per_collection.items():
+                    try:
+                        await self._write_with_retries(loop, collections[name], operations)
+                    except Exception as e:
+                        # Not worth retrying (a rejected or unencodable operation, a server error): drop these
+                        # writes but keep the flusher running, so flush() and put() never wait on them
+                        self.failed += len(operations)
+                        print(f"Write-behind: {len(operations)} writes to {collections[name].name} failed: {e}")
+                    self._in_flight = [item for item in self._in_flight if item[0].full_name != name]
+            except asyncio.CancelledError:
+                # Cancelled mid-write or during a retry backoff: hand the unconfirmed items back so
+                # the flusher or flush_sync writes them (re-sending them is safe, they are idempotent)
+                if self._collecting is not None:
+                    self._collecting[:0] = self._in_flight
+                else:
+                    self._collecting = self._in_flight
+                self._in_flight = []
+                raise
+            self._in_flight = []
+            self._latencies.append(time.monotonic() - started)
+            self.batches += 1
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _write_with_retries(self, loop, collection, operations):
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                errors = await loop.run_in_executor(self._executor, bulk_write_idempotent, collection, operations)
+                # Unordered: everything except the reported operations was applied; those are not retried
+                self.flushed += len(operations) - len(errors)
+                self.failed += len(errors)
+                if errors:
+                    print(f"Write-behind: {len(errors)} of {len(operations)} writes to {collection.name} failed: "
+                          f"{errors[0].get('errmsg')}")
+                return
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    self.failed += len(operations)
+                    print(f"Write-behind: giving up on {len(operations)} writes to {collection.name}: {e}")
+                    return
+                self.retries += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def flush(self):
+        """Write everything queued so far, now."""
+        items = self._drain()
+        for start in range(0, len(items), self.max_batch):
+            await self._write(items[start:start + self.max_batch])
+
+    async def close(self):
+        """Stop accepting writes, flush what is buffered and stop the flusher."""
+        self._closed = True
+        await self.flush()
+        if self._task is not None:
+            # The flusher finishes the batch it is filling; then every queued item is done
+            await self._queue.join()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def flush_sync(self):
+        """Blocking flush for shutdown paths that cannot await (e.g. an exit handler)."""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        items = self._in_flight + (self._collecting or []) + self._drain()
+        self._in_flight = []
+        self._collecting = None
+        per_collection = defaultdict(list)
+        collections = {}
+        for collection, operation in items:
+            per_collection[collection.full_name].append(operation)
+            collections[collection.full_name] = collection
+        for name, operations in per_collection.items():
+            try:
+                errors = bulk_write_idempotent(collections[name], operations)
+                self.flushed += len(operations) - len(errors)
+                self.failed += len(errors)
+            except Exception as e:
+                self.failed += len(operations)
+                print(f"Write-behind: {len(operations)} writes to {name} lost at shutdown: {e}")